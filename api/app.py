@@ -1,33 +1,53 @@
 import sys
 import os
-<<<<<<< HEAD
 import socket
-=======
-import uuid
-import json
-import base64
-import sqlite3
-from flask import Flask, request, jsonify
-from dotenv import load_dotenv
-import pika
->>>>>>> main
 
 # Add the project root to Python path
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
-from shared.config import RABBITMQ_HOST, RABBITMQ_PORT, RABBITMQ_QUEUE
-<<<<<<< HEAD
-
+from shared.config import (
+    UPLOAD_DIR, BATCH_MAX_ITEMS, BATCH_MAX_ARCHIVE_BYTES, RESULT_WAIT_MAX_SECONDS,
+    UPLOAD_MAX_BYTES, UPLOAD_CHUNK_SIZE
+)
+from shared.rabbitmq import (
+    RabbitMQPublisher, PublishError, job_queue, PRIORITY_INTERACTIVE, PRIORITY_BULK
+)
+from shared.result_events import ResultListener
+from shared.admission import AdmissionController, Overloaded
+from shared.image_quality import check_image, ImageRejected
+from shared.metrics import REGISTRY, render, read_snapshots
+from shared.result_cache import ResultCache, digest_cache_key
+from database import (
+    init_db, save_result_to_db, get_result as get_stored_result,
+    create_batch, get_batch_progress, get_batch_results, search_results, iter_result_rows,
+    delete_results, release_connection, SEARCH_FIELDS, EXPORT_COLUMNS
+)
+from storage import upload_path, write_result_file, read_result_file, delete_result_file
+
+import io
+import csv
 import uuid
+import atexit
 import json
+import time
 import base64
-import pika
-from flask import Flask, request, jsonify, render_template
+import hashlib
+import zipfile
+import binascii
+import tempfile
+import mimetypes
+from flask import Flask, Response, g, request, jsonify, render_template, stream_with_context
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Initialize database
+init_db()
+
+# Results of previously processed identical images
+result_cache = ResultCache()
+
 
 # Función para encontrar un puerto disponible
 def find_free_port():
@@ -43,31 +63,203 @@ def find_free_port():
 app = Flask(__name__,
             template_folder=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'templates'),
             static_folder=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static'))
-=======
-from database import init_db, DB_PATH 
-# Load environment variables
-load_dotenv()
-
-# Initialize database
-init_db() 
-
-app = Flask(__name__)
->>>>>>> main
 
 # Create required directories
-UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'uploads')
-RESULT_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'resultados')
+UPLOAD_FOLDER = UPLOAD_DIR
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(RESULT_FOLDER, exist_ok=True)
 
+# Image extensions accepted inside batch uploads
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff'}
+
+# Search results per request (default and maximum)
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 200
+# Rows read from the database per export query
+EXPORT_PAGE_SIZE = 1000
+
+
+# Long-lived RabbitMQ publisher shared by all request threads
+publisher = RabbitMQPublisher()
+atexit.register(publisher.close)
+
+# Job completion events from the workers, for SSE and long-poll requests.
+# Started on the first request that waits for a result.
+result_listener = ResultListener()
+
+# Queue depth, service time and estimated wait; sheds uploads under overload
+admission = AdmissionController(stats_source=publisher.queues_stats)
+
+# API metrics
+REQUEST_SECONDS = REGISTRY.histogram('ocr_api_request_duration_seconds', 'API request latency')
+QUEUE_DEPTH = REGISTRY.gauge('ocr_queue_depth', 'Messages waiting in each OCR job queue')
+QUEUE_CONSUMERS = REGISTRY.gauge('ocr_queue_consumers', 'Consumers attached to each OCR job queue')
+JOBS_QUEUED = REGISTRY.counter('ocr_api_jobs_queued_total', 'Jobs published to the broker, by priority')
+CACHE_STATS = REGISTRY.gauge('ocr_api_cache', 'Result cache counters of the API process')
+
+def collect_api_metrics():
+    # Queue depth is read from the broker at most every ADMISSION_STATS_TTL
+    for queue, (depth, consumers) in admission.queue_stats().items():
+        QUEUE_DEPTH.set(depth, queue=queue)
+        QUEUE_CONSUMERS.set(consumers, queue=queue)
+    for priority in (PRIORITY_INTERACTIVE, PRIORITY_BULK):
+        admission.estimated_wait(priority)
+
+    stats = result_cache.stats()
+    for name in ("hits", "misses", "evictions", "entries"):
+        CACHE_STATS.set(stats[name], counter=name)
+
+
+REGISTRY.add_collector(collect_api_metrics)
+
+# Seconds between database re-checks (and SSE keep-alives) while waiting
+WAIT_CHECK_INTERVAL = 15
+WAIT_CHECK_INTERVAL_DISCONNECTED = 2
+
+
+def save_cached_result(job_id, cached_result):
+    """Store a cache hit as a completed job so /resultado serves it"""
+    result_data = dict(cached_result)
+    result_data["job_id"] = job_id
+    result_data["status"] = "completado"
+    result_data["processed_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    result_data["cached"] = True
+
+    write_result_file(result_data)
+    save_result_to_db(result_data)
+    return result_data
+
+
+def discard_cached_results(job_ids):
+    """Undo save_cached_result() for the jobs of an aborted batch"""
+    if not job_ids:
+        return
+    try:
+        delete_results(job_ids)
+        for job_id in job_ids:
+            delete_result_file(job_id)
+    except Exception as e:
+        print(f"Failed to discard cached results of an aborted batch: {e}")
+
+
+def save_rejected_result(job_id, error):
+    """Store a batch image rejected by the quality gate as a failed job"""
+    result_data = {
+        "job_id": job_id,
+        "status": "error",
+        "error": error,
+        "processed_at": time.strftime("%Y-%m-%d %H:%M:%S")
+    }
+    write_result_file(result_data)
+    save_result_to_db(result_data)
+
+
+class UploadTooLarge(ValueError):
+    """The uploaded image is bigger than UPLOAD_MAX_BYTES"""
+
+
+def iter_stream_chunks(stream, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Read a file-like object in chunks"""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_base64_chunks(text, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Decode a base64 string piece by piece instead of all at once"""
+    if text.startswith('data:') and ',' in text[:100]:
+        # data:image/png;base64,...
+        text = text.split(',', 1)[1]
+    if any(whitespace in text for whitespace in ('\n', '\r', ' ', '\t')):
+        text = ''.join(text.split())
+    step = chunk_size // 3 * 4  # a multiple of 4 characters decodes on its own
+    for start in range(0, len(text), step):
+        yield base64.b64decode(text[start:start + step], validate=True)
+
+
+def store_upload(chunks, max_bytes=UPLOAD_MAX_BYTES):
+    """
+    Write an upload to a temporary file in the upload folder, hashing it
+    on the way, so the whole image is never held in memory.
+    Returns (temp_path, sha256_hexdigest).
+    """
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=UPLOAD_FOLDER, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Image is too large (max {max_bytes} bytes)")
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return temp_path, digest.hexdigest()
+
+
+def accept_image(chunks, extension):
+    """
+    Register one uploaded image (an iterable of byte chunks) as a new job.
+
+    Returns (job_id, cached_result, message): cached_result is the stored
+    result when an identical image was already processed, otherwise the
+    image is kept in the upload folder and message is the queue payload.
+    Raises UploadTooLarge, ImageRejected for an image that fails the
+    quality gate, or ValueError for undecodable base64.
+    """
+    temp_path, image_digest = store_upload(chunks)
+    job_id = str(uuid.uuid4())
+
+    # An identical image was already processed: no need to queue it
+    cached_result = result_cache.get(digest_cache_key(image_digest))
+    if cached_result is not None:
+        try:
+            result = save_cached_result(job_id, cached_result)
+            os.remove(temp_path)
+            return job_id, result, None
+        except Exception as e:
+            print(f"Failed to store cached result for job {job_id}: {e}")
+
+    # Unusable photos are turned away here instead of costing a model request
+    try:
+        check_image(temp_path)
+    except ImageRejected:
+        os.remove(temp_path)
+        raise
+
+    filename = upload_path(job_id, extension)
+    os.replace(temp_path, filename)
 
-# RabbitMQ connection
-def get_rabbitmq_connection():
-    return pika.BlockingConnection(pika.ConnectionParameters(
-        host=RABBITMQ_HOST,
-        port=RABBITMQ_PORT
-    ))
+    return job_id, None, {"job_id": job_id, "filename": filename}
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.teardown_appcontext
+def release_db_connection(exception=None):
+    # Request threads are short-lived: their connection goes back to the pool
+    release_connection()
+
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop('request_started', None)
+    if started is not None and request.url_rule is not None:
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            endpoint=request.url_rule.rule,
+            method=request.method,
+            status=response.status_code
+        )
+    return response
 
 
 @app.route('/')
@@ -76,129 +268,495 @@ def index():
     return render_template('index.html')
 
 
+def overloaded_response(error):
+    """429/503 answer for an upload turned away by admission control"""
+    return jsonify({
+        "error": str(error),
+        "retry_after": error.retry_after
+    }), error.status_code, {"Retry-After": str(error.retry_after)}
+
+
+def wait_estimate(seconds):
+    return None if seconds is None else round(seconds)
+
+
 @app.route('/procesar-imagen', methods=['POST'])
 def process_image():
     """
     Endpoint that receives an image, saves it, and queues it for OCR processing
     """
-    job_id = str(uuid.uuid4())
+    # Turn the upload away before storing it when the backlog is too deep
+    priority = PRIORITY_BULK if request.args.get('prioridad') == PRIORITY_BULK else PRIORITY_INTERACTIVE
+    try:
+        estimated_wait = admission.admit(priority)
+    except Overloaded as e:
+        return overloaded_response(e)
+
+    # Handle image (multipart file, raw image body or base64 JSON), streamed to disk
+    if request.content_length and request.content_length > UPLOAD_MAX_BYTES * 4 // 3 + 64 * 1024:
+        return jsonify({"error": f"Image is too large (max {UPLOAD_MAX_BYTES} bytes)"}), 413
 
-    # Handle image (either as file or base64)
     if 'image' in request.files:
         file = request.files['image']
         if file.filename == '':
             return jsonify({"error": "No selected file"}), 400
 
-        filename = os.path.join(UPLOAD_FOLDER, f"carnet_{job_id}{os.path.splitext(file.filename)[1]}")
-        file.save(filename)
-    elif request.is_json and 'image_base64' in request.json:
-        try:
-            image_data = base64.b64decode(request.json['image_base64'])
-            filename = os.path.join(UPLOAD_FOLDER, f"carnet_{job_id}.png")
-            with open(filename, 'wb') as f:
-                f.write(image_data)
-        except Exception as e:
-            return jsonify({"error": f"Invalid base64 image: {str(e)}"}), 400
+        chunks = iter_stream_chunks(file.stream)
+        extension = os.path.splitext(file.filename)[1]
+    elif request.mimetype.startswith('image/') or request.mimetype == 'application/octet-stream':
+        chunks = iter_stream_chunks(request.stream)
+        extension = mimetypes.guess_extension(request.mimetype) or ".jpg"
+        if extension == ".bin":
+            extension = ".jpg"
+    elif (request.is_json and isinstance(request.json, dict)
+          and isinstance(request.json.get('image_base64'), str)):
+        chunks = iter_base64_chunks(request.json['image_base64'])
+        extension = ".png"
     else:
         return jsonify({"error": "No image provided"}), 400
-<<<<<<< HEAD
 
-    # Publish message to RabbitMQ
     try:
-        connection = get_rabbitmq_connection()
-        channel = connection.channel()
-        channel.queue_declare(queue='ocr_queue', durable=True)
+        job_id, cached_result, message = accept_image(chunks, extension)
+    except UploadTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    except ImageRejected as e:
+        return jsonify({"error": str(e), "reason": e.reason}), 422
+    except (binascii.Error, ValueError) as e:
+        return jsonify({"error": f"Invalid base64 image: {str(e)}"}), 400
+    if cached_result is not None:
+        return jsonify(cached_result)
 
-        # Create message payload
-=======
-    
+    # Publish message to RabbitMQ
     try:
-        connection = get_rabbitmq_connection()
-        channel = connection.channel()
-        channel.queue_declare(queue=RABBITMQ_QUEUE, durable=True)
-        
->>>>>>> main
-        message = {
-            "job_id": job_id,
-            "filename": filename
-        }
-<<<<<<< HEAD
-
-        # Publish message
-=======
-        
->>>>>>> main
-        channel.basic_publish(
-            exchange='',
-            routing_key=RABBITMQ_QUEUE,
-            body=json.dumps(message),
-            properties=pika.BasicProperties(delivery_mode=2)
-        )
-
-        connection.close()
+        publish_jobs([message], priority)
 
         return jsonify({
             "job_id": job_id,
-            "status": "enviado"
+            "status": "enviado",
+            "estimated_wait_seconds": wait_estimate(estimated_wait)
         })
     except Exception as e:
         return jsonify({"error": f"Failed to queue job: {str(e)}"}), 500
 
 
+def fairness_key():
+    """
+    Client a job is accounted to for fair scheduling: the X-Client-Id
+    header, the 'cliente' form/JSON field, or the remote address
+    """
+    client_id = request.headers.get('X-Client-Id') or request.form.get('cliente')
+    if not client_id and request.is_json and isinstance(request.json, dict):
+        client_id = request.json.get('cliente')
+    return str(client_id or request.remote_addr or '')[:128]
+
+
+def publish_jobs(messages, priority):
+    """
+    Publish job messages with their priority and client. Interactive jobs
+    go to the main queue; bulk ones to the client's bulk shard.
+    """
+    if not messages:
+        return
+    key = fairness_key()
+    enqueued_at = time.time()
+    for message in messages:
+        message.update(priority=priority, fairness_key=key, enqueued_at=enqueued_at)
+    try:
+        publisher.publish_many(messages, routing_key=job_queue(priority, key))
+    except PublishError as e:
+        JOBS_QUEUED.inc(e.published, priority=priority)
+        admission.record_enqueued(priority, e.published)
+        raise
+    JOBS_QUEUED.inc(len(messages), priority=priority)
+    admission.record_enqueued(priority, len(messages))
+
+
+def iter_zip_member(archive, info):
+    with archive.open(info) as member:
+        yield from iter_stream_chunks(member)
+
+
+def read_batch_images():
+    """
+    Collect (original_filename, chunks) pairs from a batch request: either
+    several 'images' files or one ZIP file in 'archive'. The chunks are
+    read lazily, one image at a time.
+    Raises ValueError with a user-facing message on invalid input.
+    """
+    images = []
+
+    if 'archive' in request.files:
+        try:
+            archive = zipfile.ZipFile(request.files['archive'].stream)
+        except zipfile.BadZipFile:
+            raise ValueError("Invalid ZIP archive")
+
+        entries = [
+            info for info in archive.infolist()
+            if not info.is_dir()
+            and not os.path.basename(info.filename).startswith('.')
+            and not info.filename.startswith('__MACOSX/')
+            and os.path.splitext(info.filename)[1].lower() in IMAGE_EXTENSIONS
+        ]
+        if len(entries) > BATCH_MAX_ITEMS:
+            raise ValueError(f"Too many images in archive (max {BATCH_MAX_ITEMS})")
+        if sum(info.file_size for info in entries) > BATCH_MAX_ARCHIVE_BYTES:
+            raise ValueError("Archive is too large once uncompressed")
+        encrypted = [info.filename for info in entries if info.flag_bits & 0x1]
+        if encrypted:
+            raise ValueError(f"{encrypted[0]}: encrypted ZIP members are not supported")
+
+        for info in entries:
+            images.append((info.filename, iter_zip_member(archive, info)))
+    else:
+        files = [f for f in request.files.getlist('images') if f.filename]
+        if len(files) > BATCH_MAX_ITEMS:
+            raise ValueError(f"Too many images (max {BATCH_MAX_ITEMS})")
+        for file in files:
+            images.append((file.filename, iter_stream_chunks(file.stream)))
+
+    if not images:
+        raise ValueError("No images provided")
+    return images
+
+
+@app.route('/procesar-lote', methods=['POST'])
+def process_batch():
+    """
+    Endpoint that receives many images (multipart 'images' list or a ZIP
+    'archive') and queues them all as one batch
+    """
+    try:
+        images = read_batch_images()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Images are read lazily: nothing is stored yet
+    try:
+        estimated_wait = admission.admit(PRIORITY_BULK, len(images))
+    except Overloaded as e:
+        return overloaded_response(e)
+
+    batch_id = str(uuid.uuid4())
+    jobs = []
+    messages = []
+    rejected = []
+    for original_filename, chunks in images:
+        extension = os.path.splitext(original_filename)[1].lower()
+        try:
+            job_id, cached_result, message = accept_image(chunks, extension)
+        except ImageRejected as e:
+            # The rest of the batch goes on; this image counts as failed
+            job_id = str(uuid.uuid4())
+            jobs.append({
+                "job_id": job_id,
+                "filename": original_filename,
+                "status": "rechazado",
+                "error": str(e),
+                "reason": e.reason
+            })
+            rejected.append((job_id, str(e)))
+            continue
+        except (ValueError, zipfile.BadZipFile, NotImplementedError) as e:
+            # Unsupported compression methods raise NotImplementedError.
+            # Nothing was queued yet: drop the images stored and the cache
+            # hits saved so far
+            for stored in messages:
+                os.remove(stored["filename"])
+            discard_cached_results([job["job_id"] for job in jobs if job["status"] == "completado"])
+            status_code = 413 if isinstance(e, UploadTooLarge) else 400
+            return jsonify({"error": f"{original_filename}: {str(e)}"}), status_code
+        jobs.append({
+            "job_id": job_id,
+            "filename": original_filename,
+            "status": "completado" if cached_result is not None else "enviado"
+        })
+        if message:
+            messages.append(message)
+
+    # Published first, so the batch only records jobs that reached the queue
+    publish_error = None
+    try:
+        publish_jobs(messages, PRIORITY_BULK)
+        queued = len(messages)
+    except Exception as e:
+        publish_error = e
+        queued = e.published if isinstance(e, PublishError) else 0
+        for stored in messages[queued:]:
+            os.remove(stored["filename"])
+        if not queued:
+            discard_cached_results([job["job_id"] for job in jobs if job["status"] == "completado"])
+            return jsonify({"error": f"Failed to queue batch: {str(e)}", "queued_job_ids": []}), 500
+        unqueued = {message["job_id"] for message in messages[queued:]}
+        jobs = [job for job in jobs if job["job_id"] not in unqueued]
+    queued_job_ids = [message["job_id"] for message in messages[:queued]]
+
+    try:
+        create_batch(batch_id, [(job["job_id"], job["filename"]) for job in jobs],
+                     time.strftime("%Y-%m-%d %H:%M:%S"))
+        for job_id, error in rejected:
+            save_rejected_result(job_id, error)
+    except Exception as e:
+        # The queued jobs still run; the client must not send them again
+        return jsonify({"error": f"Failed to record batch: {str(e)}", "queued_job_ids": queued_job_ids}), 500
+    if publish_error is not None:
+        # Only part of the batch was queued: it holds those jobs
+        return jsonify({
+            "error": f"Failed to queue batch: {str(publish_error)}",
+            "batch_id": batch_id,
+            "queued_job_ids": queued_job_ids,
+            "jobs": jobs
+        }), 500
+
+    return jsonify({
+        "batch_id": batch_id,
+        "total": len(jobs),
+        "status": "enviado",
+        "estimated_wait_seconds": wait_estimate(estimated_wait),
+        "jobs": jobs
+    })
+
+
+@app.route('/lote/<batch_id>', methods=['GET'])
+def get_batch(batch_id):
+    """
+    Endpoint with the aggregated progress of a batch
+    """
+    try:
+        uuid.UUID(batch_id, version=4)
+    except ValueError:
+        return jsonify({"error": "Invalid batch ID format"}), 400
+
+    progress = get_batch_progress(batch_id)
+    if progress is None:
+        return jsonify({"error": "Batch not found"}), 404
+    return jsonify(progress)
+
+
+@app.route('/lote/<batch_id>/resultados', methods=['GET'])
+def get_batch_result_rows(batch_id):
+    """
+    Endpoint that returns every finished result of a batch in one response
+    """
+    try:
+        uuid.UUID(batch_id, version=4)
+    except ValueError:
+        return jsonify({"error": "Invalid batch ID format"}), 400
+
+    progress = get_batch_progress(batch_id)
+    if progress is None:
+        return jsonify({"error": "Batch not found"}), 404
+
+    progress["resultados"] = get_batch_results(batch_id)
+    return jsonify(progress)
+
+
+def load_result(job_id):
+    """Return the stored result of a job, or None while it is still processing"""
+    result = get_stored_result(job_id)
+    if result is not None:
+        return result
+
+    # Results written before the database stored errors only exist as files
+    # (possibly compacted into an archive segment)
+    return read_result_file(job_id)
+
+
+def watch_result(job_id, timeout):
+    """
+    Wait for a job result without polling the database in a tight loop.
+
+    Yields None every time a check interval passes without news (so SSE
+    can send keep-alives) and finally yields the result. Stops without a
+    result once timeout seconds have passed.
+    """
+    result_listener.start()
+    event = result_listener.register(job_id)
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            result = load_result(job_id)
+            if result is not None:
+                yield result
+                return
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+
+            interval = WAIT_CHECK_INTERVAL if result_listener.connected else WAIT_CHECK_INTERVAL_DISCONNECTED
+            if event.wait(min(remaining, interval)):
+                event.clear()
+            else:
+                yield None
+    finally:
+        result_listener.unregister(job_id)
+
+
 @app.route('/resultado/<job_id>', methods=['GET'])
 def get_result(job_id):
     """
-    Endpoint to check the status of a processing job or retrieve results
+    Endpoint to check the status of a processing job or retrieve results.
+    With ?esperar=<seconds> it long-polls until the job finishes.
     """
     try:
         uuid.UUID(job_id, version=4)
     except ValueError:
         return jsonify({"error": "Invalid job ID format"}), 400
 
-<<<<<<< HEAD
-    # Check if result file exists
-    result_file = os.path.join(RESULT_FOLDER, f"{job_id}.json")
+    wait_seconds = min(request.args.get('esperar', 0, type=int), RESULT_WAIT_MAX_SECONDS)
 
-    if os.path.exists(result_file):
-        try:
-            with open(result_file, 'r') as f:
-                return jsonify(json.load(f))
-        except Exception as e:
-            return jsonify({"error": f"Failed to read result file: {str(e)}"}), 500
-    else:
-        return jsonify({
-            "status": "procesando"
-        })
-=======
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("SELECT * FROM resultados WHERE job_id = ?", (job_id,))
-        row = c.fetchone()
-        conn.close()
-
-        if row:
-            result = {
-                "job_id": row[0],
-                "nombre": row[1],
-                "codigo_estudiante": row[2],
-                "carrera": row[3],
-                "institucion": row[4],
-                "status": row[5],
-                "processed_at": row[6],
-                "raw_text": row[7],
-                "confidence": {
-                    "nombre": row[8],
-                    "codigo_estudiante": row[9],
-                    "carrera": row[10]
-                }
-            }
-            return jsonify(result)
+    try:
+        if wait_seconds > 0:
+            for result in watch_result(job_id, wait_seconds):
+                if result is not None:
+                    return jsonify(result)
         else:
-            return jsonify({"status": "procesando"})
+            result = load_result(job_id)
+            if result is not None:
+                return jsonify(result)
     except Exception as e:
-        return jsonify({"error": f"Failed to read result from database: {str(e)}"}), 500
->>>>>>> main
+        return jsonify({"error": f"Failed to read result: {str(e)}"}), 500
+
+    return jsonify({
+        "status": "procesando"
+    })
+
+
+@app.route('/buscar', methods=['GET'])
+def search():
+    """
+    Endpoint that finds results by name, student code, program or
+    institution (?q=<words>, optional ?campo=, ?estado=, ?limite=)
+    """
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify({"error": "Missing search text (?q=)"}), 400
+    field = request.args.get('campo') or None
+    if field is not None and field not in SEARCH_FIELDS:
+        return jsonify({"error": f"Invalid field, use one of: {', '.join(SEARCH_FIELDS)}"}), 400
+    limit = min(max(1, request.args.get('limite', SEARCH_DEFAULT_LIMIT, type=int)), SEARCH_MAX_LIMIT)
+
+    results = search_results(text, field=field, status=request.args.get('estado'), limit=limit)
+    return jsonify({
+        "q": text,
+        "total": len(results),
+        "resultados": results
+    })
+
+
+def iter_export_ndjson(rows, page_size=EXPORT_PAGE_SIZE):
+    """One JSON object per line, sent in chunks of page_size lines"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False))
+        if len(lines) == page_size:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def iter_export_csv(rows, page_size=EXPORT_PAGE_SIZE):
+    """Header line and rows, sent in chunks of page_size rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % page_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+@app.route('/exportar', methods=['GET'])
+def export_results():
+    """
+    Endpoint that streams every stored result as NDJSON (default) or CSV
+    (?formato=csv), ordered by job_id. Optional filters: ?estado=,
+    ?desde=<YYYY-MM-DD[ HH:MM:SS]> (processed_at) and ?despues=<job_id>
+    to resume an interrupted export after the last job_id received.
+    """
+    export_format = request.args.get('formato', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({"error": "Invalid format, use ndjson or csv"}), 400
+
+    rows = iter_result_rows(
+        after_job_id=request.args.get('despues', ''),
+        status=request.args.get('estado'),
+        since=request.args.get('desde'),
+        page_size=EXPORT_PAGE_SIZE
+    )
+    filename = f"resultados-{time.strftime('%Y%m%d-%H%M%S')}.{export_format}"
+    if export_format == 'csv':
+        body, mimetype = iter_export_csv(rows), 'text/csv; charset=utf-8'
+    else:
+        body, mimetype = iter_export_ndjson(rows), 'application/x-ndjson'
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+
+@app.route('/eventos/<job_id>', methods=['GET'])
+def result_events(job_id):
+    """
+    Server-Sent Events endpoint: pushes the result as soon as the worker
+    reports that the job finished
+    """
+    try:
+        uuid.UUID(job_id, version=4)
+    except ValueError:
+        return jsonify({"error": "Invalid job ID format"}), 400
+
+    def stream():
+        try:
+            for result in watch_result(job_id, RESULT_WAIT_MAX_SECONDS):
+                if result is None:
+                    yield ": keep-alive\n\n"
+                else:
+                    yield f"event: resultado\ndata: {json.dumps(result, ensure_ascii=False)}\n\n"
+                    return
+            yield "event: timeout\ndata: {}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Prometheus metrics of the API plus the snapshots written by the workers
+    """
+    families = [(REGISTRY.collect(), (('process', 'api'),))] + read_snapshots()
+    return Response(render(families), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/estadisticas-cache', methods=['GET'])
+def cache_stats():
+    """
+    Endpoint with hit/miss counters of the result cache (this API process)
+    """
+    return jsonify(result_cache.stats())
+
+
+@app.route('/estadisticas-publicador', methods=['GET'])
+def publisher_stats():
+    """
+    Endpoint with publish counters and latency percentiles (this API process)
+    """
+    return jsonify(publisher.stats())
 
 
 if __name__ == '__main__':
@@ -215,11 +773,6 @@ if __name__ == '__main__':
         print(f"⚠️ El puerto 5000 está en uso. Usando puerto alternativo: {port}")
 
     debug = os.getenv('DEBUG', 'False').lower() == 'true'
-<<<<<<< HEAD
 
     print(f"🚀 Iniciando servidor en http://localhost:{port}")
     app.run(host=host, port=port, debug=debug)
-=======
-    
-    app.run(host=host, port=port, debug=debug)
->>>>>>> main
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Calibrate the field extractor's CONFIDENCE scores (worker/field_extractor.py)
+against labelled cards.
+
+The input is a JSON Lines file, one card per line: the model's raw_text
+plus the correct value of each field that is on the card. Every value
+extract() finds is grouped by how it was found (the CONFIDENCE key its
+score comes from) and checked against the label; the share that was
+right is the calibrated confidence for that case.
+
+    python benchmarks/calibrate_confidence.py tests/fixtures/labelled_cards.jsonl
+    python benchmarks/calibrate_confidence.py labelled.jsonl --min-samples 50
+"""
+import os
+import sys
+import json
+import argparse
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BASE_DIR, 'worker'))
+
+from field_extractor import extract, normalize, FIELDS, CONFIDENCE
+
+# Score -> CONFIDENCE key, to tell how extract() found each value
+METHODS = {score: method for method, score in CONFIDENCE.items()}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Calibración de la confianza de los campos extraídos")
+    parser.add_argument('labelled', help="Archivo JSON Lines con raw_text y los valores correctos")
+    parser.add_argument('--min-samples', type=int, default=20,
+                        help="Avisar cuando un caso tiene menos valores que estos")
+    return parser.parse_args()
+
+
+def load_samples(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def same_value(found, expected):
+    return normalize(found) == normalize(expected)
+
+
+def calibrate(samples):
+    """Return {CONFIDENCE key: (right, total)} over the labelled samples"""
+    counts = {method: [0, 0] for method in CONFIDENCE}
+    for sample in samples:
+        result = extract(sample["raw_text"])
+        for field in FIELDS:
+            if not result[field]:
+                continue
+            method = METHODS.get(result["confidence"][field])
+            if method is None:
+                continue
+            counts[method][1] += 1
+            if same_value(result[field], sample.get(field) or ""):
+                counts[method][0] += 1
+    return {method: tuple(count) for method, count in counts.items()}
+
+
+def main():
+    args = parse_args()
+    samples = load_samples(args.labelled)
+    print(f"{len(samples)} carnés etiquetados")
+
+    for method, (right, total) in calibrate(samples).items():
+        current = CONFIDENCE[method]
+        if not total:
+            print(f"  {method:<14} sin valores (actual {current})")
+            continue
+        warning = "  ⚠️ pocas muestras" if total < args.min_samples else ""
+        print(f"  {method:<14} {right}/{total} correctos = {right / total:.2f} "
+              f"(actual {current}){warning}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of the API -> queue -> worker -> database path.
+
+Runs everything in one process against local stand-ins: a fake Ollama
+server (benchmarks/fake_ollama.py) and an in-memory broker replacing
+RabbitMQ. Images are uploaded through the real /procesar-imagen endpoint
+and processed by the real worker code (process_job), so regressions in
+pre-processing, process_image_ocr, extract_fields or save_result_to_db
+show up in the numbers.
+
+    python benchmarks/e2e_benchmark.py --jobs 200 --concurrency 4 --latency 0.2
+    python benchmarks/e2e_benchmark.py --ollama-nodes 3 --down-nodes 1
+"""
+import os
+import io
+import sys
+import json
+import time
+import queue
+import random
+import argparse
+import tempfile
+import threading
+from collections import defaultdict
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+sys.path.insert(0, os.path.join(BASE_DIR, 'worker'))
+sys.path.insert(0, os.path.join(BASE_DIR, 'api'))
+
+from fake_ollama import FakeOllamaServer
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark de extremo a extremo del sistema OCR")
+    parser.add_argument('--jobs', type=int, default=100, help="Número de imágenes a procesar")
+    parser.add_argument('--images', help="Directorio con imágenes reales (por defecto se generan)")
+    parser.add_argument('--image-size', default='1600x1000', help="Tamaño de las imágenes generadas")
+    parser.add_argument('--clients', type=int, default=4, help="Clientes subiendo imágenes en paralelo")
+    parser.add_argument('--concurrency', type=int, default=4, help="Trabajos en paralelo en el worker")
+    parser.add_argument('--latency', type=float, default=0.2, help="Latencia del Ollama falso (s)")
+    parser.add_argument('--jitter', type=float, default=0.2, help="Variación relativa de la latencia")
+    parser.add_argument('--ollama-nodes', type=int, default=1,
+                        help="Servidores Ollama falsos (OLLAMA_API_URLS)")
+    parser.add_argument('--down-nodes', type=int, default=0,
+                        help="Cuántos de esos servidores responden 503 (para probar la expulsión)")
+    parser.add_argument('--format', choices=['text', 'json'], default='text',
+                        help="Formato de salida del modelo (OCR_OUTPUT_FORMAT)")
+    parser.add_argument('--json', help="Guardar el reporte en este archivo JSON")
+    return parser.parse_args()
+
+
+def percentile(samples, p):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def generate_corpus(count, size):
+    """Distinct synthetic card-like JPEGs (no two images share bytes)"""
+    from PIL import Image, ImageDraw
+
+    width, height = (int(v) for v in size.lower().split('x'))
+    rng = random.Random(42)
+    corpus = []
+    for i in range(count):
+        image = Image.new('RGB', (width, height), (rng.randint(200, 255),) * 3)
+        draw = ImageDraw.Draw(image)
+        for _ in range(12):
+            x, y = rng.randint(0, width - 200), rng.randint(0, height - 40)
+            draw.rectangle([x, y, x + rng.randint(50, 200), y + rng.randint(10, 40)],
+                           fill=tuple(rng.randint(0, 120) for _ in range(3)))
+        draw.text((20, 20), f"Carnet {i} - 2021{i:05d}", fill=(0, 0, 0))
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=90)
+        corpus.append((f"carnet_{i}.jpg", output.getvalue()))
+    return corpus
+
+
+def load_corpus(directory, count):
+    files = sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if os.path.splitext(name)[1].lower() in ('.jpg', '.jpeg', '.png', '.webp')
+    )
+    if not files:
+        raise SystemExit(f"No images found in {directory}")
+    corpus = []
+    for i in range(count):
+        path = files[i % len(files)]
+        with open(path, 'rb') as f:
+            corpus.append((os.path.basename(path), f.read()))
+    return corpus
+
+
+class InMemoryBroker:
+    """Drop-in for the API publisher: messages go to a local queue"""
+
+    def __init__(self):
+        self.queue = queue.Queue()
+
+    def publish(self, message, routing_key=None):
+        self.publish_many([message], routing_key)
+
+    def publish_many(self, messages, routing_key=None):
+        now = time.perf_counter()
+        for message in messages:
+            self.queue.put((now, message))
+
+    def stats(self):
+        return {"queued": self.queue.qsize()}
+
+    def close(self):
+        pass
+
+
+class StageRecorder:
+    """Collects per-stage durations, wrapping the functions on the hot path"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def wrap(self, stage, func):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - started)
+        return timed
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix='ocr-bench-')
+
+    fakes = [
+        FakeOllamaServer(latency=args.latency, jitter=args.jitter).start()
+        for _ in range(max(1, args.ollama_nodes))
+    ]
+    for fake in fakes[:args.down_nodes]:
+        fake.healthy = False
+
+    # Must be set before the project modules read shared.config
+    os.environ.update({
+        'OLLAMA_API_URL': fakes[0].api_url,
+        'OLLAMA_API_URLS': ','.join(fake.api_url for fake in fakes),
+        'OLLAMA_HEALTH_INTERVAL': '1',
+        'DB_PATH': os.path.join(workdir, 'ocr_results.db'),
+        'CACHE_ENABLED': 'False',
+        'UPLOAD_DIR': os.path.join(workdir, 'uploads'),
+        'RESULTS_DIR': os.path.join(workdir, 'resultados'),
+        'WORKER_CONCURRENCY': str(args.concurrency),
+        'OCR_OUTPUT_FORMAT': args.format,
+    })
+
+    import app as api_app
+    import ocr_worker
+    import ocr_processor
+    import ollama_client
+
+    recorder = StageRecorder()
+    broker = InMemoryBroker()
+    api_app.publisher = broker
+
+    ocr_processor.preprocess_image = recorder.wrap('preprocess', ocr_processor.preprocess_image)
+    ollama_client.OllamaClient.chat = recorder.wrap('ollama', ollama_client.OllamaClient.chat)
+    ocr_processor.extract_fields = recorder.wrap('extract_fields', ocr_processor.extract_fields)
+    ocr_worker.result_writer.save = recorder.wrap('db_write', ocr_worker.result_writer.save)
+
+    print("Preparando imágenes...")
+    if args.images:
+        corpus = load_corpus(args.images, args.jobs)
+    else:
+        corpus = generate_corpus(args.jobs, args.image_size)
+
+    submitted = {}
+    finished = {}
+    failures = []
+    lock = threading.Lock()
+
+    def consume():
+        while True:
+            item = broker.queue.get()
+            if item is None:
+                return
+            enqueued_at, message = item
+            recorder.record('queue_wait', time.perf_counter() - enqueued_at)
+            started = time.perf_counter()
+            try:
+                status = ocr_worker.process_job(message)
+            except Exception as e:
+                status = f"exception: {e}"
+            recorder.record('worker_total', time.perf_counter() - started)
+            with lock:
+                finished[message['job_id']] = (time.perf_counter(), status)
+
+    def upload(items):
+        client = api_app.app.test_client()
+        for name, data in items:
+            started = time.perf_counter()
+            response = client.post('/procesar-imagen', data={'image': (io.BytesIO(data), name)},
+                                   content_type='multipart/form-data')
+            recorder.record('upload', time.perf_counter() - started)
+            if response.status_code != 200:
+                failures.append(response.get_json())
+                continue
+            with lock:
+                submitted[response.get_json()['job_id']] = started
+
+    consumers = [threading.Thread(target=consume) for _ in range(args.concurrency)]
+    for thread in consumers:
+        thread.start()
+
+    print(f"Procesando {args.jobs} trabajos ({args.clients} clientes, concurrencia {args.concurrency}, "
+          f"latencia Ollama {args.latency}s)...")
+    started = time.perf_counter()
+    uploaders = [threading.Thread(target=upload, args=(corpus[i::args.clients],)) for i in range(args.clients)]
+    for thread in uploaders:
+        thread.start()
+    for thread in uploaders:
+        thread.join()
+    for _ in consumers:
+        broker.queue.put(None)
+    for thread in consumers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    end_to_end = [finished[job_id][0] - submitted[job_id] for job_id in submitted if job_id in finished]
+    statuses = defaultdict(int)
+    for _, status in finished.values():
+        statuses[status] += 1
+
+    report = {
+        "jobs": args.jobs,
+        "completed": len(end_to_end),
+        "upload_failures": len(failures),
+        "statuses": dict(statuses),
+        "elapsed_s": round(elapsed, 3),
+        "jobs_per_s": round(len(end_to_end) / elapsed, 2) if elapsed else 0.0,
+        "ollama_requests": sum(fake.requests for fake in fakes),
+        "ollama_requests_per_node": [fake.requests for fake in fakes],
+        "stages_ms": {}
+    }
+    for stage, samples in [('end_to_end', end_to_end)] + sorted(recorder.samples.items()):
+        report["stages_ms"][stage] = {
+            "count": len(samples),
+            "p50": round(percentile(samples, 0.50) * 1000, 2),
+            "p95": round(percentile(samples, 0.95) * 1000, 2),
+            "p99": round(percentile(samples, 0.99) * 1000, 2),
+            "mean": round(sum(samples) / len(samples) * 1000, 2) if samples else 0.0
+        }
+
+    for fake in fakes:
+        fake.stop()
+
+    print(f"\nCompletados: {report['completed']}/{args.jobs} en {report['elapsed_s']}s "
+          f"({report['jobs_per_s']} trabajos/s), estados: {report['statuses']}")
+    if len(fakes) > 1:
+        print(f"Peticiones por servidor Ollama: {report['ollama_requests_per_node']}")
+    print(f"\n{'etapa':<16}{'n':>7}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}{'media ms':>11}")
+    for stage, row in report["stages_ms"].items():
+        print(f"{stage:<16}{row['count']:>7}{row['p50']:>11}{row['p95']:>11}{row['p99']:>11}{row['mean']:>11}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReporte guardado en {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark of the field extractor (worker/field_extractor.py).
+
+Runs extract() over stored raw_text values from the result database, or
+over generated transcriptions with the label variants models produce,
+and reports texts per second.
+
+    python benchmarks/extract_benchmark.py --texts 50000
+    python benchmarks/extract_benchmark.py --db data/ocr_results.db --min-rate 5000
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BASE_DIR, 'worker'))
+
+from field_extractor import extract, FIELDS
+
+NAMES = ["María Fernanda López Gómez", "JUAN CAMILO PÉREZ", "Ana Sofía Rodríguez", "Luis Ángel Martínez Rojas"]
+PROGRAMS = ["Ingeniería de Sistemas y Computación", "Derecho", "Medicina", "Licenciatura en Matemáticas"]
+INSTITUTIONS = ["Universidad Pedagógica y Tecnológica de Colombia", "Universidad Nacional de Colombia", "UPTC"]
+LABEL_VARIANTS = {
+    "nombre": ["Nombre: {}", "**Nombre:** {}", "Nombre completo : {}", "- Name: {}"],
+    "codigo_estudiante": ["Código: {}", "Codigo : {}", "**Código estudiantil:** {}", "Student ID: {}"],
+    "carrera": ["Carrera: {}", "Programa académico: {}", "* Carrera : {}"],
+    "institucion": ["Institución: {}", "Institucion: {}", "{}", "University: {}"],
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark de extracción de campos")
+    parser.add_argument('--texts', type=int, default=20000, help="Número de textos a procesar")
+    parser.add_argument('--db', help="Usar los raw_text guardados en esta base de datos")
+    parser.add_argument('--min-rate', type=float, default=0, help="Fallar si se procesan menos textos/s")
+    return parser.parse_args()
+
+
+def generate_texts(count):
+    rng = random.Random(7)
+    texts = []
+    for _ in range(count):
+        values = {
+            "nombre": rng.choice(NAMES),
+            "codigo_estudiante": str(rng.randint(201000000, 202499999)),
+            "carrera": rng.choice(PROGRAMS),
+            "institucion": rng.choice(INSTITUTIONS),
+        }
+        lines = [rng.choice(LABEL_VARIANTS[field]).format(values[field]) for field in FIELDS]
+        if rng.random() < 0.3:
+            lines.insert(0, "Aquí está la transcripción del carné:")
+        texts.append("\n".join(lines))
+    return texts
+
+
+def load_texts(db_path, count):
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT raw_text FROM resultados WHERE raw_text IS NOT NULL LIMIT ?", (count,)
+        ).fetchall()
+    finally:
+        conn.close()
+    if not rows:
+        raise SystemExit(f"No raw_text found in {db_path}")
+    texts = [row[0] for row in rows]
+    # Repeat the stored texts up to the requested count
+    return (texts * (count // len(texts) + 1))[:count]
+
+
+def main():
+    args = parse_args()
+    texts = load_texts(args.db, args.texts) if args.db else generate_texts(args.texts)
+
+    started = time.perf_counter()
+    found = dict.fromkeys(FIELDS, 0)
+    for text in texts:
+        result = extract(text)
+        for field in FIELDS:
+            if result[field]:
+                found[field] += 1
+    elapsed = time.perf_counter() - started
+
+    rate = len(texts) / elapsed if elapsed else float('inf')
+    print(f"{len(texts)} textos en {elapsed:.3f}s: {rate:,.0f} textos/s "
+          f"({elapsed / len(texts) * 1e6:.1f} µs por texto)")
+    for field, count in found.items():
+        print(f"  {field:<18} {count * 100.0 / len(texts):5.1f}% extraído")
+
+    if args.min_rate and rate < args.min_rate:
+        raise SystemExit(f"Por debajo del mínimo de {args.min_rate:,.0f} textos/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Ollama HTTP API, for benchmarks.
+
+Answers /api/chat with a canned student card transcription after a
+configurable latency (streaming or not) and /api/tags for health checks.
+
+    python benchmarks/fake_ollama.py --port 11500 --latency 0.5
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED_RESPONSE = (
+    "Nombre: María Fernanda López Gómez\n"
+    "Código: 202112345\n"
+    "Carrera: Ingeniería de Sistemas y Computación\n"
+    "Institución: Universidad Pedagógica y Tecnológica de Colombia\n"
+)
+# Answer to requests with a "format" (JSON schema) constraint
+CANNED_JSON_RESPONSE = json.dumps({
+    "nombre": "María Fernanda López Gómez",
+    "codigo_estudiante": "202112345",
+    "carrera": "Ingeniería de Sistemas y Computación",
+    "institucion": "Universidad Pedagógica y Tecnológica de Colombia",
+}, ensure_ascii=False)
+
+
+class FakeOllamaServer:
+    """
+    Threaded fake Ollama server.
+
+    latency: seconds spent "generating" each answer (spread over the
+    streamed chunks); jitter: +/- random fraction of the latency;
+    response: text returned as the assistant message; load_time: seconds
+    to "load" the model when it is not resident, which happens on the
+    first request and after unload_after idle seconds (reported as
+    load_duration, like Ollama). Requests without messages only load.
+    Requests with a "format" get a JSON object. Answers report an
+    approximate eval_count.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.5, jitter=0.0,
+                 response=CANNED_RESPONSE, model='qwen2.5vl:7b', load_time=0.0,
+                 unload_after=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.response = response
+        self.model = model
+        self.load_time = load_time
+        self.unload_after = unload_after
+        self.requests = 0
+        self.aborted = 0
+        self.loads = 0
+        self.healthy = True
+        self._last_request = None
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    @property
+    def api_url(self):
+        return f"http://{self.httpd.server_address[0]}:{self.port}/api"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _load(self):
+        """Seconds spent loading the model for this request"""
+        with self._lock:
+            now = time.monotonic()
+            idle = None if self._last_request is None else now - self._last_request
+            self._last_request = now
+            cold = idle is None or (self.unload_after is not None and idle > self.unload_after)
+            if cold:
+                self.loads += 1
+        if cold and self.load_time:
+            time.sleep(self.load_time)
+            return self.load_time
+        return 0.0
+
+    def _latency(self):
+        if not self.jitter:
+            return self.latency
+        return max(0.0, self.latency * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def _answer(self, json_format=False):
+        return CANNED_JSON_RESPONSE if json_format else self.response
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, payload):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == '/api/tags':
+                    if not server.healthy:
+                        return self._send_json(503, {"error": "unhealthy"})
+                    return self._send_json(200, {"models": [{"name": server.model}]})
+                self._send_json(404, {"error": "not found"})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                if self.path != '/api/chat':
+                    return self._send_json(404, {"error": "not found"})
+                if not server.healthy:
+                    return self._send_json(503, {"error": "unhealthy"})
+
+                server._count('requests')
+                load_duration = int(server._load() * 1e9)
+                if not payload.get('messages'):
+                    return self._send_json(200, {
+                        "model": server.model, "message": {"role": "assistant", "content": ""},
+                        "done": True, "done_reason": "load", "load_duration": load_duration
+                    })
+                latency = server._latency()
+                answer = server._answer(bool(payload.get('format')))
+                if payload.get('stream', True):
+                    self._stream(latency, load_duration, answer)
+                else:
+                    time.sleep(latency)
+                    self._send_json(200, {
+                        "model": server.model,
+                        "message": {"role": "assistant", "content": answer},
+                        "done": True,
+                        "load_duration": load_duration,
+                        "eval_count": len(answer.split())
+                    })
+
+            def _stream(self, latency, load_duration, answer):
+                lines = answer.splitlines(keepends=True) or [""]
+                delay = latency / len(lines)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                try:
+                    for line in lines:
+                        time.sleep(delay)
+                        self._chunk({"model": server.model,
+                                     "message": {"role": "assistant", "content": line},
+                                     "done": False})
+                    self._chunk({"model": server.model,
+                                 "message": {"role": "assistant", "content": ""},
+                                 "done": True, "load_duration": load_duration,
+                                 "eval_count": len(answer.split())})
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client stopped reading (early termination)
+                    server._count('aborted')
+                    self.close_connection = True
+
+            def _chunk(self, payload):
+                data = json.dumps(payload).encode('utf-8') + b"\n"
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+        return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Servidor Ollama falso para pruebas de rendimiento")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11500)
+    parser.add_argument('--latency', type=float, default=0.5, help="Segundos por respuesta")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Variación relativa de la latencia")
+    parser.add_argument('--load-time', type=float, default=0.0, help="Segundos para cargar el modelo en frío")
+    parser.add_argument('--unload-after', type=float, default=None, help="Descargar el modelo tras estos segundos sin uso")
+    args = parser.parse_args()
+
+    server = FakeOllamaServer(args.host, args.port, args.latency, args.jitter,
+                              load_time=args.load_time, unload_after=args.unload_after)
+    print(f"Fake Ollama escuchando en {server.api_url} (latencia {args.latency}s)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
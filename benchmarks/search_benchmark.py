@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Benchmark of /buscar (FTS5 search) and /exportar (keyset-paginated
+streaming export) over a large resultados table.
+
+Fills a temporary database with generated results through the normal
+write path (so the full-text triggers run), then times searches by name,
+student code, program and institution, a LIKE scan for comparison, and
+full NDJSON and CSV exports through the real Flask endpoints.
+
+    python benchmarks/search_benchmark.py --rows 1000000
+    python benchmarks/search_benchmark.py --db data/ocr_results.db --rows 0
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import resource
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+sys.path.insert(0, os.path.join(BASE_DIR, 'api'))
+
+FIRST_NAMES = ["María", "Juan", "Ana", "Luis", "Carlos", "Laura", "Andrés", "Sofía", "Diego", "Valentina",
+               "José", "Camila", "Miguel", "Daniela", "Jorge", "Paula", "Santiago", "Natalia", "Felipe", "Lucía"]
+LAST_NAMES = ["López", "Pérez", "Rodríguez", "Martínez", "Gómez", "García", "Hernández", "Díaz", "Moreno",
+              "Rojas", "Vargas", "Castro", "Ortiz", "Ramírez", "Suárez", "Torres", "Jiménez", "Ruiz", "Niño", "Peña"]
+PROGRAMS = ["Ingeniería de Sistemas y Computación", "Derecho", "Medicina", "Licenciatura en Matemáticas",
+            "Administración de Empresas", "Ingeniería Civil", "Psicología", "Contaduría Pública"]
+INSTITUTIONS = ["Universidad Pedagógica y Tecnológica de Colombia", "Universidad Nacional de Colombia",
+                "Universidad de Antioquia", "Universidad del Valle"]
+INSERT_CHUNK = 10000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark de búsqueda y exportación de resultados")
+    parser.add_argument('--rows', type=int, default=1000000, help="Resultados a generar")
+    parser.add_argument('--db', help="Base de datos a usar (por defecto una temporal)")
+    parser.add_argument('--queries', type=int, default=300, help="Búsquedas a cronometrar")
+    parser.add_argument('--like-queries', type=int, default=5, help="Búsquedas LIKE de comparación")
+    parser.add_argument('--no-export', action='store_true', help="No cronometrar las exportaciones")
+    return parser.parse_args()
+
+
+def generate_result(rng, index):
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}"
+    return {
+        # Sortable and unique, like the uuid4 job ids
+        "job_id": f"{rng.getrandbits(128):032x}"[:32],
+        "nombre": name,
+        "codigo_estudiante": str(201000000 + index),
+        "carrera": rng.choice(PROGRAMS),
+        "institucion": rng.choice(INSTITUTIONS),
+        "status": "completado" if rng.random() < 0.97 else "error",
+        "processed_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(1700000000 + index * 30)),
+        "raw_text": f"Nombre: {name}",
+        "confidence": {"nombre": 1.0, "codigo_estudiante": 1.0, "carrera": 0.9, "institucion": 0.9},
+    }
+
+
+def fill(database, rows):
+    rng = random.Random(11)
+    started = time.perf_counter()
+    for start in range(0, rows, INSERT_CHUNK):
+        database.save_results_to_db([generate_result(rng, index)
+                                     for index in range(start, min(rows, start + INSERT_CHUNK))])
+        if start and start % (INSERT_CHUNK * 50) == 0:
+            print(f"  {start:,} filas...")
+    elapsed = time.perf_counter() - started
+    print(f"{rows:,} filas insertadas en {elapsed:.1f}s ({rows / elapsed:,.0f} filas/s, índice FTS incluido)")
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+    return f"p50 {pick(0.5):7.2f} ms  p95 {pick(0.95):7.2f} ms  p99 {pick(0.99):7.2f} ms"
+
+
+def bench_search(client, total_rows, queries):
+    rng = random.Random(5)
+    kinds = {
+        "nombre completo": lambda: {"q": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}"},
+        "prefijo nombre": lambda: {"q": f"{rng.choice(FIRST_NAMES)[:3]} {rng.choice(LAST_NAMES)[:3]}"},
+        "código exacto": lambda: {"q": str(201000000 + rng.randrange(max(1, total_rows))), "campo": "codigo_estudiante"},
+        "carrera": lambda: {"q": f"{rng.choice(PROGRAMS).split()[0]} {rng.choice(LAST_NAMES)}"},
+    }
+    for kind, make_params in kinds.items():
+        timings = []
+        found = 0
+        for _ in range(queries // len(kinds)):
+            started = time.perf_counter()
+            response = client.get("/buscar", query_string=make_params())
+            timings.append(time.perf_counter() - started)
+            found += response.get_json()["total"]
+        print(f"  {kind:<16} {percentiles(timings)}  ({found / len(timings):.1f} resultados/consulta)")
+
+
+def bench_like(database, total_rows, queries):
+    """The same lookups without the index: LIKE stops early on common names, scans the table for a code"""
+    rng = random.Random(5)
+    enabled = database.search_index_enabled
+    database.search_index_enabled = False
+    try:
+        for kind, make_text in (
+            ("LIKE nombre", lambda: f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"),
+            ("LIKE código", lambda: str(201000000 + rng.randrange(max(1, total_rows)))),
+        ):
+            timings = []
+            for _ in range(queries):
+                started = time.perf_counter()
+                database.search_results(make_text())
+                timings.append(time.perf_counter() - started)
+            print(f"  {kind:<16} {percentiles(timings)}")
+    finally:
+        database.search_index_enabled = enabled
+
+
+def bench_export(client, export_format):
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    response = client.get(f"/exportar?formato={export_format}", buffered=False)
+    size = lines = 0
+    first_byte = None
+    for chunk in response.response:
+        if first_byte is None:
+            first_byte = time.perf_counter() - started
+        size += len(chunk)
+        lines += chunk.count(b'\n') if isinstance(chunk, bytes) else chunk.count('\n')
+    response.close()
+    elapsed = time.perf_counter() - started
+    rows = lines - (1 if export_format == 'csv' else 0)
+    rss_growth = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024
+    print(f"  {export_format:<6} {rows:,} filas, {size / 1e6:,.1f} MB en {elapsed:.1f}s "
+          f"({rows / elapsed:,.0f} filas/s, primer byte {first_byte * 1000 if first_byte else 0:.0f} ms, "
+          f"memoria máxima +{rss_growth:.0f} MB)")
+
+
+def main():
+    args = parse_args()
+    if args.db:
+        os.environ['DB_PATH'] = os.path.abspath(args.db)
+    else:
+        os.environ['DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='search-bench-'), 'ocr_results.db')
+    import database
+    database.init_db()
+    if args.rows:
+        fill(database, args.rows)
+    total_rows = database.get_connection().execute('SELECT COUNT(*) FROM resultados').fetchone()[0]
+
+    import app as api_app
+    client = api_app.app.test_client()
+    print(f"Búsqueda sobre {total_rows:,} resultados (índice FTS5: {'sí' if database.search_index_enabled else 'no'}):")
+    bench_search(client, total_rows, args.queries)
+    if args.like_queries:
+        bench_like(database, total_rows, args.like_queries)
+
+    if not args.no_export:
+        print("Exportación completa:")
+        bench_export(client, 'ndjson')
+        bench_export(client, 'csv')
+
+
+if __name__ == '__main__':
+    main()
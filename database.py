@@ -1,9 +1,154 @@
+import re
+import time
+import queue
 import sqlite3
+import threading
+from concurrent.futures import Future
+
+from shared.config import DB_PATH, DB_POOL_SIZE, DB_WRITE_BATCH_SIZE, DB_WRITE_BATCH_LINGER_MS
+
+# Columns of the resultados table added after the first release; init_db()
+# adds them to existing databases.
+MIGRATED_COLUMNS = {
+    "confidence_nombre": "REAL",
+    "confidence_codigo_estudiante": "REAL",
+    "confidence_carrera": "REAL",
+    "confidence_institucion": "REAL",
+    "error": "TEXT",
+    "created_at": "TEXT",
+}
+
+CONFIDENCE_FIELDS = ("nombre", "codigo_estudiante", "carrera", "institucion")
+
+# Full-text index of the extracted fields (FTS5, external content: the text
+# stays in resultados and the triggers keep the index in step). Accents and
+# case are ignored. Rowids are the link, so after a VACUUM the index must be
+# rebuilt: INSERT INTO resultados_fts(resultados_fts) VALUES ('rebuild')
+SEARCH_FIELDS = CONFIDENCE_FIELDS
+SEARCH_INDEX_SQL = f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS resultados_fts USING fts5(
+        {", ".join(SEARCH_FIELDS)},
+        content = resultados,
+        tokenize = "unicode61 remove_diacritics 2"
+    )
+'''
+_new_fields = ", ".join(f"new.{field}" for field in SEARCH_FIELDS)
+_old_fields = ", ".join(f"old.{field}" for field in SEARCH_FIELDS)
+SEARCH_TRIGGERS_SQL = [
+    f'''
+    CREATE TRIGGER IF NOT EXISTS resultados_fts_insert AFTER INSERT ON resultados BEGIN
+        INSERT INTO resultados_fts (rowid, {", ".join(SEARCH_FIELDS)}) VALUES (new.rowid, {_new_fields});
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS resultados_fts_delete AFTER DELETE ON resultados BEGIN
+        INSERT INTO resultados_fts (resultados_fts, rowid, {", ".join(SEARCH_FIELDS)})
+        VALUES ('delete', old.rowid, {_old_fields});
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS resultados_fts_update AFTER UPDATE OF {", ".join(SEARCH_FIELDS)} ON resultados BEGIN
+        INSERT INTO resultados_fts (resultados_fts, rowid, {", ".join(SEARCH_FIELDS)})
+        VALUES ('delete', old.rowid, {_old_fields});
+        INSERT INTO resultados_fts (rowid, {", ".join(SEARCH_FIELDS)}) VALUES (new.rowid, {_new_fields});
+    END
+    ''',
+]
+SEARCH_TERM_PATTERN = re.compile(r'\w+')
+
+# Columns of a result in exports, in order
+EXPORT_COLUMNS = (
+    "job_id", "nombre", "codigo_estudiante", "carrera", "institucion", "status", "processed_at",
+    *(f"confidence_{field}" for field in CONFIDENCE_FIELDS), "error"
+)
+
+# False when this SQLite build has no FTS5: search falls back to LIKE scans
+search_index_enabled = False
+
+UPSERT_RESULT_SQL = '''
+    INSERT INTO resultados (
+        job_id, nombre, codigo_estudiante, carrera, institucion,
+        status, processed_at, raw_text,
+        confidence_nombre, confidence_codigo_estudiante,
+        confidence_carrera, confidence_institucion,
+        error, created_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(job_id) DO UPDATE SET
+        nombre = excluded.nombre,
+        codigo_estudiante = excluded.codigo_estudiante,
+        carrera = excluded.carrera,
+        institucion = excluded.institucion,
+        status = excluded.status,
+        processed_at = excluded.processed_at,
+        raw_text = excluded.raw_text,
+        confidence_nombre = excluded.confidence_nombre,
+        confidence_codigo_estudiante = excluded.confidence_codigo_estudiante,
+        confidence_carrera = excluded.confidence_carrera,
+        confidence_institucion = excluded.confidence_institucion,
+        error = excluded.error
+'''
+
+UPDATE_FIELDS_SQL = '''
+    UPDATE resultados SET
+        nombre = ?, codigo_estudiante = ?, carrera = ?, institucion = ?,
+        confidence_nombre = ?, confidence_codigo_estudiante = ?,
+        confidence_carrera = ?, confidence_institucion = ?
+    WHERE job_id = ?
+'''
+
+_local = threading.local()
+# Idle connections handed back by release_connection()
+_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+
+
+def _open_connection():
+    # Used by one thread at a time, but not always the one that opened it
+    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')  # durable enough with WAL, far fewer fsyncs
+    conn.execute('PRAGMA busy_timeout=30000')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-16000')  # 16 MB page cache
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def get_connection():
+    """
+    Return this thread's connection to the result database.
+
+    A thread takes an idle connection from the pool (or opens one) and
+    keeps it until it calls release_connection(). Long-lived worker
+    threads keep theirs; the API releases it at the end of each request,
+    since the dev server starts a thread per request. WAL is enabled so
+    the API can read while workers write.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        try:
+            conn = _pool.get_nowait()
+        except queue.Empty:
+            conn = _open_connection()
+        _local.conn = conn
+    return conn
+
+
+def release_connection():
+    """Hand this thread's connection back to the pool, or close it if the pool is full"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        return
+    _local.conn = None
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
 
-DB_PATH = 'data/ocr_results.db'
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
     c.execute('''
         CREATE TABLE IF NOT EXISTS resultados (
@@ -14,21 +159,71 @@ def init_db():
             institucion TEXT,
             status TEXT,
             processed_at TEXT,
-            raw_text TEXT
+            raw_text TEXT,
+            confidence_nombre REAL,
+            confidence_codigo_estudiante REAL,
+            confidence_carrera REAL,
+            confidence_institucion REAL,
+            error TEXT,
+            created_at TEXT
         )
     ''')
-    conn.commit()
-    conn.close()
 
-def save_result_to_db(data):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    existing = {row[1] for row in c.execute('PRAGMA table_info(resultados)')}
+    for column, column_type in MIGRATED_COLUMNS.items():
+        if column not in existing:
+            c.execute(f'ALTER TABLE resultados ADD COLUMN {column} {column_type}')
+
+    c.execute('CREATE INDEX IF NOT EXISTS idx_resultados_status_processed ON resultados (status, processed_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_resultados_created ON resultados (created_at)')
     c.execute('''
-        INSERT OR REPLACE INTO resultados (
-            job_id, nombre, codigo_estudiante, carrera, institucion,
-            status, processed_at, raw_text
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
+        CREATE TABLE IF NOT EXISTS lotes (
+            batch_id TEXT PRIMARY KEY,
+            total INTEGER,
+            created_at TEXT
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS lote_trabajos (
+            batch_id TEXT,
+            job_id TEXT,
+            position INTEGER,
+            original_filename TEXT,
+            PRIMARY KEY (batch_id, job_id)
+        )
+    ''')
+    # Result files compacted into archive segments (see storage.py)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS resultados_archivados (
+            job_id TEXT PRIMARY KEY,
+            segment TEXT
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_archivados_segment ON resultados_archivados (segment)')
+    conn.commit()
+    init_search_index(conn)
+
+
+def init_search_index(conn):
+    """Create the full-text index, indexing the existing results the first time"""
+    global search_index_enabled
+    created = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'resultados_fts'").fetchone() is None
+    try:
+        with conn:
+            conn.execute(SEARCH_INDEX_SQL)
+            for trigger_sql in SEARCH_TRIGGERS_SQL:
+                conn.execute(trigger_sql)
+            if created:
+                conn.execute("INSERT INTO resultados_fts (resultados_fts) VALUES ('rebuild')")
+    except sqlite3.OperationalError as e:
+        print(f"Full-text search disabled (SQLite without FTS5?): {e}")
+        return
+    search_index_enabled = True
+
+
+def _result_row(data):
+    confidence = data.get('confidence') or {}
+    return (
         data.get('job_id'),
         data.get('nombre'),
         data.get('codigo_estudiante'),
@@ -36,7 +231,338 @@ def save_result_to_db(data):
         data.get('institucion'),
         data.get('status'),
         data.get('processed_at'),
-        data.get('raw_text')
-    ))
-    conn.commit()
-    conn.close()
+        data.get('raw_text'),
+        *(confidence.get(field) for field in CONFIDENCE_FIELDS),
+        data.get('error'),
+        data.get('created_at') or time.strftime("%Y-%m-%d %H:%M:%S")
+    )
+
+
+def save_result_to_db(data):
+    conn = get_connection()
+    with conn:
+        conn.execute(UPSERT_RESULT_SQL, _result_row(data))
+
+
+def save_results_to_db(results):
+    """Write several results in a single transaction"""
+    conn = get_connection()
+    with conn:
+        conn.executemany(UPSERT_RESULT_SQL, [_result_row(data) for data in results])
+
+
+def _row_to_result(row):
+    result = {
+        "job_id": row["job_id"],
+        "nombre": row["nombre"],
+        "codigo_estudiante": row["codigo_estudiante"],
+        "carrera": row["carrera"],
+        "institucion": row["institucion"],
+        "status": row["status"],
+        "processed_at": row["processed_at"],
+        "raw_text": row["raw_text"],
+        "confidence": {
+            field: row[f"confidence_{field}"] for field in CONFIDENCE_FIELDS
+        }
+    }
+    if row["error"]:
+        result["error"] = row["error"]
+    return result
+
+
+def get_result(job_id):
+    """Return the stored result of a job as a dict, or None if not finished"""
+    conn = get_connection()
+    row = conn.execute('SELECT * FROM resultados WHERE job_id = ?', (job_id,)).fetchone()
+    return _row_to_result(row) if row else None
+
+
+def get_raw_text_page(after_job_id='', limit=500, status=None):
+    """
+    Next page of stored transcriptions, ordered by job_id (keyset
+    pagination, so a scan can resume from the last job_id it handled).
+    Returns rows with job_id, raw_text, the extracted fields and their
+    confidences.
+    """
+    conn = get_connection()
+    query = f'''
+        SELECT job_id, raw_text, nombre, codigo_estudiante, carrera, institucion,
+               {', '.join(f"confidence_{field}" for field in CONFIDENCE_FIELDS)}
+        FROM resultados
+        WHERE job_id > ? AND raw_text IS NOT NULL
+    '''
+    params = [after_job_id]
+    if status:
+        query += ' AND status = ?'
+        params.append(status)
+    query += ' ORDER BY job_id LIMIT ?'
+    params.append(limit)
+    return conn.execute(query, params).fetchall()
+
+
+def search_results(text, field=None, status=None, limit=20):
+    """
+    Results whose extracted fields contain every word of text (words may
+    be prefixes: "mar lop" finds "María López"), newest first. field
+    limits the search to one of SEARCH_FIELDS. Every match contains all
+    the words, so relevance ranking is skipped: it would score every
+    match, while rowid order stops after limit rows.
+    """
+    terms = SEARCH_TERM_PATTERN.findall(text)
+    if not terms:
+        return []
+    conn = get_connection()
+    if search_index_enabled:
+        match = " ".join(f'"{term}"*' for term in terms)
+        if field:
+            match = f"{field} : ({match})"
+        query = '''
+            SELECT r.* FROM resultados_fts
+            JOIN resultados r ON r.rowid = resultados_fts.rowid
+            WHERE resultados_fts MATCH ?
+        '''
+        params = [match]
+        if status:
+            query += ' AND r.status = ?'
+            params.append(status)
+        query += ' ORDER BY resultados_fts.rowid DESC LIMIT ?'
+    else:
+        fields = [field] if field else SEARCH_FIELDS
+        conditions = ["(" + " OR ".join(f"{name} LIKE ?" for name in fields) + ")" for _ in terms]
+        query = f'SELECT * FROM resultados WHERE {" AND ".join(conditions)}'
+        params = [f"%{term}%" for term in terms for _ in fields]
+        if status:
+            query += ' AND status = ?'
+            params.append(status)
+        query += ' ORDER BY rowid DESC LIMIT ?'
+    params.append(limit)
+    return [_row_to_result(row) for row in conn.execute(query, params)]
+
+
+def iter_result_rows(after_job_id='', status=None, since=None, page_size=1000):
+    """
+    Yield every stored result as a tuple of EXPORT_COLUMNS, ordered by
+    job_id. Pages are separate keyset queries (job_id > last one seen), so
+    memory stays flat and no read transaction is held between pages.
+    """
+    conn = get_connection()
+    query = f'SELECT {", ".join(EXPORT_COLUMNS)} FROM resultados WHERE job_id > ?'
+    filters = []
+    if status:
+        query += ' AND status = ?'
+        filters.append(status)
+    if since:
+        query += ' AND processed_at >= ?'
+        filters.append(since)
+    query += ' ORDER BY job_id LIMIT ?'
+
+    while True:
+        rows = conn.execute(query, [after_job_id, *filters, page_size]).fetchall()
+        for row in rows:
+            yield tuple(row)
+        if len(rows) < page_size:
+            return
+        after_job_id = rows[-1][0]
+
+
+def count_raw_texts(after_job_id='', status=None):
+    conn = get_connection()
+    query = 'SELECT COUNT(*) FROM resultados WHERE job_id > ? AND raw_text IS NOT NULL'
+    params = [after_job_id]
+    if status:
+        query += ' AND status = ?'
+        params.append(status)
+    return conn.execute(query, params).fetchone()[0]
+
+
+def update_extracted_fields(results):
+    """
+    Overwrite the extracted fields and confidences of existing results
+    in a single transaction. results: list of extract_fields() dicts
+    with their job_id.
+    """
+    conn = get_connection()
+    with conn:
+        conn.executemany(UPDATE_FIELDS_SQL, [
+            (
+                data.get('nombre'), data.get('codigo_estudiante'),
+                data.get('carrera'), data.get('institucion'),
+                *((data.get('confidence') or {}).get(field) for field in CONFIDENCE_FIELDS),
+                data['job_id']
+            )
+            for data in results
+        ])
+
+
+def get_job_statuses(job_ids):
+    """Map job_id -> (status, created_at) for the given jobs that have a result"""
+    conn = get_connection()
+    statuses = {}
+    job_ids = list(job_ids)
+    # Stay under SQLite's limit of bound parameters per statement
+    for start in range(0, len(job_ids), 500):
+        chunk = job_ids[start:start + 500]
+        rows = conn.execute(
+            f'SELECT job_id, status, created_at FROM resultados WHERE job_id IN ({",".join("?" * len(chunk))})',
+            chunk
+        )
+        statuses.update({row['job_id']: (row['status'], row['created_at']) for row in rows})
+    return statuses
+
+
+class ResultWriter:
+    """
+    Groups results written by concurrent worker threads into single
+    transactions.
+
+    save() blocks until the result is committed, so callers can still ack
+    the message only after the row is durable. A background thread collects
+    up to batch_size pending results, waiting at most linger_ms for more to
+    arrive, and commits them together.
+    """
+
+    def __init__(self, batch_size=DB_WRITE_BATCH_SIZE, linger_ms=DB_WRITE_BATCH_LINGER_MS):
+        self.batch_size = max(1, batch_size)
+        self.linger = linger_ms / 1000.0
+        self._pending = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def save(self, data):
+        """Queue a result and wait until it has been committed"""
+        future = Future()
+        self._pending.put((data, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._pending.get()]
+            deadline = time.monotonic() + self.linger
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                save_results_to_db([data for data, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for _, future in batch:
+                    future.set_result(None)
+
+
+def create_batch(batch_id, items, created_at):
+    """
+    Register a batch and its jobs.
+    items: list of (job_id, original_filename) in upload order
+    """
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            'INSERT INTO lotes (batch_id, total, created_at) VALUES (?, ?, ?)',
+            (batch_id, len(items), created_at)
+        )
+        conn.executemany('''
+            INSERT INTO lote_trabajos (batch_id, job_id, position, original_filename)
+            VALUES (?, ?, ?, ?)
+        ''', [(batch_id, job_id, position, original) for position, (job_id, original) in enumerate(items)])
+
+
+def get_batch_progress(batch_id):
+    """Return aggregated status counts for a batch, or None if it does not exist"""
+    conn = get_connection()
+    batch = conn.execute('SELECT total, created_at FROM lotes WHERE batch_id = ?', (batch_id,)).fetchone()
+    if not batch:
+        return None
+
+    counts = {row[0]: row[1] for row in conn.execute('''
+        SELECT r.status, COUNT(*)
+        FROM lote_trabajos t
+        JOIN resultados r ON r.job_id = t.job_id
+        WHERE t.batch_id = ?
+        GROUP BY r.status
+    ''', (batch_id,))}
+
+    total = batch[0]
+    completed = counts.get('completado', 0)
+    errors = counts.get('error', 0)
+    return {
+        "batch_id": batch_id,
+        "created_at": batch[1],
+        "total": total,
+        "completados": completed,
+        "errores": errors,
+        "procesando": total - completed - errors,
+        "progreso": round((completed + errors) * 100.0 / total, 1) if total else 100.0
+    }
+
+
+def get_batch_results(batch_id):
+    """Return all finished result rows of a batch, in upload order"""
+    conn = get_connection()
+    rows = conn.execute('''
+        SELECT t.original_filename, r.*
+        FROM lote_trabajos t
+        JOIN resultados r ON r.job_id = t.job_id
+        WHERE t.batch_id = ?
+        ORDER BY t.position
+    ''', (batch_id,)).fetchall()
+    results = []
+    for row in rows:
+        result = _row_to_result(row)
+        result["original_filename"] = row["original_filename"]
+        results.append(result)
+    return results
+
+
+def add_archived_results(segment, job_ids):
+    """Record which archive segment holds each compacted result file"""
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            'INSERT OR REPLACE INTO resultados_archivados (job_id, segment) VALUES (?, ?)',
+            [(job_id, segment) for job_id in job_ids]
+        )
+
+
+def get_archive_segment(job_id):
+    """Name of the archive segment holding a job's result file, or None"""
+    conn = get_connection()
+    row = conn.execute('SELECT segment FROM resultados_archivados WHERE job_id = ?', (job_id,)).fetchone()
+    return row[0] if row else None
+
+
+def delete_archived_segment(segment):
+    conn = get_connection()
+    with conn:
+        conn.execute('DELETE FROM resultados_archivados WHERE segment = ?', (segment,))
+
+
+def delete_results(job_ids):
+    """Delete the results of some jobs in a single transaction"""
+    conn = get_connection()
+    with conn:
+        conn.executemany('DELETE FROM resultados WHERE job_id = ?', [(job_id,) for job_id in job_ids])
+
+
+def delete_results_before(cutoff):
+    """
+    Delete results processed before cutoff ('YYYY-MM-DD HH:MM:SS') and
+    batches created before it. Returns the number of deleted results.
+    """
+    conn = get_connection()
+    with conn:
+        deleted = conn.execute('DELETE FROM resultados WHERE processed_at < ?', (cutoff,)).rowcount
+        conn.execute('''
+            DELETE FROM lote_trabajos WHERE batch_id IN (
+                SELECT batch_id FROM lotes WHERE created_at < ?
+            )
+        ''', (cutoff,))
+        conn.execute('DELETE FROM lotes WHERE created_at < ?', (cutoff,))
+    return deleted
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Bulk reprocessing of stored results, after tuning the prompt or the field
+extractor.
+
+    python reprocess.py extract                  # re-extract fields from every raw_text
+    python reprocess.py extract --resume         # continue an interrupted run
+    python reprocess.py ocr --status error       # re-run OCR on the uploads that failed
+    python reprocess.py ocr --since "2025-05-01" --limit 200 --concurrency 2
+
+"extract" never calls the model: it streams raw_text rows in job_id order,
+runs the extractor in a process pool and writes each page back in one
+transaction. "ocr" sends uploads through the worker's process_job (skipping
+the result cache) with bounded concurrency. "extract" saves a checkpoint
+after every page, "ocr" every OCR_CHECKPOINT_EVERY jobs and on exit, so
+--resume picks up where an interrupted run stopped.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BASE_DIR, 'worker'))
+
+from database import (
+    init_db, get_raw_text_page, count_raw_texts, update_extracted_fields, get_job_statuses
+)
+from field_extractor import extract, FIELDS
+from storage import iter_uploads
+
+CHECKPOINT_DIR = os.path.join(BASE_DIR, 'data')
+
+# Rows handed to a pool process at a time
+EXTRACT_CHUNK_SIZE = 200
+# Finished OCR jobs between two checkpoint writes
+OCR_CHECKPOINT_EVERY = 50
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Reprocesa resultados guardados")
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+
+    extract_parser = subparsers.add_parser('extract', help="Re-extrae los campos de raw_text (sin modelo)")
+    extract_parser.add_argument('--status', help="Solo resultados con este estado (p. ej. completado)")
+    extract_parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                                help="Procesos para la extracción")
+    extract_parser.add_argument('--page-size', type=int, default=2000, help="Filas por transacción")
+    extract_parser.add_argument('--dry-run', action='store_true', help="Solo contar los cambios")
+
+    ocr_parser = subparsers.add_parser('ocr', help="Vuelve a pasar imágenes subidas por el modelo")
+    ocr_parser.add_argument('--status', help="Solo trabajos con este estado ('sin-resultado' para los que no tienen)")
+    ocr_parser.add_argument('--since', help="Solo trabajos creados desde esta fecha (YYYY-MM-DD)")
+    ocr_parser.add_argument('--job-id', action='append', default=[], help="Trabajo concreto (repetible)")
+    ocr_parser.add_argument('--limit', type=int, help="Máximo de imágenes")
+    ocr_parser.add_argument('--concurrency', type=int, default=1, help="Imágenes en paralelo")
+
+    for sub in (extract_parser, ocr_parser):
+        sub.add_argument('--resume', action='store_true', help="Continuar desde el último checkpoint")
+        sub.add_argument('--checkpoint', help="Archivo de checkpoint (por defecto data/reprocess_<modo>.json)")
+    return parser.parse_args()
+
+
+def load_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_checkpoint(path, checkpoint):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(temp_path, path)
+
+
+def print_progress(done, total, started, extra=""):
+    elapsed = time.perf_counter() - started
+    rate = done / elapsed if elapsed else 0.0
+    percent = done * 100.0 / total if total else 100.0
+    print(f"  {done}/{total} ({percent:.1f}%) - {rate:,.0f}/s{extra}", flush=True)
+
+
+def extract_chunk(rows):
+    """
+    Pool process entry point: rows are (job_id, raw_text, *old field
+    values, *old confidences)
+    """
+    results = []
+    for job_id, raw_text, *old in rows:
+        old_values, old_confidences = old[:len(FIELDS)], old[len(FIELDS):]
+        data = extract(raw_text)
+        data["job_id"] = job_id
+        data["changed"] = (
+            [data[field] for field in FIELDS] != [value or "" for value in old_values]
+            or [data["confidence"][field] for field in FIELDS] != list(old_confidences)
+        )
+        del data["raw_text"]
+        results.append(data)
+    return results
+
+
+def run_extract(args, checkpoint_path):
+    checkpoint = load_checkpoint(checkpoint_path) if args.resume else {}
+    after = checkpoint.get("last_job_id", "")
+    done = checkpoint.get("processed", 0)
+    changed = checkpoint.get("changed", 0)
+    total = done + count_raw_texts(after, args.status)
+    print(f"Re-extrayendo campos de {total - done} resultados con {args.processes} procesos"
+          + (f" (continuando tras {after})" if after else "") + "...")
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max(1, args.processes)) as pool:
+        while True:
+            rows = get_raw_text_page(after, args.page_size, args.status)
+            if not rows:
+                break
+            rows = [tuple(row) for row in rows]
+            # Pages are processed in parallel chunks but written in order
+            futures = deque(
+                pool.submit(extract_chunk, rows[start:start + EXTRACT_CHUNK_SIZE])
+                for start in range(0, len(rows), EXTRACT_CHUNK_SIZE)
+            )
+            results = []
+            while futures:
+                results.extend(futures.popleft().result())
+
+            updates = [data for data in results if data.pop("changed")]
+            if updates and not args.dry_run:
+                update_extracted_fields(updates)
+
+            after = rows[-1][0]
+            done += len(rows)
+            changed += len(updates)
+            if not args.dry_run:
+                save_checkpoint(checkpoint_path, {"last_job_id": after, "processed": done, "changed": changed})
+            print_progress(done, total, started, f", {changed} con cambios")
+
+    action = "cambiarían" if args.dry_run else "actualizados"
+    print(f"✅ {done} resultados revisados, {changed} {action}")
+
+
+def find_uploads(args):
+    """(job_id, path) of the uploads matching the filters, in job_id order"""
+    uploads = dict(iter_uploads())
+
+    if args.job_id:
+        wanted = set(args.job_id)
+        uploads = {job_id: path for job_id, path in uploads.items() if job_id in wanted}
+
+    if args.status or args.since:
+        statuses = get_job_statuses(uploads)
+        selected = {}
+        for job_id, path in uploads.items():
+            status, created_at = statuses.get(job_id, ('sin-resultado', None))
+            if args.status and status != args.status:
+                continue
+            if args.since and (created_at or '') < args.since:
+                continue
+            selected[job_id] = path
+        uploads = selected
+
+    jobs = sorted(uploads.items())
+    return jobs[:args.limit] if args.limit else jobs
+
+
+def run_ocr(args, checkpoint_path):
+    # Imported here: loading the worker opens the result writer and cache
+    import ocr_worker
+
+    checkpoint = load_checkpoint(checkpoint_path) if args.resume else {}
+    # Jobs that ended in "error" are left out, so --resume runs them again
+    finished = set(checkpoint.get("done", []))
+    jobs = [job for job in find_uploads(args) if job[0] not in finished]
+    total = len(finished) + len(jobs)
+    processed = len(finished)
+    statuses = checkpoint.get("statuses", {})
+    print(f"Re-procesando {len(jobs)} imágenes con el modelo (concurrencia {args.concurrency})...")
+
+    def run(job_id, path):
+        try:
+            return ocr_worker.process_job({"job_id": job_id, "filename": path, "refresh": True})
+        except Exception as e:
+            print(f"  ❌ {job_id}: {e}")
+            return "error"
+
+    started = time.perf_counter()
+    pending = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+            futures = {pool.submit(run, job_id, path): job_id for job_id, path in jobs}
+            for future in as_completed(futures):
+                status = future.result()
+                if status != "error":
+                    finished.add(futures[future])
+                statuses[status] = statuses.get(status, 0) + 1
+                processed += 1
+                pending += 1
+                if pending >= OCR_CHECKPOINT_EVERY:
+                    save_checkpoint(checkpoint_path, {"done": list(finished), "statuses": statuses})
+                    pending = 0
+                print_progress(processed, total, started, f", estados: {statuses}")
+    finally:
+        # Also on Ctrl+C, so --resume skips the jobs finished since the last write
+        if pending:
+            save_checkpoint(checkpoint_path, {"done": list(finished), "statuses": statuses})
+
+    print(f"✅ {processed} imágenes re-procesadas: {statuses}")
+
+
+def main():
+    args = parse_args()
+    init_db()
+    checkpoint_path = args.checkpoint or os.path.join(CHECKPOINT_DIR, f"reprocess_{args.mode}.json")
+    try:
+        if args.mode == 'extract':
+            run_extract(args, checkpoint_path)
+        else:
+            run_ocr(args, checkpoint_path)
+    except KeyboardInterrupt:
+        print(f"\nInterrumpido. Continúa con --resume (checkpoint en {checkpoint_path})")
+        sys.exit(130)
+
+
+if __name__ == '__main__':
+    main()
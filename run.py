@@ -12,10 +12,18 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
+from shared.config import (
+    WORKER_MIN_PROCESSES, WORKER_MAX_PROCESSES,
+    AUTOSCALE_BACKLOG_PER_WORKER, AUTOSCALE_INTERVAL_SECONDS,
+    AUTOSCALE_SCALE_DOWN_DELAY, WORKER_DRAIN_TIMEOUT, STORAGE_SWEEP_INTERVAL
+)
+from shared.rabbitmq import get_queues_stats
+
 # Define paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 API_PATH = os.path.join(BASE_DIR, 'api', 'app.py')
 WORKER_PATH = os.path.join(BASE_DIR, 'worker', 'ocr_worker.py')
+STORAGE_PATH = os.path.join(BASE_DIR, 'storage.py')
 UPLOAD_DIR = os.path.join(BASE_DIR, 'data', 'uploads')
 RESULTS_DIR = os.path.join(BASE_DIR, 'data', 'resultados')
 
@@ -26,6 +34,10 @@ os.makedirs(RESULTS_DIR, exist_ok=True)
 # Global variables to track running processes
 processes = []
 
+# Backoff for restarting crashed workers
+RESTART_MAX_BACKOFF = 60
+RESTART_RESET_SECONDS = 60
+
 
 def is_port_in_use(port):
     """Verifica si un puerto está en uso"""
@@ -82,19 +94,150 @@ def start_api():
     return api_process
 
 
-def start_worker():
-    """Inicia un proceso worker para procesar las imágenes"""
-    print("\n🚀 Iniciando Worker OCR...")
-    # Iniciar el proceso worker
-    worker_process = subprocess.Popen([sys.executable, WORKER_PATH])
-    processes.append(worker_process)
-    print(f"✅ Worker OCR funcionando (PID: {worker_process.pid})")
-    return worker_process
+class WorkerSupervisor:
+    """
+    Keeps a set of worker processes running.
+
+    Crashed workers are restarted with exponential backoff. With
+    max_workers > min_workers the number of workers follows the RabbitMQ
+    backlog: one more worker per `backlog_per_worker` waiting messages,
+    scaling down one at a time once the backlog stayed low for a while.
+    Stopping a worker sends SIGTERM so it drains its in-flight jobs.
+    """
+
+    def __init__(self, min_workers, max_workers, concurrency=None,
+                 backlog_per_worker=AUTOSCALE_BACKLOG_PER_WORKER,
+                 scale_interval=AUTOSCALE_INTERVAL_SECONDS,
+                 scale_down_delay=AUTOSCALE_SCALE_DOWN_DELAY,
+                 drain_timeout=WORKER_DRAIN_TIMEOUT):
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.concurrency = concurrency
+        self.backlog_per_worker = max(1, backlog_per_worker)
+        self.scale_interval = scale_interval
+        self.scale_down_delay = scale_down_delay
+        self.drain_timeout = drain_timeout
+
+        self.target = self.min_workers
+        self.workers = []    # running worker processes
+        self.draining = []   # (process, deadline) of workers asked to stop
+        self.restarts = []   # (restart_at, failure_count) of crashed workers
+        self.last_scale_check = 0
+        self.low_backlog_since = None
+        self.stopping = False
+
+    @property
+    def autoscaling(self):
+        return self.max_workers > self.min_workers
+
+    def spawn_worker(self, failures=0):
+        command = [sys.executable, WORKER_PATH]
+        if self.concurrency:
+            command += ['--concurrency', str(self.concurrency)]
+        process = subprocess.Popen(command)
+        self.workers.append({"process": process, "started_at": time.time(), "failures": failures})
+        print(f"✅ Worker OCR funcionando (PID: {process.pid})")
+
+    def start(self):
+        print(f"\n🚀 Iniciando {self.target} worker(s) OCR...")
+        if self.autoscaling:
+            print(f"   Autoescalado entre {self.min_workers} y {self.max_workers} workers")
+        for _ in range(self.target):
+            self.spawn_worker()
+
+    def check(self):
+        """Called periodically from the main loop"""
+        now = time.time()
+
+        # Crashed workers: schedule a restart with backoff
+        for worker in list(self.workers):
+            code = worker["process"].poll()
+            if code is None:
+                continue
+            self.workers.remove(worker)
+            # A worker that ran for a while is considered healthy again
+            failures = 0 if now - worker["started_at"] > RESTART_RESET_SECONDS else worker["failures"] + 1
+            delay = min(RESTART_MAX_BACKOFF, 2 ** failures)
+            print(f"⚠️ Worker {worker['process'].pid} terminó con código {code}, reiniciando en {delay}s")
+            self.restarts.append((now + delay, failures))
+
+        for restart in list(self.restarts):
+            if restart[0] <= now and not self.stopping:
+                self.restarts.remove(restart)
+                if len(self.workers) + len(self.restarts) < self.target:
+                    self.spawn_worker(failures=restart[1])
+
+        # Draining workers that outlived their deadline are killed
+        for process, deadline in list(self.draining):
+            if process.poll() is not None:
+                self.draining.remove((process, deadline))
+            elif now > deadline:
+                print(f"  Worker {process.pid} no terminó a tiempo, forzando cierre")
+                process.kill()
+                self.draining.remove((process, deadline))
+
+        if self.stopping:
+            return
+
+        if self.autoscaling and now - self.last_scale_check >= self.scale_interval:
+            self.last_scale_check = now
+            self.autoscale(now)
+
+    def autoscale(self, now):
+        try:
+            # Interactive plus bulk shards
+            backlog = sum(ready for ready, _ in get_queues_stats().values())
+        except Exception as e:
+            print(f"⚠️ No se pudo consultar la cola: {e!r}")
+            return
+
+        wanted = -(-backlog // self.backlog_per_worker)  # ceil
+        wanted = max(self.min_workers, min(self.max_workers, wanted))
+
+        if wanted > self.target:
+            self.low_backlog_since = None
+            print(f"📈 {backlog} mensajes en cola, escalando a {wanted} workers")
+            for _ in range(wanted - self.target):
+                self.spawn_worker()
+            self.target = wanted
+        elif wanted < self.target:
+            if self.low_backlog_since is None:
+                self.low_backlog_since = now
+            elif now - self.low_backlog_since >= self.scale_down_delay:
+                self.low_backlog_since = now
+                self.target -= 1
+                print(f"📉 {backlog} mensajes en cola, reduciendo a {self.target} workers")
+                if self.workers:
+                    self.stop_worker(self.workers.pop())
+        else:
+            self.low_backlog_since = None
+
+    def stop_worker(self, worker):
+        """Ask a worker to finish its in-flight jobs and exit"""
+        process = worker["process"]
+        if process.poll() is None:
+            process.send_signal(signal.SIGTERM)
+            print(f"  Enviada señal de parada al worker {process.pid}")
+            self.draining.append((process, time.time() + self.drain_timeout))
+
+    def stop_all(self):
+        """Stop every worker and wait for them to drain"""
+        self.stopping = True
+        self.restarts = []
+        while self.workers:
+            self.stop_worker(self.workers.pop())
+        if self.draining:
+            print(f"  Esperando que los workers terminen sus trabajos (máx. {self.drain_timeout}s)...")
+        while self.draining:
+            self.check()
+            time.sleep(0.5)
 
 
-def stop_all_processes():
+def stop_all_processes(supervisor=None):
     """Stop all running processes"""
     print("\n🛑 Deteniendo todos los procesos...")
+    if supervisor is not None:
+        supervisor.stop_all()
     for process in processes:
         if process.poll() is None:  # If process is still running
             try:
@@ -113,7 +256,49 @@ def stop_all_processes():
                 print(f"  Error al detener el proceso {process.pid}: {e}")
 
 
+def start_storage_sweeps(interval=STORAGE_SWEEP_INTERVAL):
+    """Run 'storage.py sweep' (compaction and retention) every interval seconds"""
+    if interval <= 0:
+        return
+
+    def sweep_loop():
+        while True:
+            time.sleep(interval)
+            try:
+                subprocess.run([sys.executable, STORAGE_PATH, 'sweep'], cwd=BASE_DIR)
+            except Exception as e:
+                print(f"⚠️ Error en la limpieza de almacenamiento: {e}")
+
+    threading.Thread(target=sweep_loop, name="storage-sweep", daemon=True).start()
+    print(f"🧹 Limpieza de almacenamiento cada {interval} s")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Inicia la API y los workers OCR")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Número fijo de procesos worker (WORKER_PROCESSES)")
+    parser.add_argument('--min-workers', type=int, default=None,
+                        help="Mínimo de workers con autoescalado")
+    parser.add_argument('--max-workers', type=int, default=None,
+                        help="Máximo de workers con autoescalado (según la cola de RabbitMQ)")
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help="Trabajos en paralelo por worker (WORKER_CONCURRENCY)")
+    parser.add_argument('--drain-timeout', type=int, default=WORKER_DRAIN_TIMEOUT,
+                        help="Segundos para que un worker termine sus trabajos al detenerse")
+    args = parser.parse_args()
+
+    # --workers N fixes the pool size unless min/max are also given
+    if args.min_workers is None:
+        args.min_workers = args.workers or WORKER_MIN_PROCESSES
+    if args.max_workers is None:
+        args.max_workers = args.workers or WORKER_MAX_PROCESSES
+    args.max_workers = max(args.min_workers, args.max_workers)
+    return args
+
+
 def main():
+    args = parse_args()
+
     # Mostrar banner
     print("\n" + "=" * 50)
     print("           SISTEMA OCR INICIANDO")
@@ -127,24 +312,38 @@ def main():
             print("Saliendo.")
             sys.exit(1)
 
-    # Iniciar API y Worker
+    supervisor = WorkerSupervisor(
+        args.min_workers, args.max_workers,
+        concurrency=args.concurrency,
+        drain_timeout=args.drain_timeout
+    )
+
+    # SIGTERM (p. ej. desde systemd o docker stop) se trata igual que Ctrl+C
+    def handle_sigterm(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+    # Iniciar API y Workers
     try:
         start_api()
-        # Iniciar el worker para procesar las imágenes
-        start_worker()
+        # Iniciar los workers para procesar las imágenes
+        supervisor.start()
+        start_storage_sweeps()
 
         print("\n⌛ Presiona Ctrl+C para detener el servidor...")
 
-        # Esperar por KeyboardInterrupt
+        # Vigilar los workers hasta recibir KeyboardInterrupt
         while True:
+            supervisor.check()
             time.sleep(1)
 
     except KeyboardInterrupt:
         print("\n\n⛔ Señal de interrupción recibida")
     finally:
-        stop_all_processes()
+        stop_all_processes(supervisor)
         print("\n✨ Sistema OCR detenido")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
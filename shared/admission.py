@@ -0,0 +1,210 @@
+import math
+import time
+import threading
+
+from shared.config import (
+    ADMISSION_MAX_WAIT_SECONDS, ADMISSION_MAX_BULK_WAIT_SECONDS, ADMISSION_MAX_QUEUE_DEPTH,
+    ADMISSION_DEFAULT_SERVICE_SECONDS, ADMISSION_STATS_TTL, PRIORITY_WEIGHTS, WORKER_CONCURRENCY
+)
+from shared.metrics import REGISTRY, read_snapshots
+from shared.rabbitmq import get_queues_stats, JOB_QUEUES, PRIORITY_INTERACTIVE, PRIORITY_BULK
+
+# Worker histogram the service time is derived from
+JOB_DURATION_METRIC = 'ocr_job_duration_seconds'
+# Worker gauge with the jobs each worker runs in parallel
+WORKER_CONCURRENCY_METRIC = 'ocr_worker_concurrency'
+# Retry-After bounds, in seconds
+RETRY_AFTER_MIN = 1
+RETRY_AFTER_MAX = 3600
+# Retry-After when the queues are full and no worker is consuming them
+RETRY_AFTER_NO_WORKERS = 60
+
+ESTIMATED_WAIT = REGISTRY.gauge('ocr_admission_estimated_wait_seconds', 'Estimated wait of a new job, by priority')
+SERVICE_SECONDS = REGISTRY.gauge('ocr_admission_service_seconds', 'Per-job service time observed from the workers')
+REJECTED = REGISTRY.counter('ocr_admission_rejected_total', 'Uploads turned away by admission control, by priority and reason')
+
+
+class Overloaded(Exception):
+    """The queues cannot take more work now; retry_after is in seconds"""
+
+    def __init__(self, message, status_code, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def _retry_after(seconds):
+    return int(min(RETRY_AFTER_MAX, max(RETRY_AFTER_MIN, math.ceil(seconds))))
+
+
+class AdmissionController:
+    """
+    Decides whether the API takes new jobs and estimates how long they
+    will wait.
+
+    Queue depths and consumers come from a broker stats poll (passive
+    declares through stats_source, e.g. the API publisher's queues_stats)
+    cached for stats_ttl seconds. The per-job service time is a moving
+    average of the job durations the workers publish in their metric
+    snapshots, next to their concurrency. A job's wait is the work queued
+    ahead of it in its priority class over the worker slots that class
+    gets by its weight.
+    """
+
+    def __init__(self, max_wait=None, max_queue_depth=ADMISSION_MAX_QUEUE_DEPTH,
+                 default_service_seconds=ADMISSION_DEFAULT_SERVICE_SECONDS, stats_ttl=ADMISSION_STATS_TTL,
+                 stats_source=get_queues_stats):
+        self.max_wait = max_wait or {
+            PRIORITY_INTERACTIVE: ADMISSION_MAX_WAIT_SECONDS,
+            PRIORITY_BULK: ADMISSION_MAX_BULK_WAIT_SECONDS,
+        }
+        self.max_queue_depth = max_queue_depth
+        self.default_service_seconds = default_service_seconds
+        self.stats_ttl = stats_ttl
+        self.stats_source = stats_source
+        self._queue_stats = {}
+        # priority -> messages ready, including jobs published since the last poll
+        self._depths = {}
+        self._consumers = 0
+        self._service_seconds = None
+        # Mean concurrency the workers publish; None until one has
+        self._worker_concurrency = None
+        # process -> (sum, count) of its job duration histogram at the last poll
+        self._job_totals = {}
+        self._checked_at = None
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+
+    @property
+    def service_seconds(self):
+        return self._service_seconds or self.default_service_seconds
+
+    def refresh(self):
+        if self._checked_at is not None and time.monotonic() - self._checked_at < self.stats_ttl:
+            return
+        # One request thread polls; the others go on with the previous figures
+        if not self._refreshing.acquire(blocking=False):
+            return
+        try:
+            self._checked_at = time.monotonic()
+            try:
+                stats = self.stats_source()
+            except Exception as e:
+                # Nothing is enforced on figures we could not read
+                print(f"Could not read queue depth: {e!r}")
+            else:
+                depths = {}
+                for queue, (ready, _) in stats.items():
+                    priority = JOB_QUEUES.get(queue, PRIORITY_BULK)
+                    depths[priority] = depths.get(priority, 0) + ready
+                # Every worker consumes every job queue; the interactive one
+                # is never sharded, so its consumers are the workers
+                consumers = max((consumers for queue, (_, consumers) in stats.items()
+                                 if JOB_QUEUES.get(queue) == PRIORITY_INTERACTIVE), default=0)
+                with self._lock:
+                    self._queue_stats = stats
+                    self._depths = depths
+                    self._consumers = consumers
+            self._read_worker_snapshots()
+        finally:
+            self._refreshing.release()
+
+    def _read_worker_snapshots(self):
+        """
+        Average duration of the jobs the workers finished since the last
+        poll, and their mean concurrency
+        """
+        totals = {}
+        concurrencies = []
+        for collected, labels in read_snapshots():
+            total = count = 0
+            for name, _, _, samples in collected:
+                if name == WORKER_CONCURRENCY_METRIC:
+                    concurrencies.extend(value for _, _, value in samples)
+                if name != JOB_DURATION_METRIC:
+                    continue
+                for sample_name, _, value in samples:
+                    if sample_name.endswith('_sum'):
+                        total += value
+                    elif sample_name.endswith('_count'):
+                        count += value
+            totals[dict(labels).get('process')] = (total, count)
+        if concurrencies:
+            self._worker_concurrency = sum(concurrencies) / len(concurrencies)
+
+        seconds = jobs = 0
+        for process, (total, count) in totals.items():
+            previous_total, previous_count = self._job_totals.get(process, (0.0, 0))
+            if count < previous_count:
+                # The worker restarted with fresh counters
+                previous_total, previous_count = 0.0, 0
+            seconds += total - previous_total
+            jobs += count - previous_count
+        self._job_totals = totals
+        if jobs > 0:
+            mean = seconds / jobs
+            self._service_seconds = mean if self._service_seconds is None else 0.7 * self._service_seconds + 0.3 * mean
+        SERVICE_SECONDS.set(self.service_seconds)
+
+    def slots(self, consumers):
+        """Jobs the consuming workers run in parallel"""
+        return consumers * (self._worker_concurrency or WORKER_CONCURRENCY)
+
+    def queue_stats(self):
+        """{queue_name: (messages_ready, consumers)} of the last poll"""
+        self.refresh()
+        with self._lock:
+            return dict(self._queue_stats)
+
+    def estimated_wait(self, priority, count=0):
+        """
+        Seconds until a new job of this priority starts, with count more
+        jobs queued ahead of it. None when no worker is consuming.
+        """
+        self.refresh()
+        with self._lock:
+            depths = dict(self._depths)
+            consumers = self._consumers
+        if consumers == 0:
+            return None
+        # The scheduler splits the slots between the classes with a backlog
+        backlogged = {p for p, depth in depths.items() if depth > 0} | {priority}
+        share = PRIORITY_WEIGHTS.get(priority, 1) / sum(PRIORITY_WEIGHTS.get(p, 1) for p in backlogged)
+        ahead = depths.get(priority, 0) + count
+        wait = ahead * self.service_seconds / (self.slots(consumers) * share)
+        if count == 0:
+            ESTIMATED_WAIT.set(wait, priority=priority)
+        return wait
+
+    def admit(self, priority, count=1):
+        """
+        Estimated wait of count new jobs of this priority; raises
+        Overloaded when they would exceed a limit
+        """
+        self.refresh()
+        with self._lock:
+            depth = sum(self._depths.values())
+            consumers = self._consumers
+
+        if self.max_queue_depth > 0 and depth + count > self.max_queue_depth:
+            REJECTED.inc(priority=priority, reason="queue_depth")
+            if consumers:
+                excess = depth + count - self.max_queue_depth
+                retry_after = excess * self.service_seconds / self.slots(consumers)
+            else:
+                retry_after = RETRY_AFTER_NO_WORKERS
+            raise Overloaded(f"The OCR queues are full ({depth} jobs waiting)", 503, _retry_after(retry_after))
+
+        wait = self.estimated_wait(priority, count - 1)
+        limit = self.max_wait.get(priority, 0)
+        if wait is not None and limit > 0 and wait > limit:
+            REJECTED.inc(priority=priority, reason="estimated_wait")
+            # Roughly when the backlog is short enough again
+            raise Overloaded(f"Estimated wait of {wait:.0f}s exceeds the limit of {limit:.0f}s",
+                             429, _retry_after(wait - limit))
+        return wait
+
+    def record_enqueued(self, priority, count):
+        """Count jobs published since the last poll in the queue depth"""
+        with self._lock:
+            self._depths[priority] = self._depths.get(priority, 0) + count
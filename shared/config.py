@@ -1,13 +1,14 @@
 import os
+import json
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Base application paths
-BASE_DIR = os.path.dirname(os.path.dirname(__file__))
-UPLOAD_DIR = os.path.join(BASE_DIR, 'data', 'uploads')
-RESULTS_DIR = os.path.join(BASE_DIR, 'data', 'resultados')
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UPLOAD_DIR = os.getenv('UPLOAD_DIR', os.path.join(BASE_DIR, 'data', 'uploads'))
+RESULTS_DIR = os.getenv('RESULTS_DIR', os.path.join(BASE_DIR, 'data', 'resultados'))
 
 # Ensure directories exist
 os.makedirs(UPLOAD_DIR, exist_ok=True)
@@ -18,11 +19,192 @@ RABBITMQ_HOST = os.getenv('RABBITMQ_HOST', 'localhost')
 RABBITMQ_PORT = int(os.getenv('RABBITMQ_PORT', 5672))
 RABBITMQ_QUEUE = os.getenv('RABBITMQ_QUEUE', 'ocr_queue')
 
+# Job priorities. RABBITMQ_QUEUE takes interactive jobs (single uploads from
+# the web UI); batch uploads go to BULK_QUEUE, split into BULK_QUEUE_SHARDS
+# queues by the client's fairness key so one big upload cannot hold back
+# everybody else's. Workers pick between the classes by weight.
+BULK_QUEUE = os.getenv('BULK_QUEUE', f'{RABBITMQ_QUEUE}.bulk')
+BULK_QUEUE_SHARDS = max(1, int(os.getenv('BULK_QUEUE_SHARDS', 4)))
+PRIORITY_WEIGHTS = {
+    name.strip(): int(weight)
+    for name, weight in (item.split('=') for item in os.getenv('PRIORITY_WEIGHTS', 'interactive=4,bulk=1').split(','))
+}
+
 # Ollama configuration
 OLLAMA_API_URL = os.getenv('OLLAMA_API_URL', 'http://localhost:11434/api')
 OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', 'qwen2.5vl:7b')  # Default model
+# Several Ollama servers (comma-separated API URLs) share the inference load;
+# defaults to OLLAMA_API_URL alone
+OLLAMA_API_URLS = [url.strip() for url in os.getenv('OLLAMA_API_URLS', OLLAMA_API_URL).split(',') if url.strip()]
+# Seconds between health probes of each server (0 disables them)
+OLLAMA_HEALTH_INTERVAL = float(os.getenv('OLLAMA_HEALTH_INTERVAL', 10))
+# A server is taken out of rotation after this many consecutive failed
+# requests (or one failed probe), for at least OLLAMA_EJECT_SECONDS
+OLLAMA_EJECT_AFTER_FAILURES = int(os.getenv('OLLAMA_EJECT_AFTER_FAILURES', 3))
+OLLAMA_EJECT_SECONDS = float(os.getenv('OLLAMA_EJECT_SECONDS', 30))
+# After this many consecutive failed model requests the worker stops
+# consuming jobs and probes Ollama, every BREAKER_PROBE_INITIAL_SECONDS
+# doubling up to BREAKER_PROBE_MAX_SECONDS, until it answers (0 disables it)
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', 5))
+BREAKER_PROBE_INITIAL_SECONDS = float(os.getenv('BREAKER_PROBE_INITIAL_SECONDS', 5))
+BREAKER_PROBE_MAX_SECONDS = float(os.getenv('BREAKER_PROBE_MAX_SECONDS', 120))
 
 # API configuration
 API_HOST = os.getenv('HOST', '0.0.0.0')
 API_PORT = int(os.getenv('PORT', 5000))
-API_DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
\ No newline at end of file
+API_DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
+
+# Worker configuration
+# Number of OCR jobs a single worker process keeps in flight. The RabbitMQ
+# prefetch window is set to the same value so the broker never hands out more
+# messages than the worker can process concurrently.
+WORKER_CONCURRENCY = max(1, int(os.getenv('WORKER_CONCURRENCY', 1)))
+
+# Failed jobs are retried through the broker instead of sleeping in the
+# worker: the message waits in a delay queue (one per delay, with a queue
+# TTL) and is dead-lettered back to the main queue. After the last attempt
+# it goes to the dead-letter queue for inspection.
+RETRY_MAX_ATTEMPTS = max(1, int(os.getenv('RETRY_MAX_ATTEMPTS', 3)))
+RETRY_DELAYS_SECONDS = [int(delay) for delay in os.getenv('RETRY_DELAYS_SECONDS', '5,15').split(',') if delay.strip()] or [5]
+DEAD_LETTER_QUEUE = os.getenv('DEAD_LETTER_QUEUE', f'{RABBITMQ_QUEUE}.dead')
+
+# Result cache configuration
+# Identical card images (same bytes, model and prompt) reuse the stored
+# extraction instead of calling the model again.
+CACHE_ENABLED = os.getenv('CACHE_ENABLED', 'True').lower() == 'true'
+CACHE_DB_PATH = os.getenv('CACHE_DB_PATH', os.path.join(BASE_DIR, 'data', 'ocr_cache.db'))
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 10000))
+CACHE_TTL_SECONDS = int(os.getenv('CACHE_TTL_SECONDS', 7 * 24 * 3600))
+
+# Ollama client configuration
+# Extra top-level request parameters (e.g. '{"options": {"temperature": 0}}')
+OLLAMA_PARAMETERS = json.loads(os.getenv('OLLAMA_PARAMETERS', '{}'))
+OLLAMA_TIMEOUT = int(os.getenv('OLLAMA_TIMEOUT', 180))
+# Stream tokens and stop generation as soon as the four labelled fields are out
+OLLAMA_STREAM = os.getenv('OLLAMA_STREAM', 'True').lower() == 'true'
+# Keep-alive HTTP connections kept open to Ollama (one per in-flight job)
+OLLAMA_POOL_SIZE = int(os.getenv('OLLAMA_POOL_SIZE', WORKER_CONCURRENCY))
+# How long Ollama keeps the model loaded after each request ('' = server default, 5m)
+OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+# Seconds without any request after which an idle worker pings Ollama to keep
+# the model loaded (0 disables). Keep it below OLLAMA_KEEP_ALIVE.
+KEEP_WARM_INTERVAL = int(os.getenv('KEEP_WARM_INTERVAL', 600))
+# A model load longer than this counts as a cold start
+COLD_START_THRESHOLD_MS = int(os.getenv('COLD_START_THRESHOLD_MS', 3000))
+# Workers on the same host share these to warm the model only once
+MODEL_WARM_MARKER = os.getenv('MODEL_WARM_MARKER', os.path.join(BASE_DIR, 'data', 'ollama_model.warm'))
+
+# OCR engines, cheapest first. Each engine's result is kept only if the
+# required fields reach the minimum confidence (i.e. were labelled and
+# passed validation); otherwise the next engine runs. The last engine's
+# result is always kept. E.g. OCR_ENGINES=tesseract,ollama
+OCR_ENGINES = [name.strip() for name in os.getenv('OCR_ENGINES', 'ollama').split(',') if name.strip()]
+OCR_REQUIRED_FIELDS = [name.strip() for name in os.getenv('OCR_REQUIRED_FIELDS', 'nombre,codigo_estudiante').split(',') if name.strip()]
+OCR_MIN_CONFIDENCE = float(os.getenv('OCR_MIN_CONFIDENCE', 0.9))
+# Model output: 'text' (labelled lines scraped by the field extractor) or
+# 'json' (Ollama's format constraint with a JSON schema of the four fields;
+# the text parser stays as fallback)
+OCR_OUTPUT_FORMAT = os.getenv('OCR_OUTPUT_FORMAT', 'text').lower()
+# Cap on generated tokens per card (0 = model default) and stop sequences
+# (JSON list, e.g. '["\\n\\n\\n"]'), so a model that starts describing the
+# image stops early
+OCR_NUM_PREDICT = int(os.getenv('OCR_NUM_PREDICT', 256))
+OCR_STOP_SEQUENCES = json.loads(os.getenv('OCR_STOP_SEQUENCES', '[]'))
+TESSERACT_LANG = os.getenv('TESSERACT_LANG', 'spa+eng')
+TESSERACT_CONFIG = os.getenv('TESSERACT_CONFIG', '--psm 6')
+
+# Image pre-processing before inference
+# Smaller images mean fewer vision tokens; these knobs trade accuracy for latency.
+PREPROCESS_ENABLED = os.getenv('PREPROCESS_ENABLED', 'True').lower() == 'true'
+PREPROCESS_MAX_SIDE = int(os.getenv('PREPROCESS_MAX_SIDE', 1280))  # 0 disables resizing
+PREPROCESS_AUTOCROP = os.getenv('PREPROCESS_AUTOCROP', 'False').lower() == 'true'
+PREPROCESS_GRAYSCALE = os.getenv('PREPROCESS_GRAYSCALE', 'False').lower() == 'true'
+PREPROCESS_AUTOCONTRAST = os.getenv('PREPROCESS_AUTOCONTRAST', 'False').lower() == 'true'
+PREPROCESS_FORMAT = os.getenv('PREPROCESS_FORMAT', 'JPEG').upper()  # JPEG or WEBP
+PREPROCESS_QUALITY = int(os.getenv('PREPROCESS_QUALITY', 85))
+
+# Uploads are streamed to disk in chunks; larger images are rejected
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', 20 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+# Quality gate: uploads that are not images, too small, blank, over- or
+# underexposed or too blurry are rejected (422) before they are queued.
+# Sharpness is the variance of the Laplacian of the image scaled to
+# 1024 px; 0 disables a check.
+QUALITY_GATE_ENABLED = os.getenv('QUALITY_GATE_ENABLED', 'True').lower() == 'true'
+QUALITY_MIN_SIDE = int(os.getenv('QUALITY_MIN_SIDE', 300))
+QUALITY_MAX_PIXELS = int(os.getenv('QUALITY_MAX_PIXELS', 50_000_000))
+QUALITY_MIN_SHARPNESS = float(os.getenv('QUALITY_MIN_SHARPNESS', 20))
+QUALITY_MIN_CONTRAST = float(os.getenv('QUALITY_MIN_CONTRAST', 8))
+# Largest share of pure white (or pure black) pixels
+QUALITY_MAX_CLIPPED_RATIO = float(os.getenv('QUALITY_MAX_CLIPPED_RATIO', 0.99))
+
+# Batch uploads
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 1000))
+# Limit on the total uncompressed size of a ZIP batch (guards against zip bombs)
+BATCH_MAX_ARCHIVE_BYTES = int(os.getenv('BATCH_MAX_ARCHIVE_BYTES', 500 * 1024 * 1024))
+
+# Admission control: the API estimates how long a new job would wait from
+# the queue depth and the service time the workers report, and turns
+# uploads away (429 with Retry-After) when that exceeds the limit of the
+# job's priority, or (503) when the queues hold more than
+# ADMISSION_MAX_QUEUE_DEPTH messages. 0 disables a limit.
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv('ADMISSION_MAX_WAIT_SECONDS', 600))
+ADMISSION_MAX_BULK_WAIT_SECONDS = float(os.getenv('ADMISSION_MAX_BULK_WAIT_SECONDS', 6 * 3600))
+ADMISSION_MAX_QUEUE_DEPTH = int(os.getenv('ADMISSION_MAX_QUEUE_DEPTH', 50000))
+# Service time assumed until the workers have reported one
+ADMISSION_DEFAULT_SERVICE_SECONDS = float(os.getenv('ADMISSION_DEFAULT_SERVICE_SECONDS', 10))
+# Queue depth and service time are refreshed at most this often
+ADMISSION_STATS_TTL = float(os.getenv('ADMISSION_STATS_TTL', 5))
+
+# RabbitMQ publisher (API side)
+# Number of long-lived connections shared by the API threads
+PUBLISHER_POOL_SIZE = max(1, int(os.getenv('PUBLISHER_POOL_SIZE', 2)))
+PUBLISHER_MAX_ATTEMPTS = int(os.getenv('PUBLISHER_MAX_ATTEMPTS', 2))
+
+# Result database
+DB_PATH = os.path.abspath(os.getenv('DB_PATH', os.path.join(BASE_DIR, 'data', 'ocr_results.db')))
+# Idle connections kept for reuse by short-lived threads (API requests)
+DB_POOL_SIZE = max(1, int(os.getenv('DB_POOL_SIZE', 8)))
+# Results from concurrent worker threads are grouped into one transaction
+DB_WRITE_BATCH_SIZE = int(os.getenv('DB_WRITE_BATCH_SIZE', 50))
+DB_WRITE_BATCH_LINGER_MS = int(os.getenv('DB_WRITE_BATCH_LINGER_MS', 20))
+
+# Storage lifecycle (storage.py)
+# Also write each result as data/resultados/<shard>/<job_id>.json; with False
+# the database is the only copy
+RESULT_FILES_ENABLED = os.getenv('RESULT_FILES_ENABLED', 'True').lower() == 'true'
+# Result files older than this are packed into compressed archive segments (0 = never)
+RESULT_COMPACT_AFTER_DAYS = float(os.getenv('RESULT_COMPACT_AFTER_DAYS', 7))
+# Results (rows, files and archives) and uploaded images are deleted after
+# these many days (0 = keep forever)
+RESULT_RETENTION_DAYS = float(os.getenv('RESULT_RETENTION_DAYS', 0))
+UPLOAD_RETENTION_DAYS = float(os.getenv('UPLOAD_RETENTION_DAYS', 0))
+# Seconds between storage sweeps started by run.py (0 disables them)
+STORAGE_SWEEP_INTERVAL = int(os.getenv('STORAGE_SWEEP_INTERVAL', 3600))
+
+# Result notifications (worker -> API) for push delivery to the browser
+RESULTS_EXCHANGE = os.getenv('RESULTS_EXCHANGE', 'ocr_resultados')
+# Longest time an SSE / long-poll request waits for a result
+RESULT_WAIT_MAX_SECONDS = int(os.getenv('RESULT_WAIT_MAX_SECONDS', 300))
+
+# Worker supervisor (run.py)
+WORKER_PROCESSES = max(1, int(os.getenv('WORKER_PROCESSES', 1)))
+# Autoscaling is enabled when WORKER_MAX_PROCESSES > WORKER_MIN_PROCESSES
+WORKER_MIN_PROCESSES = int(os.getenv('WORKER_MIN_PROCESSES', WORKER_PROCESSES))
+WORKER_MAX_PROCESSES = int(os.getenv('WORKER_MAX_PROCESSES', WORKER_PROCESSES))
+# Waiting messages per worker process before another one is started
+AUTOSCALE_BACKLOG_PER_WORKER = int(os.getenv('AUTOSCALE_BACKLOG_PER_WORKER', 10))
+AUTOSCALE_INTERVAL_SECONDS = int(os.getenv('AUTOSCALE_INTERVAL_SECONDS', 10))
+# Seconds the backlog must stay low before a worker is stopped
+AUTOSCALE_SCALE_DOWN_DELAY = int(os.getenv('AUTOSCALE_SCALE_DOWN_DELAY', 60))
+# Seconds a stopping worker gets to finish its in-flight jobs
+WORKER_DRAIN_TIMEOUT = int(os.getenv('WORKER_DRAIN_TIMEOUT', 300))
+
+# Metrics
+# Worker processes write metric snapshots here; the API merges them in /metrics
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(BASE_DIR, 'data', 'metrics'))
+METRICS_SNAPSHOT_INTERVAL = int(os.getenv('METRICS_SNAPSHOT_INTERVAL', 5))
+# Print one JSON line per job with its timing spans
+METRICS_LOG_SPANS = os.getenv('METRICS_LOG_SPANS', 'True').lower() == 'true'
+GPU_SAMPLE_INTERVAL = int(os.getenv('GPU_SAMPLE_INTERVAL', 15))
@@ -0,0 +1,99 @@
+import time
+from PIL import Image, ImageFilter, ImageStat, UnidentifiedImageError
+
+from shared.config import (
+    QUALITY_GATE_ENABLED, QUALITY_MIN_SIDE, QUALITY_MAX_PIXELS, QUALITY_MIN_SHARPNESS,
+    QUALITY_MIN_CONTRAST, QUALITY_MAX_CLIPPED_RATIO
+)
+from shared.metrics import REGISTRY
+
+QUALITY_CHECKS = REGISTRY.counter('ocr_quality_checks_total', 'Uploads checked by the quality gate, by result (accepted or rejection reason)')
+QUALITY_CHECK_SECONDS = REGISTRY.histogram('ocr_quality_check_seconds', 'Time spent checking the quality of an upload',
+                                           buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+
+ACCEPTED_FORMATS = {'JPEG', 'MPO', 'PNG', 'WEBP', 'BMP', 'TIFF'}
+# Images are analysed at this size, so sharpness does not depend on the resolution
+ANALYSIS_SIDE = 1024
+# Pixel values this close to black or white count as clipped
+CLIPPED_LEVELS = 5
+# Laplacian kernel; the offset keeps negative responses from clipping at 0
+LAPLACIAN = ImageFilter.Kernel((3, 3), [0, 1, 0, 1, -4, 1, 0, 1, 0], scale=1, offset=128)
+
+
+class ImageRejected(ValueError):
+    """The upload is not worth sending to the model; the message says how to fix it"""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+def check_image(path, enabled=QUALITY_GATE_ENABLED):
+    """Raise ImageRejected when the uploaded file fails a quality check"""
+    if not enabled:
+        return
+    started = time.perf_counter()
+    result = "accepted"
+    try:
+        _check_image(path)
+    except ImageRejected as e:
+        result = e.reason
+        raise
+    finally:
+        QUALITY_CHECKS.inc(result=result)
+        QUALITY_CHECK_SECONDS.observe(time.perf_counter() - started)
+
+
+def _check_image(path, min_side=QUALITY_MIN_SIDE, max_pixels=QUALITY_MAX_PIXELS,
+                 min_sharpness=QUALITY_MIN_SHARPNESS, min_contrast=QUALITY_MIN_CONTRAST,
+                 max_clipped=QUALITY_MAX_CLIPPED_RATIO):
+    # Only the header is read here
+    try:
+        image = Image.open(path)
+    except Image.DecompressionBombError:
+        raise ImageRejected("too_large", "The image has too many pixels: send a smaller photo of the card")
+    except (UnidentifiedImageError, OSError):
+        raise ImageRejected("not_an_image", "The file is not an image: send a JPEG, PNG or WEBP photo of the card")
+
+    with image:
+        if image.format not in ACCEPTED_FORMATS:
+            raise ImageRejected("unsupported_format",
+                                f"Unsupported image format {image.format}: send a JPEG, PNG or WEBP photo of the card")
+        width, height = image.size
+        if min(width, height) < min_side:
+            raise ImageRejected("too_small", f"The image is too small ({width}x{height}, at least {min_side} px "
+                                             "on the short side): take the photo closer to the card")
+        if max_pixels > 0 and width * height > max_pixels:
+            raise ImageRejected("too_large", f"The image has too many pixels ({width}x{height}): "
+                                             "send a smaller photo of the card")
+
+        # JPEGs are decoded straight at a reduced scale
+        image.draft('L', (ANALYSIS_SIDE, ANALYSIS_SIDE))
+        try:
+            gray = image.convert('L')
+        except (OSError, SyntaxError) as e:
+            raise ImageRejected("corrupt", f"The image is damaged or truncated ({e}): send it again")
+    gray.thumbnail((ANALYSIS_SIDE, ANALYSIS_SIDE))
+
+    if min_contrast > 0 and ImageStat.Stat(gray).stddev[0] < min_contrast:
+        raise ImageRejected("blank", "The image is blank or almost uniform: make sure the card fills the photo")
+
+    histogram = gray.histogram()
+    pixels = gray.width * gray.height
+    if max_clipped > 0:
+        highlights = sum(histogram[-CLIPPED_LEVELS:]) / pixels
+        if highlights > max_clipped:
+            raise ImageRejected("overexposed", f"The image is overexposed ({highlights:.0%} pure white): "
+                                               "avoid flash glare and direct light on the card")
+        shadows = sum(histogram[:CLIPPED_LEVELS]) / pixels
+        if shadows > max_clipped:
+            raise ImageRejected("underexposed", f"The image is too dark ({shadows:.0%} pure black): "
+                                                "take the photo with more light")
+
+    if min_sharpness > 0:
+        # Filters leave the outermost pixels untouched: they are left out
+        edges = gray.filter(LAPLACIAN).crop((1, 1, gray.width - 1, gray.height - 1))
+        sharpness = ImageStat.Stat(edges).var[0]
+        if sharpness < min_sharpness:
+            raise ImageRejected("blurry", f"The image is too blurry to read (sharpness {sharpness:.0f}, "
+                                          f"at least {min_sharpness:.0f}): hold the camera steady and focus on the card")
@@ -0,0 +1,311 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+from shared.config import METRICS_DIR, METRICS_SNAPSHOT_INTERVAL, METRICS_LOG_SPANS
+
+# Latency buckets in seconds, wide enough for multi-second vision inference
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Snapshots older than this belong to workers that are gone
+SNAPSHOT_STALE_SECONDS = 60
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self._values = {}
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append((f'{self.name}_bucket', key + (('le', repr(float(bound))),), bucket_count))
+                samples.append((f'{self.name}_bucket', key + (('le', '+Inf'),), count))
+                samples.append((f'{self.name}_sum', key, total))
+                samples.append((f'{self.name}_count', key, count))
+        return samples
+
+
+class Registry:
+    """A set of metrics rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, **kwargs)
+            return metric
+
+    def counter(self, name, documentation):
+        return self._get_or_create(Counter, name, documentation)
+
+    def gauge(self, name, documentation):
+        return self._get_or_create(Gauge, name, documentation)
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, buckets=buckets)
+
+    def add_collector(self, collector):
+        """Register a function called before each render/snapshot (to refresh gauges)"""
+        self._collectors.append(collector)
+
+    def collect(self):
+        """Return [(name, type, documentation, samples)] for every metric"""
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"Metrics collector failed: {e!r}")
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return [(m.name, m.type_name, m.documentation, m.samples()) for m in metrics]
+
+    def snapshot(self):
+        """JSON-serialisable copy of every metric, for other processes"""
+        return [
+            {"name": name, "type": type_name, "help": documentation,
+             "samples": [[sample_name, list(map(list, key)), value] for sample_name, key, value in samples]}
+            for name, type_name, documentation, samples in self.collect()
+        ]
+
+
+def render(families):
+    """
+    Render metrics to Prometheus text. families is a list of
+    (collected, extra_labels) pairs, where collected comes from
+    Registry.collect(), so several processes can be merged.
+    """
+    merged = {}
+    for collected, labels in families:
+        for name, type_name, documentation, samples in collected:
+            entry = merged.setdefault(name, (type_name, documentation, []))
+            for sample_name, key, value in samples:
+                entry[2].append((sample_name, tuple(labels) + tuple(tuple(item) for item in key), value))
+
+    lines = []
+    for name, (type_name, documentation, samples) in sorted(merged.items()):
+        lines.append(f'# HELP {name} {documentation}')
+        lines.append(f'# TYPE {name} {type_name}')
+        for sample_name, key, value in samples:
+            lines.append(f'{sample_name}{_format_labels(key)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_snapshot(registry, process_name, directory=METRICS_DIR):
+    """Atomically write this process' metrics to the shared metrics directory"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{process_name}.json')
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({"process": process_name, "written_at": time.time(), "metrics": registry.snapshot()}, f)
+    os.replace(temp_path, path)
+
+
+def read_snapshots(directory=METRICS_DIR):
+    """
+    Load the metric snapshots of the other processes as render() families.
+    Stale snapshots (from workers that stopped) are removed.
+    """
+    families = []
+    if not os.path.isdir(directory):
+        return families
+
+    now = time.time()
+    for filename in os.listdir(directory):
+        if not filename.endswith('.json'):
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if now - snapshot.get("written_at", 0) > SNAPSHOT_STALE_SECONDS:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+
+        collected = [
+            (m["name"], m["type"], m["help"], [(s[0], tuple(map(tuple, s[1])), s[2]) for s in m["samples"]])
+            for m in snapshot["metrics"]
+        ]
+        families.append((collected, (('process', snapshot["process"]),)))
+    return families
+
+
+class SnapshotWriter:
+    """Daemon thread that periodically publishes a worker's metrics to disk"""
+
+    def __init__(self, registry, process_name, interval=METRICS_SNAPSHOT_INTERVAL):
+        self.registry = registry
+        self.process_name = process_name
+        self.interval = interval
+        self._thread = threading.Thread(target=self._run, name="metrics-snapshot", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            try:
+                write_snapshot(self.registry, self.process_name)
+            except Exception as e:
+                print(f"Could not write metrics snapshot: {e!r}")
+            time.sleep(self.interval)
+
+
+# Process-wide registry
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'ocr_stage_duration_seconds', 'Duration of each job processing stage')
+
+_context = threading.local()
+
+
+@contextmanager
+def job_context(job_id, model=None):
+    """
+    Collect the timing spans of one job on this thread. When the block
+    ends, the spans are printed as one JSON line (METRICS_LOG_SPANS).
+    """
+    _context.job = {"job_id": job_id, "model": model, "attempt": 1, "spans": []}
+    started = time.perf_counter()
+    try:
+        yield _context.job
+    finally:
+        job = _context.job
+        _context.job = None
+        if METRICS_LOG_SPANS:
+            print(json.dumps({
+                "event": "job_spans",
+                "job_id": job["job_id"],
+                "model": job["model"],
+                "total_ms": round((time.perf_counter() - started) * 1000, 2),
+                "spans": job["spans"]
+            }, ensure_ascii=False))
+
+
+def set_attempt(attempt):
+    """Tag the following spans of the current job with this attempt number"""
+    job = getattr(_context, 'job', None)
+    if job is not None:
+        job["attempt"] = attempt
+
+
+@contextmanager
+def span(stage):
+    """
+    Time one stage of the current job: recorded in the stage histogram
+    (labelled by stage and model) and in the job's span list (with
+    job_id and attempt number).
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        job = getattr(_context, 'job', None)
+        model = job["model"] if job else None
+        STAGE_SECONDS.observe(elapsed, stage=stage, model=model or '')
+        if job is not None:
+            job["spans"].append({
+                "stage": stage,
+                "attempt": job["attempt"],
+                "ms": round(elapsed * 1000, 2)
+            })
@@ -0,0 +1,35 @@
+# Prompts sent to the vision model.
+#
+# They live in shared/ because the result cache key includes the prompt text:
+# changing the prompt must invalidate cached results in both the API and the
+# worker.
+
+OCR_PROMPT = """This is an OCR task. TRANSCRIBE ALL TEXT from this student ID card image.
+
+DO NOT describe the image. DO NOT count fields.
+DO NOT say what's visible or not visible.
+ONLY TRANSCRIBE THE ACTUAL TEXT you can see on the card.
+
+Look for and transcribe:
+- Student name
+- Student ID number/code
+- Program/major
+- University name
+
+Format each field with a label EXACTLY like this:
+Nombre: [transcribed student name]
+Código: [transcribed student ID number]
+Carrera: [transcribed program/major]
+Institución: [transcribed university name]"""
+
+# OCR_OUTPUT_FORMAT=json: the answer is constrained to the card schema
+# (field_extractor.JSON_SCHEMA), so the prompt only says what goes where.
+OCR_JSON_PROMPT = """This is an OCR task. TRANSCRIBE the text of this student ID card image.
+
+DO NOT describe the image. Answer ONLY with a JSON object with these keys:
+- "nombre": student name
+- "codigo_estudiante": student ID number/code
+- "carrera": program/major
+- "institucion": university name
+
+Use an empty string for a field that is not on the card."""
@@ -0,0 +1,317 @@
+import zlib
+import json
+import time
+import queue
+import threading
+from collections import deque
+
+import pika
+from pika.exceptions import AMQPError, NackError, UnroutableError
+from pika.adapters.blocking_connection import ReturnedMessage
+
+from shared.config import (
+    RABBITMQ_HOST, RABBITMQ_PORT, RABBITMQ_QUEUE,
+    PUBLISHER_POOL_SIZE, PUBLISHER_MAX_ATTEMPTS,
+    BULK_QUEUE, BULK_QUEUE_SHARDS
+)
+from shared.metrics import REGISTRY
+
+PUBLISH_SECONDS = REGISTRY.histogram('ocr_publish_duration_seconds', 'Time to publish and confirm job messages')
+PUBLISH_FAILURES = REGISTRY.counter('ocr_publish_failures_total', 'Publishes that failed after retrying')
+
+# Number of recent publish latencies kept for the percentiles
+LATENCY_WINDOW = 1000
+
+
+def connection_parameters():
+    return pika.ConnectionParameters(
+        host=RABBITMQ_HOST,
+        port=RABBITMQ_PORT
+    )
+
+
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BULK = 'bulk'
+
+# Every queue workers take jobs from, with its priority class
+JOB_QUEUES = {RABBITMQ_QUEUE: PRIORITY_INTERACTIVE}
+JOB_QUEUES.update({f'{BULK_QUEUE}.{shard}': PRIORITY_BULK for shard in range(BULK_QUEUE_SHARDS)})
+
+
+def job_queue(priority=PRIORITY_INTERACTIVE, fairness_key=None):
+    """Queue for a job: bulk jobs are spread over shards by fairness key"""
+    if priority != PRIORITY_BULK:
+        return RABBITMQ_QUEUE
+    shard = zlib.crc32((fairness_key or '').encode('utf-8')) % BULK_QUEUE_SHARDS
+    return f'{BULK_QUEUE}.{shard}'
+
+
+def get_queues_stats(queue_names=tuple(JOB_QUEUES)):
+    """
+    {queue_name: (messages_ready, consumers)} for several queues over one
+    connection. Queues that do not exist yet are left out.
+    """
+    stats = {}
+    connection = pika.BlockingConnection(connection_parameters())
+    try:
+        channel = connection.channel()
+        for name in queue_names:
+            try:
+                result = channel.queue_declare(queue=name, passive=True)
+            except pika.exceptions.ChannelClosedByBroker:
+                # 404: the failed passive declare closed the channel
+                channel = connection.channel()
+                continue
+            stats[name] = (result.method.message_count, result.method.consumer_count)
+        return stats
+    finally:
+        connection.close()
+
+
+def _enable_batch_confirms(connection, channel, on_confirm):
+    """
+    Put a BlockingChannel in confirm mode without making basic_publish
+    wait: on_confirm gets every Basic.Ack / Basic.Nack frame instead.
+
+    BlockingChannel.confirm_delivery() waits for each message's confirm
+    before publishing the next one, so this goes through the underlying
+    asynchronous channel (channel._impl), a pika internal. It is the only
+    place that does; pika is pinned in requirements.txt for it.
+    """
+    selected = []
+    channel._impl.confirm_delivery(ack_nack_callback=on_confirm, callback=selected.append)
+    while not selected:
+        connection.process_data_events(time_limit=1)
+
+
+class PublishError(AMQPError):
+    """publish_many gave up; the first `published` messages were confirmed"""
+
+    def __init__(self, message, published):
+        super().__init__(message)
+        self.published = published
+
+
+class _PublisherChannel:
+    """One long-lived connection + confirm channel, used by one thread at a time"""
+
+    def __init__(self, queues):
+        self.queues = queues
+        self.connection = None
+        self.channel = None
+        # Delivery tags published and not confirmed yet; tags count from 1 per channel
+        self._unconfirmed = set()
+        self.next_tag = 1
+        self._error = None
+
+    @property
+    def is_open(self):
+        return (self.connection is not None and self.connection.is_open
+                and self.channel is not None and self.channel.is_open)
+
+    def open(self):
+        self.close()
+        self.connection = pika.BlockingConnection(connection_parameters())
+        self.channel = self.connection.channel()
+        # Declared once per connection instead of once per publish
+        for name, arguments in self.queues.items():
+            self.channel.queue_declare(queue=name, durable=True, arguments=arguments)
+        # Confirms are tracked here, so a batch waits for them only once
+        _enable_batch_confirms(self.connection, self.channel, self._on_confirm)
+        self.channel.add_on_return_callback(self._on_return)
+
+    def close(self):
+        try:
+            if self.connection is not None and self.connection.is_open:
+                self.connection.close()
+        except Exception:
+            pass
+        self.connection = None
+        self.channel = None
+        self._unconfirmed = set()
+        self.next_tag = 1
+        self._error = None
+
+    def _on_confirm(self, frame):
+        method = frame.method
+        if isinstance(method, pika.spec.Basic.Nack):
+            # Nacked messages stay unconfirmed, so they are published again
+            self._error = NackError([])
+            return
+        if self._error is not None:
+            return
+        if method.multiple:
+            self._unconfirmed = {tag for tag in self._unconfirmed if tag > method.delivery_tag}
+        else:
+            self._unconfirmed.discard(method.delivery_tag)
+
+    def _on_return(self, channel, method, properties, body):
+        # Basic.Return comes before the message's ack
+        self._error = UnroutableError([ReturnedMessage(method, properties, body)])
+
+    def ensure_open(self):
+        """Open the connection if needed; returns True when a new one was made"""
+        if not self.is_open:
+            self.open()
+            return True
+        # Service heartbeats missed while idle; raises if the broker dropped us
+        self.connection.process_data_events(time_limit=0)
+        return False
+
+    def queue_stats(self, name):
+        """(messages_ready, consumers) of a queue, with a passive declare"""
+        result = self.channel.queue_declare(queue=name, passive=True)
+        return result.method.message_count, result.method.consumer_count
+
+    def publish(self, routing_key, messages, properties):
+        """Publish messages back to back, then wait once for the broker to confirm them all"""
+        for message in messages:
+            self.channel.basic_publish(
+                exchange='',
+                routing_key=routing_key,
+                body=json.dumps(message),
+                properties=properties,
+                mandatory=True
+            )
+            self._unconfirmed.add(self.next_tag)
+            self.next_tag += 1
+        while self._unconfirmed and self._error is None:
+            self.connection.process_data_events(time_limit=1)
+        if self._error is not None:
+            raise self._error
+
+    def confirmed_since(self, tag):
+        """How many messages from delivery tag `tag` on are confirmed, in order"""
+        return max(0, min(self._unconfirmed, default=self.next_tag) - tag)
+
+
+class RabbitMQPublisher:
+    """
+    Thread-safe, long-lived RabbitMQ publisher.
+
+    pika's BlockingConnection must not be shared between threads, so the
+    publisher keeps a small pool of connections and hands each one to a
+    single thread at a time. Connections are opened lazily, declare the
+    queues once, publish with confirms and are re-opened automatically when
+    the broker connection is lost.
+    """
+
+    def __init__(self, pool_size=PUBLISHER_POOL_SIZE, queues=None,
+                 max_attempts=PUBLISHER_MAX_ATTEMPTS):
+        self.queues = queues if queues is not None else dict.fromkeys(JOB_QUEUES)
+        self.max_attempts = max(1, max_attempts)
+        self._pool = queue.Queue()
+        for _ in range(pool_size):
+            self._pool.put(_PublisherChannel(self.queues))
+
+        self._stats_lock = threading.Lock()
+        self._latencies_ms = deque(maxlen=LATENCY_WINDOW)
+        self.published = 0
+        self.failures = 0
+        self.connects = 0
+
+    def queues_stats(self, queue_names=tuple(JOB_QUEUES)):
+        """
+        Same as get_queues_stats(), over a pooled connection instead of a
+        new one per call
+        """
+        stats = {}
+        channel = self._pool.get()
+        try:
+            if channel.ensure_open():
+                self._record('connects')
+            for name in queue_names:
+                try:
+                    stats[name] = channel.queue_stats(name)
+                except pika.exceptions.ChannelClosedByBroker:
+                    # 404: the failed passive declare closed the channel
+                    channel.open()
+            return stats
+        except AMQPError:
+            channel.close()
+            raise
+        finally:
+            self._pool.put(channel)
+
+    def publish(self, message, routing_key=RABBITMQ_QUEUE):
+        """Publish a single persistent message and wait for the broker confirm"""
+        self.publish_many([message], routing_key=routing_key)
+
+    def publish_many(self, messages, routing_key=RABBITMQ_QUEUE):
+        """
+        Publish several persistent messages over one channel and wait for
+        the broker confirms once for the whole batch. Raises PublishError,
+        with how many messages were confirmed, if the rest could not be
+        confirmed after retrying.
+        """
+        if not messages:
+            return
+
+        properties = pika.BasicProperties(delivery_mode=2, content_type='application/json')
+        started = time.perf_counter()
+        confirmed = 0
+        channel = self._pool.get()
+        try:
+            for attempt in range(self.max_attempts):
+                first_tag = None
+                try:
+                    if channel.ensure_open():
+                        self._record('connects')
+                    first_tag = channel.next_tag
+                    channel.publish(routing_key, messages[confirmed:], properties)
+                    confirmed = len(messages)
+                    break
+                except AMQPError as e:
+                    # Resume after the last confirmed message so retries don't duplicate jobs
+                    if first_tag is not None:
+                        confirmed += channel.confirmed_since(first_tag)
+                    print(f"RabbitMQ publish failed (attempt {attempt + 1}/{self.max_attempts}): {e!r}")
+                    channel.close()
+                    if attempt == self.max_attempts - 1:
+                        self._record('failures')
+                        PUBLISH_FAILURES.inc()
+                        raise PublishError(f"Publish failed after {self.max_attempts} attempts: {e!r}",
+                                           confirmed) from e
+        finally:
+            self._pool.put(channel)
+
+        elapsed = time.perf_counter() - started
+        PUBLISH_SECONDS.observe(elapsed)
+        elapsed_ms = elapsed * 1000
+        with self._stats_lock:
+            self.published += len(messages)
+            self._latencies_ms.append(elapsed_ms)
+
+    def _record(self, counter):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        """Publish counters and latency percentiles (ms) over the recent window"""
+        with self._stats_lock:
+            latencies = sorted(self._latencies_ms)
+            published, failures, connects = self.published, self.failures, self.connects
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 2)
+
+        return {
+            "published": published,
+            "failures": failures,
+            "connects": connects,
+            "latency_ms": {
+                "p50": percentile(0.50),
+                "p95": percentile(0.95),
+                "p99": percentile(0.99),
+                "max": round(latencies[-1], 2) if latencies else 0.0
+            }
+        }
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from shared.config import (
+    CACHE_ENABLED, CACHE_DB_PATH, CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS,
+    OLLAMA_MODEL, OCR_OUTPUT_FORMAT, OCR_ENGINES,
+    PREPROCESS_ENABLED, PREPROCESS_MAX_SIDE, PREPROCESS_AUTOCROP, PREPROCESS_GRAYSCALE,
+    PREPROCESS_AUTOCONTRAST, PREPROCESS_FORMAT, PREPROCESS_QUALITY
+)
+from shared.prompts import OCR_PROMPT, OCR_JSON_PROMPT
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# The prompt card_request_params() sends for OCR_OUTPUT_FORMAT
+CARD_PROMPT = OCR_JSON_PROMPT if OCR_OUTPUT_FORMAT == "json" else OCR_PROMPT
+
+# What the model actually sees depends on the resize/re-encode settings too
+PREPROCESS_SETTINGS = (
+    f"{PREPROCESS_MAX_SIDE}:{PREPROCESS_AUTOCROP}:{PREPROCESS_GRAYSCALE}:"
+    f"{PREPROCESS_AUTOCONTRAST}:{PREPROCESS_FORMAT}:{PREPROCESS_QUALITY}"
+) if PREPROCESS_ENABLED else "off"
+
+
+def cache_key(image_bytes, model=OLLAMA_MODEL, prompt=CARD_PROMPT):
+    """
+    Build the cache key for an image: SHA-256 of the image bytes, combined
+    with the model name, prompt, output format, OCR engine chain and
+    preprocessing settings so that changing any of them misses.
+    """
+    image_digest = hashlib.sha256(image_bytes).hexdigest()
+    return _combine_key(image_digest, model, prompt)
+
+
+def file_cache_key(path, model=OLLAMA_MODEL, prompt=CARD_PROMPT):
+    """Same as cache_key() but hashes a file on disk in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return _combine_key(digest.hexdigest(), model, prompt)
+
+
+def digest_cache_key(image_digest, model=OLLAMA_MODEL, prompt=CARD_PROMPT):
+    """Same as cache_key() for an image whose SHA-256 hex digest is already known"""
+    return _combine_key(image_digest, model, prompt)
+
+
+def _combine_key(image_digest, model, prompt, output_format=OCR_OUTPUT_FORMAT, engines=OCR_ENGINES,
+                 preprocess=PREPROCESS_SETTINGS):
+    prompt_digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+    return hashlib.sha256(
+        f"{image_digest}:{model}:{output_format}:{','.join(engines)}:{preprocess}:{prompt_digest}".encode('utf-8')
+    ).hexdigest()
+
+
+class ResultCache:
+    """
+    SQLite-backed cache of extract_fields() results, shared by the API and
+    every worker process.
+
+    Entries expire after ttl_seconds and the table is trimmed to max_entries,
+    evicting the least recently used rows first. Hit/miss counters are kept
+    per process.
+    """
+
+    def __init__(self, db_path=CACHE_DB_PATH, max_entries=CACHE_MAX_ENTRIES,
+                 ttl_seconds=CACHE_TTL_SECONDS, enabled=CACHE_ENABLED):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        if self.enabled:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._init_db()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _init_db(self):
+        conn = self._connect()
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS ocr_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    result TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_ocr_cache_last_used ON ocr_cache (last_used_at)')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get(self, key):
+        """Return the cached result dict for key, or None on a miss"""
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT result, created_at FROM ocr_cache WHERE cache_key = ?', (key,)
+            ).fetchone()
+            if row and now - row[1] <= self.ttl_seconds:
+                conn.execute('UPDATE ocr_cache SET last_used_at = ? WHERE cache_key = ?', (now, key))
+                conn.commit()
+                self._count('hits')
+                return json.loads(row[0])
+            if row:
+                conn.execute('DELETE FROM ocr_cache WHERE cache_key = ?', (key,))
+                conn.commit()
+                self._count('evictions')
+        finally:
+            conn.close()
+
+        self._count('misses')
+        return None
+
+    def put(self, key, result):
+        """Store a result and enforce the TTL and size limits"""
+        if not self.enabled:
+            return
+
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('''
+                INSERT OR REPLACE INTO ocr_cache (cache_key, result, created_at, last_used_at)
+                VALUES (?, ?, ?, ?)
+            ''', (key, json.dumps(result, ensure_ascii=False), now, now))
+
+            evicted = conn.execute(
+                'DELETE FROM ocr_cache WHERE created_at < ?', (now - self.ttl_seconds,)
+            ).rowcount
+            evicted += conn.execute('''
+                DELETE FROM ocr_cache WHERE cache_key IN (
+                    SELECT cache_key FROM ocr_cache
+                    ORDER BY last_used_at DESC
+                    LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,)).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+
+        if evicted:
+            with self._lock:
+                self.evictions += evicted
+
+    def stats(self):
+        """Return counters for this process plus the current cache size"""
+        entries = 0
+        if self.enabled:
+            conn = self._connect()
+            try:
+                entries = conn.execute('SELECT COUNT(*) FROM ocr_cache').fetchone()[0]
+            finally:
+                conn.close()
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds
+            }
@@ -0,0 +1,95 @@
+import json
+import time
+import threading
+
+import pika
+
+from shared.config import RESULTS_EXCHANGE
+from shared.rabbitmq import connection_parameters
+
+
+def declare_results_exchange(channel):
+    channel.exchange_declare(exchange=RESULTS_EXCHANGE, exchange_type='fanout', durable=True)
+
+
+def publish_result_event(channel, job_id, status):
+    """
+    Announce that a job finished. Called by the worker on its connection
+    thread, right before acking the job message.
+    """
+    channel.basic_publish(
+        exchange=RESULTS_EXCHANGE,
+        routing_key='',
+        body=json.dumps({"job_id": job_id, "status": status}),
+        properties=pika.BasicProperties(content_type='application/json')
+    )
+
+
+class ResultListener:
+    """
+    Receives job completion events in the API process and wakes up the
+    requests waiting for them.
+
+    A daemon thread consumes an exclusive queue bound to the results fanout
+    exchange, so every API process gets every event. Waiters register a
+    job_id before checking the database, which closes the race with a job
+    that finishes in between.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = {}
+        self._thread = None
+        self.connected = False
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="result-listener", daemon=True)
+                self._thread.start()
+
+    def register(self, job_id):
+        """Return an Event that is set when job_id finishes"""
+        with self._lock:
+            waiter = self._waiters.get(job_id)
+            if waiter is None:
+                waiter = self._waiters[job_id] = [threading.Event(), 0]
+            waiter[1] += 1
+            return waiter[0]
+
+    def unregister(self, job_id):
+        with self._lock:
+            waiter = self._waiters.get(job_id)
+            if waiter is not None:
+                waiter[1] -= 1
+                if waiter[1] <= 0:
+                    del self._waiters[job_id]
+
+    def _notify(self, job_id):
+        with self._lock:
+            waiter = self._waiters.get(job_id)
+        if waiter is not None:
+            waiter[0].set()
+
+    def _on_message(self, channel, method, properties, body):
+        try:
+            self._notify(json.loads(body).get('job_id'))
+        except ValueError:
+            pass
+
+    def _run(self):
+        while True:
+            try:
+                connection = pika.BlockingConnection(connection_parameters())
+                channel = connection.channel()
+                declare_results_exchange(channel)
+                result = channel.queue_declare(queue='', exclusive=True, auto_delete=True)
+                channel.queue_bind(exchange=RESULTS_EXCHANGE, queue=result.method.queue)
+                channel.basic_consume(queue=result.method.queue,
+                                      on_message_callback=self._on_message, auto_ack=True)
+                self.connected = True
+                channel.start_consuming()
+            except Exception as e:
+                print(f"Result listener error: {e!r}. Reconnecting in 5 seconds...")
+            self.connected = False
+            time.sleep(5)
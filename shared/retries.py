@@ -0,0 +1,81 @@
+import pika
+
+from shared.config import (
+    RABBITMQ_QUEUE, RETRY_MAX_ATTEMPTS, RETRY_DELAYS_SECONDS, DEAD_LETTER_QUEUE
+)
+
+# Message header carrying the attempt number (the first delivery has none)
+ATTEMPT_HEADER = 'x-ocr-attempt'
+ERROR_HEADER = 'x-ocr-last-error'
+
+
+def retry_queue_name(delay, queue=RABBITMQ_QUEUE):
+    return f'{queue}.retry.{delay}s'
+
+
+def retry_delay(attempt):
+    """Seconds to wait before the given attempt (2 = first retry)"""
+    return RETRY_DELAYS_SECONDS[min(attempt - 2, len(RETRY_DELAYS_SECONDS) - 1)]
+
+
+def declare_retry_queues(channel, queues=(RABBITMQ_QUEUE,)):
+    """
+    Declare the delay queues of each job queue and the dead-letter queue.
+    Each delay queue has a fixed TTL and dead-letters expired messages
+    back to its job queue (so retried jobs keep their priority), and a
+    message is never stuck behind one with a longer delay.
+    """
+    for queue in queues:
+        for delay in sorted(set(RETRY_DELAYS_SECONDS)):
+            channel.queue_declare(queue=retry_queue_name(delay, queue), durable=True, arguments={
+                'x-message-ttl': delay * 1000,
+                'x-dead-letter-exchange': '',
+                'x-dead-letter-routing-key': queue,
+            })
+    channel.queue_declare(queue=DEAD_LETTER_QUEUE, durable=True)
+
+
+def get_attempt(properties):
+    """Attempt number of a delivery, from its headers"""
+    headers = getattr(properties, 'headers', None) or {}
+    try:
+        return max(1, int(headers.get(ATTEMPT_HEADER, 1)))
+    except (TypeError, ValueError):
+        return 1
+
+
+def _publish(channel, routing_key, body, properties, attempt, error):
+    headers = dict(getattr(properties, 'headers', None) or {})
+    headers[ATTEMPT_HEADER] = attempt
+    if error:
+        headers[ERROR_HEADER] = error[:500]
+    channel.basic_publish(
+        exchange='',
+        routing_key=routing_key,
+        body=body,
+        properties=pika.BasicProperties(
+            delivery_mode=2,
+            content_type=getattr(properties, 'content_type', None) or 'application/json',
+            headers=headers
+        )
+    )
+
+
+def publish_retry(channel, body, properties, attempt, error=None, queue=RABBITMQ_QUEUE):
+    """
+    Schedule the given attempt of a job (taken from queue) through a
+    delay queue. Returns the delay in seconds. Must run on the connection
+    thread, before the original delivery is acked.
+    """
+    delay = retry_delay(attempt)
+    _publish(channel, retry_queue_name(delay, queue), body, properties, attempt, error)
+    return delay
+
+
+def publish_dead_letter(channel, body, properties, attempt, error=None):
+    """Park a job that failed its last attempt (or cannot be parsed)"""
+    _publish(channel, DEAD_LETTER_QUEUE, body, properties, attempt, error)
+
+
+def is_last_attempt(attempt):
+    return attempt >= RETRY_MAX_ATTEMPTS
@@ -41,12 +41,26 @@ document.addEventListener('DOMContentLoaded', function() {
                 body: formData
             });
 
+            if (response.status === 429 || response.status === 503) {
+                // Sistema saturado: el servidor indica cuándo reintentar
+                const retryAfter = response.headers.get('Retry-After');
+                throw new Error(`El sistema está saturado, inténtalo de nuevo en ${retryAfter || 'unos'} segundos`);
+            }
+            if (response.status === 422) {
+                // Foto rechazada por el control de calidad: el servidor explica cómo corregirla
+                const rejection = await response.json();
+                throw new Error(`La foto no se puede leer. ${rejection.error}`);
+            }
             if (!response.ok) {
                 throw new Error('Error en el procesamiento de la imagen');
             }
 
             const data = await response.json();
-            if (data.job_id) {
+            if (data.status === "completado") {
+                // Imagen ya procesada anteriormente (resultado en caché)
+                loadingDiv.style.display = "none";
+                displayResults(data);
+            } else if (data.job_id) {
                 checkProcessingStatus(data.job_id);
             } else {
                 throw new Error("ID de trabajo no recibido del servidor");
@@ -57,29 +71,61 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 
-    async function checkProcessingStatus(jobId) {
+    function showProcessing(jobId) {
+        loadingDiv.innerHTML = `
+            <div class="spinner"></div>
+            <p>Procesando imagen, por favor espere...</p>
+            <p><small>ID de proceso: ${jobId}</small></p>
+            <p><small>Si tienes GPU, el procesamiento será más rápido.</small></p>
+        `;
+    }
+
+    function handleResult(result) {
+        loadingDiv.style.display = "none";
+        if (result.status === "completado") {
+            displayResults(result);
+        } else if (result.status === "error") {
+            resultDiv.innerHTML = `<p class="error">Error: ${result.error || "Ocurrió un error en el procesamiento."}</p>`;
+        } else {
+            resultDiv.innerHTML = `<p class="error">Respuesta inesperada del servidor.</p>`;
+        }
+    }
+
+    function checkProcessingStatus(jobId) {
+        showProcessing(jobId);
+
+        // El servidor avisa apenas el worker termina (Server-Sent Events)
+        if (!window.EventSource) {
+            pollProcessingStatus(jobId);
+            return;
+        }
+
+        const events = new EventSource(`/eventos/${jobId}`);
+        events.addEventListener('resultado', function(e) {
+            events.close();
+            handleResult(JSON.parse(e.data));
+        });
+        events.addEventListener('timeout', function() {
+            events.close();
+            pollProcessingStatus(jobId);
+        });
+        events.onerror = function() {
+            // Conexión perdida: se consulta con long-polling
+            events.close();
+            pollProcessingStatus(jobId);
+        };
+    }
+
+    async function pollProcessingStatus(jobId) {
         async function checkStatus() {
             try {
-                const response = await fetch(`/resultado/${jobId}`);
+                const response = await fetch(`/resultado/${jobId}?esperar=30`);
                 const result = await response.json();
 
                 if (result.status === "procesando") {
-                    loadingDiv.innerHTML = `
-                        <div class="spinner"></div>
-                        <p>Procesando imagen, por favor espere...</p>
-                        <p><small>ID de proceso: ${jobId}</small></p>
-                        <p><small>Si tienes GPU, el procesamiento será más rápido.</small></p>
-                    `;
-                    setTimeout(checkStatus, 2000);
-                } else if (result.status === "completado") {
-                    loadingDiv.style.display = "none";
-                    displayResults(result);
-                } else if (result.status === "error") {
-                    loadingDiv.style.display = "none";
-                    resultDiv.innerHTML = `<p class="error">Error: ${result.error || "Ocurrió un error en el procesamiento."}</p>`;
+                    checkStatus();
                 } else {
-                    loadingDiv.style.display = "none";
-                    resultDiv.innerHTML = `<p class="error">Respuesta inesperada del servidor.</p>`;
+                    handleResult(result);
                 }
             } catch (error) {
                 loadingDiv.style.display = "none";
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Storage lifecycle of uploaded images and result files.
+
+Files are sharded by the first SHARD_CHARS characters of the job id, so no
+directory grows past a few thousand entries:
+
+    data/uploads/<shard>/carnet_<job_id>.<ext>
+    data/resultados/<shard>/<job_id>.json
+    data/resultados/archivo/resultados-<day>-<n>.zip
+
+    python storage.py sweep                  # compaction + retention (run.py runs it periodically)
+    python storage.py compact --older-than 3
+    python storage.py migrate                # move files of the old flat layout into shards
+
+"compact" packs result files older than RESULT_COMPACT_AFTER_DAYS into ZIP
+segments, one per day of processing. Every member is compressed on its own,
+so /resultado/<job_id> reads a single result back through the segment
+index in the database. "sweep" also deletes uploads after
+UPLOAD_RETENTION_DAYS and results after RESULT_RETENTION_DAYS, when set.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import zipfile
+import argparse
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+from shared.config import (
+    UPLOAD_DIR, RESULTS_DIR, RESULT_FILES_ENABLED, RESULT_COMPACT_AFTER_DAYS,
+    RESULT_RETENTION_DAYS, UPLOAD_RETENTION_DAYS
+)
+from database import (
+    init_db, get_job_statuses, add_archived_results, get_archive_segment,
+    delete_archived_segment, delete_results_before
+)
+
+SHARD_CHARS = 3
+ARCHIVE_DIR = os.path.join(RESULTS_DIR, 'archivo')
+SEGMENT_MAX_FILES = 10000
+SEGMENT_NAME_PATTERN = re.compile(r'^resultados-(\d{4}-\d{2}-\d{2})-[0-9a-f]+\.zip$')
+
+# carnet_<job_id>.<ext> as saved by the API, and the payload the worker keeps
+# next to it after a failed attempt (.prepared.b64)
+UPLOAD_NAME_PATTERN = re.compile(r'^carnet_([0-9a-f\-]{36})\.[A-Za-z0-9]+$')
+PREPARED_NAME_PATTERN = re.compile(r'^carnet_([0-9a-f\-]{36})\.[A-Za-z0-9]+\.prepared\.b64$')
+# Temporary files of interrupted uploads older than this are removed
+TEMP_UPLOAD_MAX_AGE = 24 * 3600
+
+DAY = 24 * 3600
+
+
+def shard(job_id):
+    return job_id[:SHARD_CHARS]
+
+
+def result_path(job_id):
+    return os.path.join(RESULTS_DIR, shard(job_id), f"{job_id}.json")
+
+
+def upload_path(job_id, extension):
+    """Where the API stores a job's image (creates the shard directory)"""
+    directory = os.path.join(UPLOAD_DIR, shard(job_id))
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"carnet_{job_id}{extension}")
+
+
+def write_result_file(result_data):
+    """JSON copy of a result next to the database row, unless RESULT_FILES_ENABLED is off"""
+    if not RESULT_FILES_ENABLED:
+        return
+    path = result_path(result_data["job_id"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(result_data, f, indent=2, ensure_ascii=False)
+
+
+def delete_result_file(job_id):
+    """Remove a job's result file from the sharded layout, if any"""
+    try:
+        os.remove(result_path(job_id))
+    except FileNotFoundError:
+        pass
+
+
+def read_result_file(job_id):
+    """
+    Result file of a job from the sharded layout, the old flat layout or
+    an archive segment. None if there is none.
+    """
+    for path in (result_path(job_id), os.path.join(RESULTS_DIR, f"{job_id}.json")):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            continue
+
+    # Compaction indexes a file before deleting it, so it is always found
+    segment = get_archive_segment(job_id)
+    if segment is None:
+        return None
+    try:
+        with zipfile.ZipFile(os.path.join(ARCHIVE_DIR, segment)) as archive:
+            return json.loads(archive.read(f"{job_id}.json"))
+    except (FileNotFoundError, KeyError):
+        # Deleted by a retention sweep meanwhile
+        return None
+
+
+def iter_files(base):
+    """DirEntry of every file in a sharded directory, old flat layout included"""
+    with os.scandir(base) as entries:
+        for entry in entries:
+            if entry.is_file():
+                yield entry
+            elif entry.is_dir() and len(entry.name) == SHARD_CHARS:
+                with os.scandir(entry.path) as shard_entries:
+                    for shard_entry in shard_entries:
+                        if shard_entry.is_file():
+                            yield shard_entry
+
+
+def iter_uploads():
+    """(job_id, path) of every uploaded image"""
+    for entry in iter_files(UPLOAD_DIR):
+        match = UPLOAD_NAME_PATTERN.match(entry.name)
+        if match:
+            yield match.group(1), entry.path
+
+
+def _write_segment(day, paths):
+    """Pack result files into a new segment, index it, then delete the files"""
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    name = f"resultados-{day}-{uuid.uuid4().hex[:8]}.zip"
+    temp_path = os.path.join(ARCHIVE_DIR, f"{name}.tmp")
+    archived = []
+    with zipfile.ZipFile(temp_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for path in paths:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"  ⚠️ Se omite {path}: {e}")
+                continue
+            job_id = os.path.basename(path)[:-len('.json')]
+            archive.writestr(f"{job_id}.json", json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+            archived.append((job_id, path))
+
+    # Segments are immutable once visible: readers never see a partial ZIP
+    os.replace(temp_path, os.path.join(ARCHIVE_DIR, name))
+    add_archived_results(name, [job_id for job_id, _ in archived])
+    for _, path in archived:
+        os.remove(path)
+    return len(archived)
+
+
+def compact_results(older_than_days=RESULT_COMPACT_AFTER_DAYS):
+    """Move result files older than older_than_days into archive segments"""
+    cutoff = time.time() - older_than_days * DAY
+    by_day = {}
+    for entry in iter_files(RESULTS_DIR):
+        if not entry.name.endswith('.json'):
+            continue
+        mtime = entry.stat().st_mtime
+        if mtime < cutoff:
+            by_day.setdefault(time.strftime('%Y-%m-%d', time.localtime(mtime)), []).append(entry.path)
+
+    compacted = 0
+    for day, paths in sorted(by_day.items()):
+        for start in range(0, len(paths), SEGMENT_MAX_FILES):
+            compacted += _write_segment(day, paths[start:start + SEGMENT_MAX_FILES])
+    print(f"🗜️ {compacted} resultados compactados en {ARCHIVE_DIR}")
+    return compacted
+
+
+def sweep_results(retention_days=RESULT_RETENTION_DAYS):
+    """Delete results processed more than retention_days ago: rows, files and segments"""
+    cutoff = time.time() - retention_days * DAY
+    rows = delete_results_before(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(cutoff)))
+
+    files = 0
+    for entry in iter_files(RESULTS_DIR):
+        if entry.name.endswith('.json') and entry.stat().st_mtime < cutoff:
+            os.remove(entry.path)
+            files += 1
+
+    # A segment holds a single day; it goes once the whole day has expired
+    segments = 0
+    cutoff_day = time.strftime('%Y-%m-%d', time.localtime(cutoff))
+    if os.path.isdir(ARCHIVE_DIR):
+        for name in os.listdir(ARCHIVE_DIR):
+            match = SEGMENT_NAME_PATTERN.match(name)
+            if match and match.group(1) < cutoff_day:
+                delete_archived_segment(name)
+                os.remove(os.path.join(ARCHIVE_DIR, name))
+                segments += 1
+    print(f"🧹 Resultados: {rows} filas, {files} archivos y {segments} segmentos eliminados")
+    return rows, files, segments
+
+
+def sweep_uploads(retention_days=UPLOAD_RETENTION_DAYS):
+    """
+    Delete uploaded images older than retention_days. Images of jobs
+    without a result yet are kept twice as long, in case they are still
+    waiting in a queue. Prepared payloads are deleted as soon as their
+    job has a result, and abandoned temporary uploads after a day.
+    """
+    now = time.time()
+    cutoff = now - retention_days * DAY
+    candidates = []
+    for entry in iter_files(UPLOAD_DIR):
+        if entry.name.endswith('.part'):
+            if entry.stat().st_mtime < now - TEMP_UPLOAD_MAX_AGE:
+                os.remove(entry.path)
+            continue
+        match = UPLOAD_NAME_PATTERN.match(entry.name) or PREPARED_NAME_PATTERN.match(entry.name)
+        if match:
+            candidates.append((match.group(1), entry.path, entry.stat().st_mtime))
+
+    statuses = get_job_statuses({job_id for job_id, _, _ in candidates})
+    deleted = 0
+    for job_id, path, mtime in candidates:
+        finished = job_id in statuses
+        if path.endswith('.prepared.b64') and finished:
+            expired = True
+        elif retention_days > 0:
+            expired = mtime < (cutoff if finished else cutoff - retention_days * DAY)
+        else:
+            expired = False
+        if expired:
+            try:
+                os.remove(path)
+                deleted += 1
+            except FileNotFoundError:
+                pass
+    print(f"🧹 Subidas: {deleted} archivos eliminados")
+    return deleted
+
+
+def migrate_flat_layout():
+    """
+    Move result files and uploads of the old flat layout into their shard.
+    Uploads of jobs without a result are left alone: a queued message may
+    still point at them.
+    """
+    results = 0
+    for name in os.listdir(RESULTS_DIR):
+        path = os.path.join(RESULTS_DIR, name)
+        if name.endswith('.json') and os.path.isfile(path):
+            target = result_path(name[:-len('.json')])
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(path, target)
+            results += 1
+
+    flat_uploads = {}
+    for name in os.listdir(UPLOAD_DIR):
+        match = UPLOAD_NAME_PATTERN.match(name) or PREPARED_NAME_PATTERN.match(name)
+        if match:
+            flat_uploads.setdefault(match.group(1), []).append(name)
+    finished = get_job_statuses(flat_uploads)
+    uploads = 0
+    for job_id in finished:
+        directory = os.path.join(UPLOAD_DIR, shard(job_id))
+        os.makedirs(directory, exist_ok=True)
+        for name in flat_uploads[job_id]:
+            os.replace(os.path.join(UPLOAD_DIR, name), os.path.join(directory, name))
+            uploads += 1
+    print(f"📁 {results} resultados y {uploads} subidas movidos a directorios por prefijo")
+    return results, uploads
+
+
+def sweep():
+    """Everything the periodic sweep does, per the configured policies"""
+    if RESULT_COMPACT_AFTER_DAYS > 0:
+        compact_results()
+    if RESULT_RETENTION_DAYS > 0:
+        sweep_results()
+    sweep_uploads()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ciclo de vida del almacenamiento (subidas y resultados)")
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+    subparsers.add_parser('sweep', help="Compacta y aplica las políticas de retención configuradas")
+    compact_parser = subparsers.add_parser('compact', help="Empaqueta resultados antiguos en segmentos comprimidos")
+    compact_parser.add_argument('--older-than', type=float, default=RESULT_COMPACT_AFTER_DAYS,
+                                help="Días de antigüedad mínima")
+    subparsers.add_parser('migrate', help="Mueve los archivos del esquema plano anterior a directorios por prefijo")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    init_db()
+    started = time.perf_counter()
+    if args.mode == 'sweep':
+        sweep()
+    elif args.mode == 'compact':
+        compact_results(args.older_than)
+    else:
+        migrate_flat_layout()
+    print(f"✅ Listo en {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
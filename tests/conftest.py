@@ -0,0 +1,14 @@
+import os
+import tempfile
+
+# Keep the tests away from data/: shared.config reads these at import time
+_DATA_DIR = tempfile.mkdtemp(prefix="ocr-tests-")
+for name, path in {
+    "UPLOAD_DIR": "uploads",
+    "RESULTS_DIR": "resultados",
+    "DB_PATH": "ocr_results.db",
+    "CACHE_DB_PATH": "ocr_cache.db",
+    "METRICS_DIR": "metrics",
+    "MODEL_WARM_MARKER": "ollama_model.warm",
+}.items():
+    os.environ[name] = os.path.join(_DATA_DIR, path)
@@ -0,0 +1,120 @@
+import shutil
+
+import pytest
+
+from shared.admission import AdmissionController, Overloaded, RETRY_AFTER_NO_WORKERS
+from shared.config import METRICS_DIR, RABBITMQ_QUEUE, BULK_QUEUE, PRIORITY_WEIGHTS
+from shared.metrics import Registry, write_snapshot
+from shared.rabbitmq import PRIORITY_INTERACTIVE, PRIORITY_BULK
+
+BULK = f"{BULK_QUEUE}.0"
+
+
+@pytest.fixture(autouse=True)
+def clean_snapshots():
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    yield
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+
+
+def worker_snapshot(process, concurrency, job_seconds=()):
+    registry = Registry()
+    registry.gauge('ocr_worker_concurrency', '').set(concurrency)
+    jobs = registry.histogram('ocr_job_duration_seconds', '')
+    for seconds in job_seconds:
+        jobs.observe(seconds)
+    write_snapshot(registry, process)
+    return registry
+
+
+def controller(stats, **kwargs):
+    kwargs.setdefault("max_wait", {PRIORITY_INTERACTIVE: 0, PRIORITY_BULK: 0})
+    kwargs.setdefault("max_queue_depth", 0)
+    kwargs.setdefault("default_service_seconds", 10)
+    kwargs.setdefault("stats_ttl", 0)
+    return AdmissionController(stats_source=lambda: stats, **kwargs)
+
+
+def test_wait_is_work_ahead_over_worker_slots():
+    worker_snapshot("worker-1", concurrency=2)
+    admission = controller({RABBITMQ_QUEUE: (12, 3)})
+    # 12 jobs of 10s over 3 workers x 2 slots
+    assert admission.estimated_wait(PRIORITY_INTERACTIVE) == pytest.approx(20)
+    assert admission.estimated_wait(PRIORITY_INTERACTIVE, count=6) == pytest.approx(30)
+
+
+def test_backlogged_classes_share_slots_by_weight():
+    worker_snapshot("worker-1", concurrency=1)
+    admission = controller({RABBITMQ_QUEUE: (10, 1), BULK: (100, 1)})
+    total = PRIORITY_WEIGHTS[PRIORITY_INTERACTIVE] + PRIORITY_WEIGHTS[PRIORITY_BULK]
+    share = PRIORITY_WEIGHTS[PRIORITY_INTERACTIVE] / total
+    assert admission.estimated_wait(PRIORITY_INTERACTIVE) == pytest.approx(10 * 10 / share)
+
+
+def test_no_consumers_means_no_estimate():
+    admission = controller({RABBITMQ_QUEUE: (5, 0)})
+    assert admission.estimated_wait(PRIORITY_INTERACTIVE) is None
+    assert admission.admit(PRIORITY_INTERACTIVE) is None
+
+
+def test_full_queues_are_rejected_with_503():
+    worker_snapshot("worker-1", concurrency=1)
+    admission = controller({RABBITMQ_QUEUE: (95, 2)}, max_queue_depth=100)
+    admission.admit(PRIORITY_INTERACTIVE, count=5)
+
+    with pytest.raises(Overloaded) as error:
+        admission.admit(PRIORITY_INTERACTIVE, count=10)
+    assert error.value.status_code == 503
+    # 5 jobs over the limit, 10s each, over 2 slots
+    assert error.value.retry_after == 25
+
+
+def test_full_queues_without_workers_retry_later():
+    admission = controller({RABBITMQ_QUEUE: (100, 0)}, max_queue_depth=100)
+    with pytest.raises(Overloaded) as error:
+        admission.admit(PRIORITY_INTERACTIVE)
+    assert error.value.retry_after == RETRY_AFTER_NO_WORKERS
+
+
+def test_long_estimated_wait_is_rejected_with_429():
+    worker_snapshot("worker-1", concurrency=1)
+    admission = controller({RABBITMQ_QUEUE: (9, 1)}, max_wait={PRIORITY_INTERACTIVE: 60})
+    with pytest.raises(Overloaded) as error:
+        admission.admit(PRIORITY_INTERACTIVE)
+    assert error.value.status_code == 429
+    assert error.value.retry_after == 30
+
+
+def test_recently_enqueued_jobs_count_until_the_next_poll():
+    admission = controller({RABBITMQ_QUEUE: (0, 1)}, max_queue_depth=10, stats_ttl=3600)
+    admission.admit(PRIORITY_INTERACTIVE)
+    admission.record_enqueued(PRIORITY_INTERACTIVE, 10)
+    with pytest.raises(Overloaded):
+        admission.admit(PRIORITY_INTERACTIVE)
+
+
+def test_service_time_follows_the_worker_job_durations():
+    registry = worker_snapshot("worker-1", concurrency=1, job_seconds=[4, 4])
+    admission = controller({RABBITMQ_QUEUE: (0, 1)})
+    admission.refresh()
+    assert admission.service_seconds == pytest.approx(4)
+
+    # Only jobs finished since the last poll count, in a moving average
+    registry.histogram('ocr_job_duration_seconds', '').observe(8)
+    write_snapshot(registry, "worker-1")
+    admission.refresh()
+    assert admission.service_seconds == pytest.approx(0.7 * 4 + 0.3 * 8)
+
+
+def test_unreadable_stats_keep_the_last_figures():
+    worker_snapshot("worker-1", concurrency=1)
+    results = [{RABBITMQ_QUEUE: (3, 1)}]
+
+    def stats():
+        if results:
+            return results.pop()
+        raise ConnectionError("broker down")
+
+    admission = AdmissionController(stats_source=stats, stats_ttl=0, default_service_seconds=10)
+    assert admission.estimated_wait(PRIORITY_INTERACTIVE) == pytest.approx(30)
+    assert admission.estimated_wait(PRIORITY_INTERACTIVE) == pytest.approx(30)
@@ -0,0 +1,170 @@
+import io
+import os
+import sys
+import zipfile
+
+import pytest
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BASE_DIR, 'api'))
+
+import app as api
+from shared.admission import Overloaded
+from shared.image_quality import ImageRejected
+from shared.rabbitmq import PublishError
+
+
+class FakePublisher:
+    """Records published messages; fails after `confirm` of them when set"""
+
+    def __init__(self, confirm=None):
+        self.confirm = confirm
+        self.messages = []
+
+    def publish_many(self, messages, routing_key=None):
+        if self.confirm is None:
+            self.messages.extend(messages)
+            return
+        self.messages.extend(messages[:self.confirm])
+        raise PublishError("broker gone", self.confirm)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(api.admission, "admit", lambda priority, count=1: 5.0)
+    monkeypatch.setattr(api, "check_image", lambda path: None)
+    monkeypatch.setattr(api, "publisher", FakePublisher())
+    api.app.config["TESTING"] = True
+    return api.app.test_client()
+
+
+def images(*names):
+    return {"images": [(io.BytesIO(f"image {name}".encode()), name) for name in names]}
+
+
+def post_batch(client, data):
+    return client.post("/procesar-lote", data=data, content_type="multipart/form-data")
+
+
+def test_batch_is_queued_and_recorded(client):
+    response = post_batch(client, images("a.jpg", "b.jpg", "c.png"))
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [job["status"] for job in body["jobs"]] == ["enviado"] * 3
+    assert body["estimated_wait_seconds"] == 5
+    assert [message["job_id"] for message in api.publisher.messages] == [job["job_id"] for job in body["jobs"]]
+    assert all(os.path.exists(message["filename"]) for message in api.publisher.messages)
+    assert client.get(f"/lote/{body['batch_id']}").get_json()["total"] == 3
+
+
+def test_rejected_image_fails_alone(client, monkeypatch):
+    def check_image(path):
+        if open(path, 'rb').read() == b"image blurry.jpg":
+            raise ImageRejected("blurry", "La imagen está borrosa")
+    monkeypatch.setattr(api, "check_image", check_image)
+
+    response = post_batch(client, images("a.jpg", "blurry.jpg"))
+
+    assert response.status_code == 200
+    accepted, rejected = response.get_json()["jobs"]
+    assert accepted["status"] == "enviado"
+    assert rejected["status"] == "rechazado"
+    assert rejected["reason"] == "blurry"
+    assert len(api.publisher.messages) == 1
+    progress = client.get(f"/lote/{response.get_json()['batch_id']}").get_json()
+    assert (progress["total"], progress["errores"], progress["procesando"]) == (2, 1, 1)
+
+
+def test_overloaded_batch_is_turned_away(client, monkeypatch):
+    def admit(priority, count=1):
+        raise Overloaded("The OCR queues are full", 503, 30)
+    monkeypatch.setattr(api.admission, "admit", admit)
+
+    response = post_batch(client, images("a.jpg"))
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "30"
+    assert api.publisher.messages == []
+
+
+def test_empty_batch_is_rejected(client):
+    assert post_batch(client, {}).status_code == 400
+
+
+def test_invalid_archive_is_rejected(client):
+    response = post_batch(client, {"archive": (io.BytesIO(b"not a zip"), "cards.zip")})
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Invalid ZIP archive"
+
+
+def encrypted_archive(name):
+    """A ZIP whose only member has the encryption flag set (zipfile cannot write one)"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        zf.writestr(name, b"image")
+    data = bytearray(buffer.getvalue())
+    for signature, offset in ((b"PK\x03\x04", 6), (b"PK\x01\x02", 8)):
+        data[data.index(signature) + offset] |= 0x1
+    return io.BytesIO(bytes(data))
+
+
+def test_encrypted_archive_member_is_rejected(client):
+    response = post_batch(client, {"archive": (encrypted_archive("secret.jpg"), "cards.zip")})
+
+    assert response.status_code == 400
+    assert "secret.jpg: encrypted" in response.get_json()["error"]
+    assert api.publisher.messages == []
+
+
+@pytest.fixture
+def stored(monkeypatch):
+    """Paths of the uploads the batch stored"""
+    paths = []
+    real_accept = api.accept_image
+
+    def accept_image(chunks, extension):
+        job_id, cached, message = real_accept(chunks, extension)
+        paths.append(message["filename"])
+        return job_id, cached, message
+    monkeypatch.setattr(api, "accept_image", accept_image)
+    return paths
+
+
+def test_failed_publish_removes_the_uploads(client, monkeypatch, stored):
+    monkeypatch.setattr(api, "publisher", FakePublisher(confirm=0))
+
+    response = post_batch(client, images("a.jpg", "b.jpg"))
+
+    assert response.status_code == 500
+    assert response.get_json()["queued_job_ids"] == []
+    assert len(stored) == 2
+    assert not any(os.path.exists(path) for path in stored)
+
+
+def test_partly_published_batch_keeps_only_the_queued_jobs(client, monkeypatch, stored):
+    monkeypatch.setattr(api, "publisher", FakePublisher(confirm=2))
+
+    response = post_batch(client, images("a.jpg", "b.jpg", "c.jpg"))
+
+    assert response.status_code == 500
+    body = response.get_json()
+    queued = [message["job_id"] for message in api.publisher.messages]
+    assert body["queued_job_ids"] == queued
+    assert [job["job_id"] for job in body["jobs"]] == queued
+    progress = client.get(f"/lote/{body['batch_id']}").get_json()
+    assert (progress["total"], progress["procesando"]) == (2, 2)
+    assert [os.path.exists(path) for path in stored] == [True, True, False]
+
+
+def test_batch_record_failure_reports_the_queued_jobs(client, monkeypatch):
+    def create_batch(*args):
+        raise RuntimeError("disk full")
+    monkeypatch.setattr(api, "create_batch", create_batch)
+
+    response = post_batch(client, images("a.jpg"))
+
+    assert response.status_code == 500
+    body = response.get_json()
+    assert body["error"].startswith("Failed to record batch")
+    assert body["queued_job_ids"] == [api.publisher.messages[0]["job_id"]]
@@ -0,0 +1,84 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'worker'))
+
+from circuit_breaker import CircuitBreaker
+
+
+def make_breaker(probe_results, threshold=3):
+    """Breaker whose probes return probe_results in order; closed is set once it closes"""
+    results = iter(probe_results)
+    events = []
+    closed = threading.Event()
+    breaker = CircuitBreaker("test", probe=lambda: next(results), threshold=threshold,
+                             backoff=0.01, max_backoff=0.02)
+    breaker.add_listener(on_open=lambda: events.append("open"),
+                         on_close=lambda: (events.append("close"), closed.set()))
+    return breaker, events, closed
+
+
+def test_opens_after_threshold_consecutive_failures():
+    breaker, events, _ = make_breaker([False] * 1000)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert not breaker.is_open
+
+    breaker.record_failure()
+    assert breaker.is_open
+    # Further failures while open do not open it again
+    breaker.record_failure()
+    assert events == ["open"]
+
+
+def test_closes_after_a_successful_probe():
+    breaker, events, closed = make_breaker([False, False, True])
+    for _ in range(3):
+        breaker.record_failure()
+
+    assert closed.wait(timeout=5)
+    assert not breaker.is_open
+    assert events == ["open", "close"]
+
+    # Counting starts over once closed
+    breaker.record_failure()
+    breaker.record_failure()
+    assert not breaker.is_open
+
+
+def test_probe_exception_counts_as_down():
+    calls = []
+
+    def probe():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ConnectionError("refused")
+        return True
+
+    closed = threading.Event()
+    breaker = CircuitBreaker("test", probe=probe, threshold=1, backoff=0.01)
+    breaker.add_listener(on_close=closed.set)
+    breaker.record_failure()
+    assert closed.wait(timeout=5)
+    assert len(calls) == 2
+
+
+def test_failing_listener_does_not_stop_the_others():
+    breaker = CircuitBreaker("test", probe=lambda: False, threshold=1, backoff=60)
+    opened = []
+    breaker.add_listener(on_open=lambda: 1 / 0)
+    breaker.add_listener(on_open=lambda: opened.append(True))
+    breaker.record_failure()
+    assert breaker.is_open
+    assert opened == [True]
+
+
+def test_threshold_zero_disables_the_breaker():
+    breaker = CircuitBreaker("test", probe=lambda: True, threshold=0)
+    for _ in range(100):
+        breaker.record_failure()
+    assert not breaker.is_open
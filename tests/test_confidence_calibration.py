@@ -0,0 +1,25 @@
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BASE_DIR, 'benchmarks'))
+
+import calibrate_confidence
+
+FIXTURE = os.path.join(BASE_DIR, 'tests', 'fixtures', 'labelled_cards.jsonl')
+
+
+def test_calibrate_counts_right_values_per_method():
+    counts = calibrate_confidence.calibrate(calibrate_confidence.load_samples(FIXTURE))
+    assert counts == {
+        "label_valid": (11, 11),
+        "alias_valid": (7, 7),
+        "label_invalid": (0, 3),
+        "fallback": (2, 4),
+    }
+
+
+def test_validated_values_rank_above_unvalidated():
+    confidence = calibrate_confidence.CONFIDENCE
+    assert min(confidence["label_valid"], confidence["alias_valid"]) > \
+        max(confidence["label_invalid"], confidence["fallback"])
@@ -0,0 +1,18 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'worker'))
+
+import field_extractor
+
+
+def test_uptc_fallback_ignores_case():
+    for text in ("Carnet estudiantil UPTC", "carnet estudiantil uptc", "Carnet Estudiantil Uptc"):
+        result = field_extractor.extract(text)
+        assert result["institucion"].upper() == "UPTC"
+        assert result["confidence"]["institucion"] == field_extractor.CONFIDENCE["fallback"]
+
+
+def test_labelled_institution_wins_over_fallback():
+    result = field_extractor.extract("Institución: Universidad Pedagógica y Tecnológica de Colombia\nuptc")
+    assert result["institucion"] == "Universidad Pedagógica y Tecnológica de Colombia"
@@ -0,0 +1,63 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'worker'))
+
+from job_scheduler import JobScheduler
+
+
+def take(scheduler, count):
+    return [scheduler.get() for _ in range(count)]
+
+
+def test_weighted_round_robin_between_priorities():
+    scheduler = JobScheduler({"interactive": 3, "bulk": 1})
+    for i in range(20):
+        scheduler.put("interactive", None, f"i{i}")
+        scheduler.put("bulk", None, f"b{i}")
+
+    picked = take(scheduler, 8)
+    assert sum(item.startswith("i") for item in picked) == 6
+    # Smooth: bulk is not held back until interactive runs dry
+    assert any(item.startswith("b") for item in picked[:4])
+
+
+def test_lower_priority_is_not_starved():
+    scheduler = JobScheduler({"interactive": 4, "bulk": 1})
+    scheduler.put("bulk", None, "b0")
+    for i in range(50):
+        scheduler.put("interactive", None, f"i{i}")
+
+    assert "b0" in take(scheduler, 5)
+
+
+def test_fairness_keys_take_turns_within_a_priority():
+    scheduler = JobScheduler({"bulk": 1})
+    for i in range(3):
+        scheduler.put("bulk", "big-client", f"a{i}")
+    scheduler.put("bulk", "small-client", "b0")
+
+    assert take(scheduler, 4) == ["a0", "b0", "a1", "a2"]
+
+
+def test_unknown_priority_gets_weight_one():
+    scheduler = JobScheduler({"interactive": 1})
+    scheduler.put("other", None, "x")
+    assert scheduler.get() == "x"
+    assert scheduler.pending() == {"other": 0}
+
+
+def test_drain_and_close():
+    scheduler = JobScheduler({"interactive": 1, "bulk": 1})
+    scheduler.put("interactive", "a", 1)
+    scheduler.put("bulk", "b", 2)
+    assert sorted(scheduler.drain()) == [1, 2]
+    assert scheduler.pending() == {}
+
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(scheduler.get()))
+    waiter.start()
+    scheduler.close()
+    waiter.join(timeout=2)
+    assert results == [None]
@@ -0,0 +1,134 @@
+import json
+
+import pika
+import pytest
+from pika.exceptions import StreamLostError
+
+import shared.rabbitmq as rabbitmq
+from shared.rabbitmq import RabbitMQPublisher, PublishError
+
+
+class FakeBroker:
+    """
+    Stands in for RabbitMQ behind pika.BlockingConnection. Confirms lag one
+    message behind (like acks read while the next publish is flushed), and
+    the connection drops after `fail_after` publishes over its lifetime.
+    """
+
+    def __init__(self, fail_after=None, fail_connections=1):
+        self.fail_after = fail_after
+        self.fail_connections = fail_connections
+        self.received = []
+        self.connections = 0
+
+    def connect(self, parameters):
+        self.connections += 1
+        fail_after = self.fail_after if self.connections <= self.fail_connections else None
+        return FakeConnection(self, fail_after)
+
+
+class FakeConnection:
+    def __init__(self, broker, fail_after):
+        self.broker = broker
+        self.fail_after = fail_after
+        self.is_open = True
+        self._channel = None
+
+    def channel(self):
+        self._channel = FakeChannel(self)
+        return self._channel
+
+    def process_data_events(self, time_limit=None):
+        if not self.is_open:
+            raise StreamLostError("connection lost")
+        if self._channel is not None:
+            self._channel.confirm(self._channel.published)
+
+    def close(self):
+        self.is_open = False
+
+
+class FakeImpl:
+    def __init__(self, channel):
+        self.channel = channel
+
+    def confirm_delivery(self, ack_nack_callback, callback):
+        self.channel.on_confirm = ack_nack_callback
+        callback(None)
+
+
+class FakeChannel:
+    def __init__(self, connection):
+        self.connection = connection
+        self.is_open = True
+        self.published = 0
+        self.on_confirm = None
+        self._impl = FakeImpl(self)
+
+    def queue_declare(self, queue, durable=False, arguments=None, passive=False):
+        pass
+
+    def add_on_return_callback(self, callback):
+        pass
+
+    def confirm(self, tag):
+        if tag:
+            self.on_confirm(pika.frame.Method(1, pika.spec.Basic.Ack(delivery_tag=tag, multiple=True)))
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        connection = self.connection
+        if connection.fail_after is not None and self.published >= connection.fail_after:
+            connection.is_open = self.is_open = False
+            raise StreamLostError("connection lost")
+        self.published += 1
+        connection.broker.received.append(json.loads(body))
+        self.confirm(self.published - 1)
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    def install(**kwargs):
+        fake = FakeBroker(**kwargs)
+        monkeypatch.setattr(rabbitmq.pika, "BlockingConnection", fake.connect)
+        return fake
+    return install
+
+
+def messages(count):
+    return [{"job_id": str(i)} for i in range(count)]
+
+
+def test_publish_many_resumes_after_the_confirmed_prefix(broker):
+    fake = broker(fail_after=40)
+    publisher = RabbitMQPublisher(pool_size=1, queues={}, max_attempts=3)
+
+    publisher.publish_many(messages(100))
+
+    ids = [message["job_id"] for message in fake.received]
+    assert set(ids) == {str(i) for i in range(100)}
+    # Only the message sent but not confirmed before the drop goes out twice
+    assert len(ids) == 101
+    assert fake.connections == 2
+    assert publisher.stats()["published"] == 100
+
+
+def test_publish_many_reports_the_confirmed_count_when_giving_up(broker):
+    fake = broker(fail_after=10, fail_connections=3)
+    publisher = RabbitMQPublisher(pool_size=1, queues={}, max_attempts=3)
+
+    with pytest.raises(PublishError) as error:
+        publisher.publish_many(messages(100))
+
+    # Each connection confirms all but the last message it got
+    assert error.value.published == 27
+    assert len(fake.received) == 30
+    assert publisher.stats()["failures"] == 1
+
+
+def test_pooled_connection_is_reused(broker):
+    fake = broker()
+    publisher = RabbitMQPublisher(pool_size=1, queues={}, max_attempts=1)
+    for i in range(5):
+        publisher.publish({"job_id": str(i)})
+    assert fake.connections == 1
+    assert len(fake.received) == 5
@@ -0,0 +1,153 @@
+import os
+import sys
+import json
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BASE_DIR, 'worker'))
+
+import pika
+
+import ocr_worker
+from ocr_processor import PREPARED_PAYLOAD_SUFFIX
+from shared.config import RABBITMQ_QUEUE, RETRY_DELAYS_SECONDS, RETRY_MAX_ATTEMPTS, DEAD_LETTER_QUEUE
+from shared.retries import (
+    ATTEMPT_HEADER, ERROR_HEADER, get_attempt, retry_delay, retry_queue_name, is_last_attempt
+)
+
+
+class FakeChannel:
+    def __init__(self, fail_publish=False):
+        self.is_open = True
+        self.fail_publish = fail_publish
+        self.published = []
+        self.acks = []
+        self.nacks = []
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        if self.fail_publish:
+            raise RuntimeError("broker gone")
+        self.published.append((exchange, routing_key, body, properties))
+
+    def basic_ack(self, delivery_tag):
+        self.acks.append(delivery_tag)
+
+    def basic_nack(self, delivery_tag, requeue):
+        self.nacks.append((delivery_tag, requeue))
+
+
+class InlineConnection:
+    """Runs the settlement right away instead of on the connection thread"""
+
+    def add_callback_threadsafe(self, callback):
+        callback()
+
+
+def properties(attempt=None, **headers):
+    if attempt is not None:
+        headers[ATTEMPT_HEADER] = attempt
+    return pika.BasicProperties(headers=headers or None)
+
+
+def test_get_attempt_reads_the_header():
+    assert get_attempt(properties()) == 1
+    assert get_attempt(properties(3)) == 3
+    assert get_attempt(properties("2")) == 2
+    assert get_attempt(properties("not a number")) == 1
+    assert get_attempt(properties(0)) == 1
+    assert get_attempt(None) == 1
+
+
+def test_retry_delay_uses_the_last_delay_for_later_attempts():
+    assert retry_delay(2) == RETRY_DELAYS_SECONDS[0]
+    assert retry_delay(50) == RETRY_DELAYS_SECONDS[-1]
+
+
+def test_retry_publishes_next_attempt_to_a_delay_queue_then_acks():
+    channel = FakeChannel()
+    ocr_worker.settle_message(channel, 7, "retry", "job-1", None, b'{"job_id": "job-1"}',
+                              properties(1, tenant="a"), 1, "timeout")
+
+    (exchange, routing_key, body, props), = channel.published
+    assert routing_key == retry_queue_name(retry_delay(2), RABBITMQ_QUEUE)
+    assert props.headers[ATTEMPT_HEADER] == 2
+    assert props.headers[ERROR_HEADER] == "timeout"
+    assert props.headers["tenant"] == "a"
+    assert props.delivery_mode == 2
+    # No result event: the job is not finished
+    assert channel.acks == [7]
+
+
+def test_retry_keeps_the_job_queue():
+    channel = FakeChannel()
+    ocr_worker.settle_message(channel, 1, "retry", "job-1", None, b'{}', properties(), 1,
+                              None, "ocr_queue.bulk.2")
+    assert channel.published[0][1] == retry_queue_name(retry_delay(2), "ocr_queue.bulk.2")
+
+
+def test_dead_letter_announces_acks_and_drops_the_prepared_payload(tmp_path):
+    image = tmp_path / "card.jpg"
+    sidecar = tmp_path / ("card.jpg" + PREPARED_PAYLOAD_SUFFIX)
+    sidecar.write_text("payload")
+    body = json.dumps({"job_id": "job-1", "filename": str(image)}).encode()
+    channel = FakeChannel()
+
+    ocr_worker.settle_message(channel, 3, "dead", "job-1", "error", body,
+                              properties(RETRY_MAX_ATTEMPTS), RETRY_MAX_ATTEMPTS, "boom")
+
+    dead, event = channel.published
+    assert dead[1] == DEAD_LETTER_QUEUE
+    assert dead[3].headers[ATTEMPT_HEADER] == RETRY_MAX_ATTEMPTS
+    assert json.loads(event[2]) == {"job_id": "job-1", "status": "error"}
+    assert channel.acks == [3]
+    assert not sidecar.exists()
+
+
+def test_unparsable_message_is_dead_lettered():
+    channel = FakeChannel()
+    ocr_worker.settle_message(channel, 3, "dead", None, None, b'not json', properties(), 1, "Invalid")
+    assert [message[1] for message in channel.published] == [DEAD_LETTER_QUEUE]
+    assert channel.acks == [3]
+
+
+def test_failed_reschedule_requeues_instead_of_acking():
+    channel = FakeChannel(fail_publish=True)
+    ocr_worker.settle_message(channel, 5, "retry", "job-1", None, b'{}', properties(), 1, "boom")
+    assert channel.acks == []
+    assert channel.nacks == [(5, True)]
+
+
+def test_closed_channel_settles_nothing():
+    channel = FakeChannel()
+    channel.is_open = False
+    ocr_worker.settle_message(channel, 5, "ack", "job-1", "completado")
+    assert channel.published == channel.acks == channel.nacks == []
+
+
+def failing_job(monkeypatch):
+    def process_job(data, attempt):
+        raise RuntimeError("model timeout")
+    monkeypatch.setattr(ocr_worker, "process_job", process_job)
+    monkeypatch.setattr(ocr_worker, "save_error_result", lambda job_id, error: None)
+
+
+def test_run_job_retries_with_the_attempt_from_the_header(monkeypatch):
+    failing_job(monkeypatch)
+    channel = FakeChannel()
+    ocr_worker.run_job(InlineConnection(), channel, 1, properties(1), b'{"job_id": "job-1"}')
+
+    (_, routing_key, _, props), = channel.published
+    assert routing_key.startswith(f"{RABBITMQ_QUEUE}.retry.")
+    assert props.headers[ATTEMPT_HEADER] == 2
+    assert props.headers[ERROR_HEADER] == "model timeout"
+
+
+def test_run_job_dead_letters_the_last_attempt(monkeypatch):
+    failing_job(monkeypatch)
+    channel = FakeChannel()
+    assert is_last_attempt(RETRY_MAX_ATTEMPTS)
+    ocr_worker.run_job(InlineConnection(), channel, 1, properties(RETRY_MAX_ATTEMPTS),
+                       b'{"job_id": "job-1"}')
+
+    assert channel.published[0][1] == DEAD_LETTER_QUEUE
+    assert json.loads(channel.published[1][2]) == {"job_id": "job-1", "status": "error"}
+    assert channel.acks == [1]
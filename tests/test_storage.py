@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import uuid
+import zipfile
+
+import pytest
+
+import storage
+from database import init_db, save_result_to_db, get_archive_segment, get_result
+
+DAY = storage.DAY
+
+
+@pytest.fixture(autouse=True)
+def storage_dirs(tmp_path, monkeypatch):
+    init_db()
+    uploads = tmp_path / "uploads"
+    results = tmp_path / "resultados"
+    uploads.mkdir()
+    results.mkdir()
+    monkeypatch.setattr(storage, "UPLOAD_DIR", str(uploads))
+    monkeypatch.setattr(storage, "RESULTS_DIR", str(results))
+    monkeypatch.setattr(storage, "ARCHIVE_DIR", str(results / "archivo"))
+
+
+def age(path, days):
+    when = time.time() - days * DAY
+    os.utime(path, (when, when))
+    return path
+
+
+def result_file(days_old=0):
+    job_id = str(uuid.uuid4())
+    storage.write_result_file({"job_id": job_id, "status": "completado", "nombre": "Ana"})
+    return job_id, age(storage.result_path(job_id), days_old)
+
+
+def finished_job(days_old=0):
+    job_id = str(uuid.uuid4())
+    processed_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time() - days_old * DAY))
+    save_result_to_db({"job_id": job_id, "status": "completado", "processed_at": processed_at})
+    return job_id
+
+
+def upload(job_id, days_old, suffix=".jpg", flat=False):
+    if flat:
+        path = os.path.join(storage.UPLOAD_DIR, f"carnet_{job_id}{suffix}")
+    else:
+        path = storage.upload_path(job_id, suffix)
+    with open(path, 'wb') as f:
+        f.write(b"image")
+    return age(path, days_old)
+
+
+def test_compact_archives_old_results_and_reads_them_back():
+    old = [result_file(days_old=5) for _ in range(2)]
+    recent_id, recent_path = result_file()
+
+    assert storage.compact_results(older_than_days=3) == 2
+
+    segments = os.listdir(storage.ARCHIVE_DIR)
+    assert len(segments) == 1 and storage.SEGMENT_NAME_PATTERN.match(segments[0])
+    for job_id, path in old:
+        assert not os.path.exists(path)
+        assert get_archive_segment(job_id) == segments[0]
+        assert storage.read_result_file(job_id)["nombre"] == "Ana"
+    with zipfile.ZipFile(os.path.join(storage.ARCHIVE_DIR, segments[0])) as archive:
+        assert all(info.compress_type == zipfile.ZIP_DEFLATED for info in archive.infolist())
+    assert os.path.exists(recent_path)
+
+
+def test_sweep_results_deletes_expired_rows_files_and_segments():
+    archived_id, _ = result_file(days_old=40)
+    storage.compact_results(older_than_days=30)
+    expired_id, expired_path = result_file(days_old=40)
+    kept_id, kept_path = result_file(days_old=1)
+    old_row, new_row = finished_job(days_old=40), finished_job(days_old=1)
+
+    rows, files, segments = storage.sweep_results(retention_days=30)
+
+    assert (files, segments) == (1, 1)
+    assert rows >= 1
+    assert not os.path.exists(expired_path) and os.path.exists(kept_path)
+    assert os.listdir(storage.ARCHIVE_DIR) == []
+    assert get_archive_segment(archived_id) is None
+    assert get_result(old_row) is None and get_result(new_row) is not None
+
+
+def test_sweep_uploads_keeps_queued_jobs_longer():
+    finished = finished_job()
+    finished_upload = upload(finished, days_old=10)
+    queued_upload = upload(str(uuid.uuid4()), days_old=10)
+    abandoned_upload = upload(str(uuid.uuid4()), days_old=20)
+    recent_upload = upload(finished_job(), days_old=1)
+
+    assert storage.sweep_uploads(retention_days=7) == 2
+
+    assert not os.path.exists(finished_upload)
+    assert os.path.exists(queued_upload)
+    assert not os.path.exists(abandoned_upload)
+    assert os.path.exists(recent_upload)
+
+
+def test_sweep_uploads_drops_prepared_payloads_and_stale_parts_without_retention():
+    finished = finished_job()
+    image = upload(finished, days_old=0)
+    prepared = upload(finished, days_old=0, suffix=".jpg.prepared.b64")
+    pending_prepared = upload(str(uuid.uuid4()), days_old=0, suffix=".jpg.prepared.b64")
+    stale_part = os.path.join(storage.UPLOAD_DIR, "upload-1.part")
+    open(stale_part, 'wb').close()
+    age(stale_part, 2)
+
+    storage.sweep_uploads(retention_days=0)
+
+    assert os.path.exists(image)
+    assert not os.path.exists(prepared)
+    assert os.path.exists(pending_prepared)
+    assert not os.path.exists(stale_part)
+
+
+def test_migrate_moves_flat_files_into_shards():
+    job_id = str(uuid.uuid4())
+    flat_result = os.path.join(storage.RESULTS_DIR, f"{job_id}.json")
+    with open(flat_result, 'w') as f:
+        json.dump({"job_id": job_id}, f)
+    finished = finished_job()
+    finished_upload = upload(finished, days_old=0, flat=True)
+    queued_upload = upload(str(uuid.uuid4()), days_old=0, flat=True)
+
+    assert storage.migrate_flat_layout() == (1, 1)
+
+    assert os.path.exists(storage.result_path(job_id))
+    assert not os.path.exists(finished_upload)
+    assert os.path.exists(os.path.join(storage.UPLOAD_DIR, storage.shard(finished), os.path.basename(finished_upload)))
+    assert os.path.exists(queued_upload)
@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from shared.config import BREAKER_FAILURE_THRESHOLD, BREAKER_PROBE_INITIAL_SECONDS, BREAKER_PROBE_MAX_SECONDS
+from shared.metrics import REGISTRY
+
+BREAKER_OPEN = REGISTRY.gauge('ocr_circuit_open', '1 while the circuit breaker of a backend is open')
+BREAKER_OPENED = REGISTRY.counter('ocr_circuit_opened_total', 'Times the circuit breaker of a backend opened')
+BREAKER_PROBES = REGISTRY.counter('ocr_circuit_probes_total', 'Recovery probes of an open circuit breaker, by result')
+
+
+class CircuitBreaker:
+    """
+    Stops sending work to a backend that keeps failing.
+
+    After threshold consecutive failures the breaker opens and calls the
+    on_open listeners. A background thread then probes the backend, with
+    exponential backoff between probes, and on the first success closes
+    the breaker and calls the on_close listeners. threshold <= 0 disables
+    it.
+    """
+
+    def __init__(self, name, probe, threshold=BREAKER_FAILURE_THRESHOLD,
+                 backoff=BREAKER_PROBE_INITIAL_SECONDS, max_backoff=BREAKER_PROBE_MAX_SECONDS):
+        self.name = name
+        self.probe = probe
+        self.threshold = threshold
+        self.backoff = backoff
+        self.max_backoff = max(backoff, max_backoff)
+        self._failures = 0
+        self._open = False
+        self._listeners = []
+        self._lock = threading.Lock()
+        BREAKER_OPEN.set(0, backend=name)
+
+    @property
+    def is_open(self):
+        return self._open
+
+    def add_listener(self, on_open=None, on_close=None):
+        self._listeners.append((on_open, on_close))
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+
+    def record_failure(self):
+        if self.threshold <= 0:
+            return
+        with self._lock:
+            self._failures += 1
+            if self._open or self._failures < self.threshold:
+                return
+            self._open = True
+
+        print(f"⛔ {self.name} failed {self.threshold} times in a row: circuit open, pausing consumption")
+        BREAKER_OPEN.set(1, backend=self.name)
+        BREAKER_OPENED.inc(backend=self.name)
+        self._notify(opened=True)
+        threading.Thread(target=self._probe_loop, name=f"{self.name}-breaker", daemon=True).start()
+
+    def _notify(self, opened):
+        for on_open, on_close in self._listeners:
+            listener = on_open if opened else on_close
+            if listener is None:
+                continue
+            try:
+                listener()
+            except Exception as e:
+                print(f"Circuit breaker listener failed: {e}")
+
+    def _probe_loop(self):
+        delay = self.backoff
+        while True:
+            time.sleep(delay)
+            try:
+                healthy = self.probe()
+            except Exception as e:
+                print(f"{self.name} probe failed: {e}")
+                healthy = False
+            BREAKER_PROBES.inc(backend=self.name, result="ok" if healthy else "failed")
+            if healthy:
+                break
+            delay = min(delay * 2, self.max_backoff)
+            print(f"{self.name} still down, next probe in {delay:.0f}s")
+
+        with self._lock:
+            self._failures = 0
+            self._open = False
+        print(f"✅ {self.name} is back: circuit closed, resuming consumption")
+        BREAKER_OPEN.set(0, backend=self.name)
+        self._notify(opened=False)
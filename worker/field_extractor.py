@@ -0,0 +1,211 @@
+import re
+import json
+import unicodedata
+from functools import lru_cache
+
+FIELDS = ("nombre", "codigo_estudiante", "carrera", "institucion")
+
+# Normalized label (no accents, lowercase, no spaces) -> field. The first
+# entry of each field is the label the prompt asks for.
+LABELS = {
+    "nombre": "nombre",
+    "nombres": "nombre",
+    "nombrecompleto": "nombre",
+    "nombresyapellidos": "nombre",
+    "estudiante": "nombre",
+    "alumno": "nombre",
+    "name": "nombre",
+    "studentname": "nombre",
+    "fullname": "nombre",
+    "codigo": "codigo_estudiante",
+    "codigoestudiantil": "codigo_estudiante",
+    "codigodeestudiante": "codigo_estudiante",
+    "codigoestudiante": "codigo_estudiante",
+    "matricula": "codigo_estudiante",
+    "carne": "codigo_estudiante",
+    "id": "codigo_estudiante",
+    "studentid": "codigo_estudiante",
+    "code": "codigo_estudiante",
+    "carrera": "carrera",
+    "programa": "carrera",
+    "programaacademico": "carrera",
+    "facultad": "carrera",
+    "program": "carrera",
+    "major": "carrera",
+    "institucion": "institucion",
+    "universidad": "institucion",
+    "institution": "institucion",
+    "university": "institucion",
+}
+CANONICAL_LABELS = {"nombre", "codigo", "carrera", "institucion"}
+
+# Ollama "format" constraint for OCR_OUTPUT_FORMAT=json: one string per field
+JSON_SCHEMA = {
+    "type": "object",
+    "properties": {field: {"type": "string"} for field in FIELDS},
+    "required": list(FIELDS),
+}
+# Complete "key": "value" pairs of a JSON answer cut short by num_predict
+JSON_PAIR_PATTERN = re.compile(r'"(\w+)"\s*:\s*("(?:[^"\\]|\\.)*"|-?\d+)')
+
+# "Label: value" lines, tolerating list markers, markdown bold and spaces
+# around the colon ("**Código :** 2021...")
+LINE_PATTERN = re.compile(
+    r"^[ \t>#*\-•]*([^\W\d_]+(?:[ \t]+[^\W\d_]+){0,3})[ \t*_]*[:：][ \t]*(.*)$",
+    re.MULTILINE
+)
+
+# Answers meaning "nothing there" rather than a value (normalized)
+EMPTY_VALUES = {
+    "", "na", "n/a", "no", "ninguno", "ninguna", "novisible", "noaplica", "nodisponible",
+    "desconocido", "notvisible", "notavailable", "unknown", "none", "null",
+}
+PLACEHOLDER_PATTERN = re.compile(r"^\[.*\]$")
+
+# A value that passes its field's validator is very likely right
+VALIDATORS = {
+    "nombre": re.compile(r"^[^\W\d_]+(?:[ '.\-][^\W\d_]+)+\.?$"),
+    "codigo_estudiante": re.compile(r"^[A-Z]{0,3}\d{5,12}$", re.IGNORECASE),
+    "carrera": re.compile(r"^[^\W\d_][\w ,.()'\-]{3,}$"),
+    "institucion": re.compile(r"^[^\W\d_][\w ,.()'\-]{2,}$"),
+}
+
+# Used when the model did not label a field
+FALLBACK_PATTERNS = {
+    "institucion": [
+        re.compile(r"(?i)universidad\s+([^\s,.]+(?:\s+[^\s,.]+){0,3})"),
+        re.compile(r"(?i)([^\s,.]+)\s+university"),
+        re.compile(r"(?i)(UPTC)"),
+    ],
+    "codigo_estudiante": [
+        re.compile(r"(?<![\d\-])\d{8,12}(?![\d\-])"),
+    ],
+}
+
+# Confidence of a value by how it was found. Not calibrated yet: these are
+# starting guesses. benchmarks/calibrate_confidence.py reports the share of
+# values that were right in each case over a file of labelled cards.
+CONFIDENCE = {
+    "label_valid": 0.95,    # prompt label, value passes the validator
+    "alias_valid": 0.9,     # another known label, value passes the validator
+    "label_invalid": 0.55,  # labelled, but the value looks wrong for the field
+    "fallback": 0.5,        # found by pattern in unlabelled text
+}
+
+
+@lru_cache(maxsize=4096)
+def normalize(text):
+    """Lowercase, strip accents and drop everything but letters and digits"""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in decomposed if ch.isalnum()).lower()
+
+
+def match_label(label):
+    """Return (field, canonical) for a label as written by the model, or (None, False)"""
+    normalized = normalize(label)
+    field = LABELS.get(normalized)
+    if field is None:
+        # "Código estudiantil UPTC", "Nombre del estudiante"...: go by the first word
+        first_word = normalize(label.split(None, 1)[0])
+        field = LABELS.get(first_word)
+        return field, False
+    return field, normalized in CANONICAL_LABELS
+
+
+def clean_value(value):
+    value = value.strip().strip("*_`\"'").strip()
+    if PLACEHOLDER_PATTERN.match(value) or normalize(value) in EMPTY_VALUES:
+        return ""
+    return value
+
+
+def is_valid(field, value):
+    return bool(VALIDATORS[field].match(value.replace(" ", "") if field == "codigo_estudiante" else value))
+
+
+def _json_pairs(text):
+    """(key, value) pairs of a JSON object answer, salvaging a truncated one"""
+    try:
+        data = json.loads(text)
+        return list(data.items()) if isinstance(data, dict) else []
+    except ValueError:
+        pairs = []
+        for key, raw_value in JSON_PAIR_PATTERN.findall(text):
+            try:
+                pairs.append((key, json.loads(raw_value)))
+            except ValueError:
+                continue
+        return pairs
+
+
+def extract_json(text):
+    """
+    Fields of a JSON answer (OCR_OUTPUT_FORMAT=json). Keys are matched like
+    labels and values go through the same validators. Returns None when
+    no field could be read, so the caller falls back to the text parser.
+    """
+    values = {}
+    confidence = {}
+    for key, value in _json_pairs(text):
+        field = LABELS.get(normalize(str(key)))
+        if field is None or field in values or not isinstance(value, (str, int)):
+            continue
+        value = clean_value(str(value))
+        if not value:
+            continue
+        values[field] = value
+        confidence[field] = CONFIDENCE["label_valid" if is_valid(field, value) else "label_invalid"]
+    if not values:
+        return None
+    return _result(text, values, confidence)
+
+
+def _result(text, values, confidence):
+    result = {"raw_text": text}
+    for field in FIELDS:
+        result[field] = values.get(field, "")
+    result["confidence"] = {field: confidence.get(field, 0.0) for field in FIELDS}
+    return result
+
+
+def extract(text):
+    """
+    Parse the model's transcription into the card fields.
+
+    JSON answers are read as such. Otherwise, one pass over the
+    "Label: value" lines; the first non-empty value of each field wins.
+    Unlabelled institution names and student codes are then looked up
+    with fallback patterns. Returns the extracted fields plus a
+    "confidence" dict with a 0-1 score per field.
+    """
+    if text.lstrip().startswith("{"):
+        result = extract_json(text)
+        if result is not None:
+            return result
+
+    values = {}
+    confidence = {}
+    for match in LINE_PATTERN.finditer(text):
+        field, canonical = match_label(match.group(1))
+        if field is None or field in values:
+            continue
+        value = clean_value(match.group(2))
+        if not value:
+            continue
+        values[field] = value
+        if is_valid(field, value):
+            confidence[field] = CONFIDENCE["label_valid" if canonical else "alias_valid"]
+        else:
+            confidence[field] = CONFIDENCE["label_invalid"]
+
+    for field, patterns in FALLBACK_PATTERNS.items():
+        if field in values:
+            continue
+        for pattern in patterns:
+            match = pattern.search(text)
+            if match:
+                values[field] = match.group(0).strip()
+                confidence[field] = CONFIDENCE["fallback"]
+                break
+
+    return _result(text, values, confidence)
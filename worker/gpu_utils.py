@@ -1,4 +1,6 @@
 import subprocess
+import threading
+import time
 import json
 
 def check_gpu_usage():
@@ -30,4 +32,36 @@ def check_gpu_usage():
         return {
             "gpu_available": False,
             "error": str(e)
-        }
\ No newline at end of file
+        }
+
+def start_gpu_sampler(registry, interval):
+    """
+    Sample check_gpu_usage() every `interval` seconds into gauges of the
+    given metrics registry (only once if interval is 0). Returns the
+    first sample.
+    """
+    available = registry.gauge('ocr_gpu_available', 'Whether nvidia-smi reports a usable GPU')
+    utilization = registry.gauge('ocr_gpu_utilization_percent', 'GPU utilization')
+    memory_utilization = registry.gauge('ocr_gpu_memory_utilization_percent', 'GPU memory controller utilization')
+    memory_used = registry.gauge('ocr_gpu_memory_used_mb', 'GPU memory in use')
+    memory_total = registry.gauge('ocr_gpu_memory_total_mb', 'Total GPU memory')
+
+    def sample():
+        gpu_info = check_gpu_usage()
+        available.set(1 if gpu_info["gpu_available"] else 0)
+        if gpu_info["gpu_available"]:
+            utilization.set(gpu_info["gpu_utilization"])
+            memory_utilization.set(gpu_info["memory_utilization"])
+            memory_used.set(gpu_info["memory_used_mb"])
+            memory_total.set(gpu_info["memory_total_mb"])
+        return gpu_info
+
+    def run():
+        while True:
+            time.sleep(interval)
+            sample()
+
+    first_sample = sample()
+    if interval > 0:
+        threading.Thread(target=run, name="gpu-sampler", daemon=True).start()
+    return first_sample
@@ -0,0 +1,118 @@
+import io
+import time
+from PIL import Image, ImageChops, ImageOps
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from shared.config import (
+    PREPROCESS_ENABLED, PREPROCESS_MAX_SIDE, PREPROCESS_AUTOCROP,
+    PREPROCESS_GRAYSCALE, PREPROCESS_AUTOCONTRAST, PREPROCESS_FORMAT,
+    PREPROCESS_QUALITY
+)
+
+SUPPORTED_FORMATS = ("JPEG", "WEBP")
+
+# Pixels closer than this to the border colour are treated as background by autocrop
+AUTOCROP_THRESHOLD = 24
+
+
+def preprocess_image(image_bytes, max_side=PREPROCESS_MAX_SIDE, autocrop=PREPROCESS_AUTOCROP,
+                     grayscale=PREPROCESS_GRAYSCALE, autocontrast=PREPROCESS_AUTOCONTRAST,
+                     output_format=PREPROCESS_FORMAT, quality=PREPROCESS_QUALITY,
+                     enabled=PREPROCESS_ENABLED):
+    """
+    Prepare an image for the vision model.
+
+    Stages: decode, EXIF orientation fix, optional autocrop, max-side
+    resize, optional grayscale/autocontrast and re-encode. image_bytes
+    may also be a read-only mmap of the image file. Returns a tuple
+    (image_bytes, stats) where stats holds per-stage timings in ms and the
+    byte savings. If re-encoding would make the image bigger without
+    having changed its dimensions, the original bytes are kept.
+    """
+    stats = {
+        "original_bytes": len(image_bytes),
+        "output_bytes": len(image_bytes),
+        "saved_bytes": 0,
+        "timings_ms": {},
+        "applied": False
+    }
+    if not enabled:
+        return image_bytes, stats
+
+    if output_format not in SUPPORTED_FORMATS:
+        raise ValueError(f"Unsupported pre-processing format: {output_format}")
+
+    timings = stats["timings_ms"]
+
+    def stage(name, started):
+        timings[name] = round((time.perf_counter() - started) * 1000, 2)
+        return time.perf_counter()
+
+    t = time.perf_counter()
+    image = Image.open(io.BytesIO(image_bytes) if isinstance(image_bytes, bytes) else image_bytes)
+    stats["original_size"] = image.size
+    if image.format == "JPEG" and max_side:
+        # Let the JPEG decoder downscale by a power of two while decoding
+        image.draft("RGB", (max_side, max_side))
+    image.load()
+    t = stage("decode", t)
+
+    image = ImageOps.exif_transpose(image)
+    t = stage("exif_transpose", t)
+
+    if autocrop:
+        image = _autocrop(image)
+        t = stage("autocrop", t)
+
+    if max_side and max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        t = stage("resize", t)
+
+    if grayscale:
+        image = image.convert("L")
+    elif image.mode not in ("RGB", "L"):
+        # JPEG/WebP have no palette or alpha support worth keeping for OCR
+        image = image.convert("RGB")
+    if autocontrast:
+        image = ImageOps.autocontrast(image, cutoff=1)
+    t = stage("color", t)
+
+    output = io.BytesIO()
+    image.save(output, format=output_format, quality=quality)
+    encoded = output.getvalue()
+    stage("encode", t)
+
+    stats["output_size"] = image.size
+    if len(encoded) >= len(image_bytes) and image.size == stats["original_size"]:
+        return image_bytes, stats
+
+    stats["output_bytes"] = len(encoded)
+    stats["saved_bytes"] = len(image_bytes) - len(encoded)
+    stats["applied"] = True
+    return encoded, stats
+
+
+def _autocrop(image):
+    """Trim uniform borders around the card, using the top-left pixel as background"""
+    rgb = image.convert("RGB")
+    background = Image.new("RGB", rgb.size, rgb.getpixel((0, 0)))
+    diff = ImageChops.difference(rgb, background).convert("L")
+    mask = diff.point(lambda value: 255 if value > AUTOCROP_THRESHOLD else 0)
+    bbox = mask.getbbox()
+    if not bbox:
+        return image
+    return image.crop(bbox)
+
+
+def format_stats(stats):
+    """One-line summary of the pre-processing stats for logs"""
+    if not stats["applied"]:
+        return f"original image kept ({stats['original_bytes']} bytes)"
+    stages = ", ".join(f"{name} {ms}ms" for name, ms in stats["timings_ms"].items())
+    return (f"{stats['original_size'][0]}x{stats['original_size'][1]} -> "
+            f"{stats['output_size'][0]}x{stats['output_size'][1]}, "
+            f"{stats['original_bytes']} -> {stats['output_bytes']} bytes "
+            f"(-{stats['saved_bytes']}) [{stages}]")
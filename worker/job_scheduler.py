@@ -0,0 +1,84 @@
+import threading
+from collections import OrderedDict, deque
+
+
+class JobScheduler:
+    """
+    Local buffer between the RabbitMQ consumers and the job threads.
+
+    The worker prefetches a few deliveries from every job queue; the job
+    threads then take them by smooth weighted round-robin between priority
+    classes (so interactive jobs go first without starving bulk ones) and
+    round-robin between fairness keys inside a class.
+    """
+
+    def __init__(self, weights):
+        self.weights = {name: max(1, weight) for name, weight in weights.items()}
+        self._cond = threading.Condition()
+        # priority -> OrderedDict(fairness_key -> deque of items)
+        self._pending = {}
+        self._credits = dict.fromkeys(self.weights, 0)
+        self._closed = False
+
+    def put(self, priority, fairness_key, item):
+        with self._cond:
+            keys = self._pending.setdefault(priority, OrderedDict())
+            keys.setdefault(fairness_key or '', deque()).append(item)
+            self._cond.notify()
+
+    def get(self):
+        """Block until an item is available; None once the scheduler is closed"""
+        with self._cond:
+            while not self._closed:
+                priority = self._pick_priority()
+                if priority is not None:
+                    return self._pop(priority)
+                self._cond.wait()
+            return None
+
+    def _pick_priority(self):
+        ready = [priority for priority, keys in self._pending.items() if keys]
+        if not ready:
+            return None
+        total = 0
+        for priority in ready:
+            weight = self.weights.get(priority, 1)
+            self._credits[priority] = self._credits.get(priority, 0) + weight
+            total += weight
+        chosen = max(ready, key=lambda priority: self._credits[priority])
+        self._credits[chosen] -= total
+        return chosen
+
+    def _pop(self, priority):
+        keys = self._pending[priority]
+        key, items = next(iter(keys.items()))
+        item = items.popleft()
+        if items:
+            # Next time, another client's job goes first
+            keys.move_to_end(key)
+        else:
+            del keys[key]
+        return item
+
+    def pending(self):
+        with self._cond:
+            return {priority: sum(len(items) for items in keys.values())
+                    for priority, keys in self._pending.items()}
+
+    def drain(self):
+        """Remove and return every buffered item"""
+        with self._cond:
+            items = [item for keys in self._pending.values() for items in keys.values() for item in items]
+            self._pending.clear()
+            return items
+
+    def clear(self):
+        """Drop the buffered deliveries (their channel is gone; the broker redelivers them)"""
+        with self._cond:
+            self._pending.clear()
+
+    def close(self):
+        """Wake up the job threads and make get() return None"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
@@ -0,0 +1,130 @@
+import os
+import sys
+import time
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    try:
+        import msvcrt
+    except ImportError:
+        msvcrt = None
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from shared.config import KEEP_WARM_INTERVAL, MODEL_WARM_MARKER
+from shared.metrics import REGISTRY
+
+KEEP_WARM_PINGS = REGISTRY.counter('ocr_model_keep_warm_pings_total', 'Requests sent only to load or keep the model loaded')
+
+
+def _lock(handle):
+    """Exclusive lock on an open file: flock on POSIX, msvcrt on Windows, none elsewhere"""
+    if fcntl is not None:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+    elif msvcrt is not None:
+        while True:
+            try:
+                # LK_LOCK gives up after ~10s; keep waiting like flock does
+                msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+
+
+def _unlock(handle):
+    if fcntl is not None:
+        fcntl.flock(handle, fcntl.LOCK_UN)
+    elif msvcrt is not None:
+        handle.seek(0)
+        msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class ModelKeeper:
+    """
+    Keeps the vision model resident in Ollama.
+
+    Workers on the same host share a marker file whose mtime is the last
+    time any of them used (or warmed) the model. Warming happens under an
+    exclusive lock on the marker, and is skipped when the marker shows the
+    model was used recently, so N workers starting together (or going idle
+    together) load the model once.
+
+    The dedupe is per host only: the marker and its lock are local files,
+    so workers on different machines sharing one Ollama server each warm
+    the model on their own. Without a file lock (neither fcntl nor msvcrt
+    available) workers starting together may both send the warm request.
+    """
+
+    def __init__(self, client, interval=KEEP_WARM_INTERVAL, marker_path=MODEL_WARM_MARKER):
+        self.client = client
+        self.interval = interval
+        self.marker_path = marker_path
+        os.makedirs(os.path.dirname(marker_path), exist_ok=True)
+
+    def _marker_time(self):
+        try:
+            return os.path.getmtime(self.marker_path)
+        except OSError:
+            return 0.0
+
+    def last_used(self):
+        """Last time any worker on this host used the model (0 if never)"""
+        return max(self._marker_time(), self.client.last_used)
+
+    def mark_used(self, when=None):
+        when = when or time.time()
+        with open(self.marker_path, 'a'):
+            pass
+        os.utime(self.marker_path, (when, when))
+
+    def publish_last_use(self):
+        """Share this worker's last request with the others"""
+        if self.client.last_used > self._marker_time():
+            self.mark_used(self.client.last_used)
+
+    def warm(self, max_age=None, reason="keep-warm"):
+        """
+        Load the model unless some worker used it within max_age seconds.
+        Returns True when this call sent the request.
+        """
+        max_age = self.interval if max_age is None else max_age
+        with open(f"{self.marker_path}.lock", 'w') as lock:
+            # Other workers wait here, then see the fresh marker and skip
+            _lock(lock)
+            try:
+                if time.time() - self.last_used() < max_age:
+                    return False
+                started = time.perf_counter()
+                load_seconds = self.client.load_model()
+                KEEP_WARM_PINGS.inc(reason=reason)
+                self.mark_used()
+                print(f"🔥 Model {self.client.model} {reason}: ready in "
+                      f"{time.perf_counter() - started:.1f}s (load {load_seconds:.1f}s)")
+                return True
+            finally:
+                _unlock(lock)
+
+    def start(self, is_idle):
+        """
+        Background thread: publishes this worker's last use to the shared
+        marker and, while is_idle() is true, keeps the model loaded.
+        """
+        if self.interval <= 0:
+            return self
+        threading.Thread(target=self._run, args=(is_idle,), name="model-keeper", daemon=True).start()
+        return self
+
+    def _run(self, is_idle):
+        # Check several times per interval so the ping lands before keep_alive runs out
+        tick = max(1.0, self.interval / 4)
+        while True:
+            time.sleep(tick)
+            try:
+                self.publish_last_use()
+                if is_idle():
+                    self.warm()
+            except Exception as e:
+                print(f"⚠️ Keep-warm failed: {e}")
@@ -0,0 +1,83 @@
+import os
+import sys
+from PIL import Image, ImageOps
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from shared.config import TESSERACT_LANG, TESSERACT_CONFIG
+
+try:
+    import pytesseract
+except ImportError:  # optional: only needed for the tesseract engine
+    pytesseract = None
+
+
+class OcrEngine:
+    """
+    A way of turning a card image into text. Engines are tried in the
+    order of OCR_ENGINES; recognize() returns the transcription, or None
+    when the engine failed.
+    """
+    name = None
+
+    def available(self):
+        return True
+
+    def recognize(self, image_path):
+        raise NotImplementedError
+
+
+ENGINES = {}
+
+
+def register_engine(cls):
+    """Class decorator making an engine selectable by name in OCR_ENGINES"""
+    ENGINES[cls.name] = cls
+    return cls
+
+
+@register_engine
+class TesseractEngine(OcrEngine):
+    """Local Tesseract OCR on the CPU: fast, good enough for clean scans"""
+    name = "tesseract"
+
+    # Tesseract reads small text much better above this size
+    MIN_SIDE = 1000
+
+    def __init__(self, lang=TESSERACT_LANG, config=TESSERACT_CONFIG):
+        self.lang = lang
+        self.config = config
+
+    def available(self):
+        if pytesseract is None:
+            return False
+        try:
+            pytesseract.get_tesseract_version()
+            return True
+        except Exception:
+            return False
+
+    def recognize(self, image_path):
+        with Image.open(image_path) as image:
+            image = ImageOps.exif_transpose(image).convert("L")
+        if max(image.size) < self.MIN_SIDE:
+            scale = self.MIN_SIDE / max(image.size)
+            image = image.resize((int(image.width * scale), int(image.height * scale)), Image.LANCZOS)
+        text = pytesseract.image_to_string(image, lang=self.lang, config=self.config)
+        return text.strip() or None
+
+
+def build_engines(names):
+    """Instantiate the named engines, skipping unknown or unavailable ones"""
+    engines = []
+    for name in names:
+        cls = ENGINES.get(name)
+        if cls is None:
+            print(f"⚠️ Unknown OCR engine '{name}', skipping it")
+            continue
+        engine = cls()
+        if not engine.available():
+            print(f"⚠️ OCR engine '{name}' is not available (missing dependency?), skipping it")
+            continue
+        engines.append(engine)
+    return engines
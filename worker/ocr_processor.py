@@ -1,136 +1,215 @@
 import base64
-import requests
-import json
-import time
-from PIL import Image
-import io
+import mmap
+from contextlib import contextmanager, ExitStack
 import os
 import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
-OLLAMA_MODEL = "qwen2.5vl:7b"  # Hardcoded model name
 
-def process_image_ocr(image_path, max_retries=3):
+from shared.config import (
+    OCR_ENGINES, OCR_REQUIRED_FIELDS, OCR_MIN_CONFIDENCE,
+    OCR_OUTPUT_FORMAT, OCR_NUM_PREDICT, OCR_STOP_SEQUENCES
+)
+from shared.prompts import OCR_PROMPT, OCR_JSON_PROMPT
+from ollama_client import get_client
+from circuit_breaker import CircuitBreaker
+from image_preprocess import preprocess_image, format_stats
+import field_extractor
+from ocr_engines import OcrEngine, register_engine, build_engines
+from shared.metrics import REGISTRY, span
+
+OLLAMA_ERRORS = REGISTRY.counter('ocr_ollama_errors_total', 'Failed or empty Ollama requests')
+ENGINE_RESULTS = REGISTRY.counter('ocr_engine_results_total', 'OCR engine runs by outcome (accepted, escalated, failed)')
+
+# Opens after BREAKER_FAILURE_THRESHOLD failed model requests in a row; the
+# worker stops consuming jobs until a probe finds Ollama up again
+BACKEND_BREAKER = CircuitBreaker("ollama", probe=lambda: get_client().ping())
+
+# Bounds on the generated answer of each card
+GENERATION_OPTIONS = {}
+if OCR_NUM_PREDICT > 0:
+    GENERATION_OPTIONS["num_predict"] = OCR_NUM_PREDICT
+if OCR_STOP_SEQUENCES:
+    GENERATION_OPTIONS["stop"] = OCR_STOP_SEQUENCES
+
+
+def card_request_params():
+    """Prompt and request parameters of a single-card request (OCR_OUTPUT_FORMAT)"""
+    if OCR_OUTPUT_FORMAT == "json":
+        # The schema bounds the answer; it ends with the closing brace
+        return OCR_JSON_PROMPT, {"format": field_extractor.JSON_SCHEMA, "options": GENERATION_OPTIONS}
+    # Stream the answer and stop as soon as the four fields are out
+    return OCR_PROMPT, {"stop_when_fields_complete": True, "options": GENERATION_OPTIONS}
+
+
+# A failed attempt leaves the prepared base64 payload next to the upload,
+# so the broker retry does not pre-process and encode the image again
+PREPARED_PAYLOAD_SUFFIX = '.prepared.b64'
+
+
+@contextmanager
+def map_file(path):
+    """Read-only memory map of a file, so it is never copied into memory up front"""
+    with open(path, "rb") as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            yield f.read()
+            return
+        try:
+            yield mapped
+        finally:
+            mapped.close()
+
+
+def prepare_payload(image_path):
+    """
+    Pre-process (resize, re-encode...) and base64-encode an image once.
+    Returns the payload as ASCII bytes, ready to be sent to the model.
+    """
+    with map_file(image_path) as image_bytes:
+        prepared = image_bytes
+        try:
+            with span("preprocess"):
+                prepared, stats = preprocess_image(image_bytes)
+            print(f"Image pre-processing: {format_stats(stats)}")
+        except Exception as e:
+            # Let the model try the original file anyway
+            print(f"Image pre-processing failed, using original image: {e}")
+
+        with span("base64_encode"):
+            return base64.b64encode(prepared)
+
+
+def save_prepared_payload(path, payload):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(payload)
+    os.replace(temp_path, path)
+
+
+def request_model(prompt, images, **params):
+    """
+    Send a chat request to Ollama, counting it in BACKEND_BREAKER: only
+    requests that raise are failures, an empty answer means the server
+    is up
+    """
+    try:
+        text = get_client().chat(prompt, images=images, **params)
+    except Exception:
+        BACKEND_BREAKER.record_failure()
+        raise
+    BACKEND_BREAKER.record_success()
+    return text
+
+
+def process_image_ocr(image_path):
     """
-    Process an image using the Ollama OCR model with retry logic
-    No image modifications applied - using original image
+    Process an image using the Ollama OCR model
+    The image goes through the pre-processing stage (resize, re-encode...)
+    and base64 encoding once per job: a failed attempt keeps the payload
+    for the next delivery. Each attempt makes a single request: the worker
+    retries failed jobs later through the broker's delay queues
     """
-    # Process with multiple retry attempts
-    for attempt in range(max_retries):
+    prepared_path = image_path + PREPARED_PAYLOAD_SUFFIX
+    with ExitStack() as stack:
+        reused = os.path.exists(prepared_path)
+        if reused:
+            print("Reusing the image payload prepared by a previous attempt")
+            with span("file_read"):
+                base64_image = stack.enter_context(map_file(prepared_path))
+        else:
+            base64_image = prepare_payload(image_path)
+
+        ocr_text = None
         try:
-            print(f"OCR processing attempt {attempt+1}/{max_retries}")
-            
-            # Encode original image to base64 without any modifications
-            with open(image_path, "rb") as img_file:
-                base64_image = base64.b64encode(img_file.read()).decode('utf-8')
-            
-            # Use a specific prompt for OCR
-            system_prompt = """This is an OCR task. TRANSCRIBE ALL TEXT from this student ID card image.
-
-DO NOT describe the image. DO NOT count fields.
-DO NOT say what's visible or not visible.
-ONLY TRANSCRIBE THE ACTUAL TEXT you can see on the card.
-
-Look for and transcribe:
-- Student name
-- Student ID number/code
-- Program/major
-- University name
-
-Format each field with a label EXACTLY like this:
-Nombre: [transcribed student name]
-Código: [transcribed student ID number]
-Carrera: [transcribed program/major]
-Institución: [transcribed university name]"""
-            
-            # Non-streaming approach
-            import json
-            import os
-
-            # Get parameters from environment
-            params_str = os.getenv('OLLAMA_PARAMETERS', '{}')
-            model_params = json.loads(params_str)
-
-            # Add to your API request
-            response = requests.post(
-                "http://localhost:11434/api/chat",
-                json={
-                    "model": OLLAMA_MODEL,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": system_prompt,
-                            "images": [base64_image],
-                        },
-                    ],
-                    "stream": False,
-                    **model_params,  # Add all parameters from config
-                },
-                timeout=180,  # Increased timeout from 90 to 180 seconds
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                ocr_text = data.get("message", {}).get("content", "")
-                if ocr_text:
-                    print("OCR processing successful")
-                    return ocr_text
-                else:
-                    print("OCR returned empty response")
+            prompt, params = card_request_params()
+            with span("ollama_request"):
+                ocr_text = request_model(prompt, images=[base64_image], **params)
+            if ocr_text:
+                print("OCR processing successful")
             else:
-                print(f"Error from Ollama API: {response.status_code} - {response.text}")
-                
+                print("OCR returned empty response")
+                OLLAMA_ERRORS.inc()
         except Exception as e:
             print(f"Error in OCR processing: {e}")
-        
-        # Wait before retrying
-        if attempt < max_retries - 1:
-            sleep_time = 5 * (attempt + 1)
-            print(f"Retrying in {sleep_time} seconds...")
-            time.sleep(sleep_time)
-    
+            OLLAMA_ERRORS.inc()
+
+    if ocr_text:
+        if reused:
+            os.remove(prepared_path)
+        return ocr_text
+
+    if not reused:
+        try:
+            save_prepared_payload(prepared_path, base64_image)
+        except OSError as e:
+            print(f"Could not keep the prepared payload: {e}")
     return None
 
+
 def extract_fields(text):
-    """Improved extraction with better institution handling"""
-    extracted_data = {
-        "raw_text": text,
-        "nombre": "",
-        "codigo_estudiante": "",
-        "carrera": "",
-        "institucion": ""
-    }
-    
-    # Parse labeled output (if model followed the prompt format)
-    lines = text.split('\n')
-    for line in lines:
-        line = line.strip()
-        if line.lower().startswith("nombre:"):
-            extracted_data["nombre"] = line[7:].strip()
-        elif line.lower().startswith("código:") or line.lower().startswith("codigo:"):
-            extracted_data["codigo_estudiante"] = line[7:].strip()
-        elif line.lower().startswith("carrera:"):
-            extracted_data["carrera"] = line[8:].strip()
-        elif line.lower().startswith("institución:") or line.lower().startswith("institucion:"):
-            extracted_data["institucion"] = line[12:].strip()
-    
-    # Extract institution if not found above
-    if not extracted_data["institucion"]:
-        # Look for university names
-        import re
-        uni_patterns = [
-            r"(?i)universidad\s+([^\s,.]+(?:\s+[^\s,.]+){0,3})",
-            r"(?i)([^\s,.]+)\s+university",
-            r"(?i)(UPTC)"
-        ]
-        
-        for pattern in uni_patterns:
-            matches = re.search(pattern, text)
-            if matches:
-                extracted_data["institucion"] = matches.group(0).strip()
-                break
-    
-    # More extraction logic as fallback...
-    # (keep your existing extraction code here)
-    
-    return extracted_data
\ No newline at end of file
+    """
+    Extract the card fields from the OCR text (JSON answer or labelled
+    lines), with a confidence score per field (see field_extractor)
+    """
+    return field_extractor.extract(text)
+
+
+@register_engine
+class OllamaEngine(OcrEngine):
+    """The vision LLM: slow and GPU-bound, but reads hard cards"""
+    name = "ollama"
+
+    def recognize(self, image_path):
+        return process_image_ocr(image_path)
+
+
+def needs_escalation(result_data, required_fields=OCR_REQUIRED_FIELDS, min_confidence=OCR_MIN_CONFIDENCE):
+    """True when a required field is missing or below the confidence threshold"""
+    return any(result_data["confidence"].get(field, 0.0) < min_confidence for field in required_fields)
+
+
+_engines = None
+
+
+def get_engines():
+    global _engines
+    if _engines is None:
+        # Never end up without an engine
+        _engines = build_engines(OCR_ENGINES) or [OllamaEngine()]
+        print(f"OCR engines: {' -> '.join(engine.name for engine in _engines)}")
+    return _engines
+
+
+def recognize_card(image_path):
+    """
+    Run the OCR engines from cheapest to most expensive and extract the
+    card fields. A cheaper engine's result is accepted when it has every
+    required field with enough confidence; otherwise the next engine
+    runs. Returns the extract_fields() result with the engine used, or
+    None if the last engine failed (so the job is retried).
+    """
+    engines = get_engines()
+    for position, engine in enumerate(engines):
+        last = position == len(engines) - 1
+        try:
+            with span(f"engine_{engine.name}"):
+                text = engine.recognize(image_path)
+        except Exception as e:
+            print(f"OCR engine {engine.name} failed: {e}")
+            text = None
+        if not text:
+            ENGINE_RESULTS.inc(engine=engine.name, outcome="failed")
+            continue
+
+        with span("extract_fields"):
+            result_data = extract_fields(text)
+        result_data["engine"] = engine.name
+        if last or not needs_escalation(result_data):
+            ENGINE_RESULTS.inc(engine=engine.name, outcome="accepted")
+            return result_data
+        print(f"OCR engine {engine.name} missed required fields, escalating")
+        ENGINE_RESULTS.inc(engine=engine.name, outcome="escalated")
+    return None
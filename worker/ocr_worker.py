@@ -3,12 +3,34 @@ import json
 import pika
 import time
 import sys
-import requests
+import argparse
+import signal
+import functools
 import base64
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from ocr_processor import process_image_ocr, extract_fields, OLLAMA_MODEL
-from gpu_utils import check_gpu_usage
-from database import init_db, save_result_to_db
+
+# Add the project root to Python path if needed
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from ocr_processor import recognize_card, needs_escalation, BACKEND_BREAKER, PREPARED_PAYLOAD_SUFFIX
+from ollama_client import get_client
+from model_keeper import ModelKeeper
+from gpu_utils import start_gpu_sampler
+from database import init_db, ResultWriter
+from storage import write_result_file
+from job_scheduler import JobScheduler
+from shared.config import (
+    RABBITMQ_HOST, RABBITMQ_PORT, RABBITMQ_QUEUE, OLLAMA_MODEL, WORKER_CONCURRENCY,
+    GPU_SAMPLE_INTERVAL, PRIORITY_WEIGHTS
+)
+from shared.rabbitmq import JOB_QUEUES, PRIORITY_INTERACTIVE, PRIORITY_BULK
+from shared.result_cache import ResultCache, file_cache_key
+from shared.result_events import declare_results_exchange, publish_result_event
+from shared.retries import (
+    declare_retry_queues, get_attempt, is_last_attempt, publish_retry, publish_dead_letter
+)
+from shared.metrics import REGISTRY, SnapshotWriter, job_context, span, set_attempt
 
 # Load environment variables
 load_dotenv()
@@ -16,123 +38,271 @@ load_dotenv()
 # Initialize the database
 init_db()
 
-# Create results directory
-BASE_DIR = os.path.dirname(os.path.dirname(__file__))
-RESULT_FOLDER = os.path.join(BASE_DIR, 'data', 'resultados')
-os.makedirs(RESULT_FOLDER, exist_ok=True)
+# Groups result writes from the job threads into shared transactions
+result_writer = ResultWriter()
 
-# Add the project root to Python path if needed
-sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
-from shared.config import RABBITMQ_HOST, RABBITMQ_PORT, RABBITMQ_QUEUE
+# Results of previously processed identical images
+result_cache = ResultCache()
 
-def warmup_model():
-    """Pre-warm the model with a simple request"""
+# Worker metrics, merged by the API's /metrics endpoint
+JOBS_TOTAL = REGISTRY.counter('ocr_jobs_total', 'Jobs processed by final status')
+JOB_SECONDS = REGISTRY.histogram('ocr_job_duration_seconds', 'Time spent processing a job in the worker')
+JOBS_IN_FLIGHT = REGISTRY.gauge('ocr_jobs_in_flight', 'Jobs currently being processed')
+CACHE_LOOKUPS = REGISTRY.counter('ocr_cache_lookups_total', 'Worker result cache lookups')
+JOB_RETRIES = REGISTRY.counter('ocr_retries_total', 'Jobs sent to a delay queue for another attempt')
+DEAD_LETTERS = REGISTRY.counter('ocr_dead_letters_total', 'Jobs moved to the dead-letter queue')
+QUEUE_WAIT_SECONDS = REGISTRY.histogram('ocr_queue_wait_seconds', 'Time from upload until a worker starts the job, by priority')
+BUFFERED_JOBS = REGISTRY.gauge('ocr_worker_buffered_jobs', 'Prefetched jobs waiting for a job thread, by priority')
+# Read by the API's admission control to size the worker pool
+WORKER_SLOTS = REGISTRY.gauge('ocr_worker_concurrency', 'Jobs this worker runs in parallel')
+
+
+class RetryableJobError(Exception):
+    """The job failed but a later attempt may succeed"""
+
+def warmup_model(keeper):
+    """
+    Load the model before taking jobs, unless another worker on this host
+    already did (or used it) within the keep-warm interval
+    """
     print("🔥 Pre-warming the vision model...")
     try:
-        # Create a simple 1x1 pixel image for warming up
-        sample_image = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAADElEQVQI12P4//8/AAX+Av7czFnnAAAAAElFTkSuQmCC"
-        
-        # Simple warm-up request
-        response = requests.post(
-            "http://localhost:11434/api/chat",
-            json={
-                "model": OLLAMA_MODEL,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": "Describe this image briefly",
-                        "images": [sample_image],
-                    },
-                ],
-                "stream": False,
-            },
-            timeout=120,  # Longer timeout for warmup
-        )
-        
-        if response.status_code == 200:
-            print("✅ Model pre-warmed successfully")
-        else:
-            print(f"⚠️ Model pre-warming failed: {response.status_code}")
+        if not keeper.warm(max_age=keeper.interval or 60, reason="startup"):
+            print("✅ Model already warm (used by another worker)")
     except Exception as e:
         print(f"⚠️ Model pre-warming failed: {e}")
 
-def callback(ch, method, properties, body):
+def process_job(data, attempt=1):
     """
-    Callback function that processes student ID card OCR jobs from the queue
+    Process a single student ID card OCR job.
+
+    Runs on a pool thread, so it must not touch the pika channel. A job
+    with "refresh" set skips the result cache lookup. Returns
+    the final job status when the job is finished (successfully or with a
+    stored error result) and raises when this attempt failed.
     """
+    job_id = data.get('job_id')
+    status = "failed"
+    started = time.perf_counter()
+    JOBS_IN_FLIGHT.inc()
     try:
-        # Parse the message
-        data = json.loads(body)
-        job_id = data.get('job_id')
-        filename = data.get('filename')
-        
-        print(f"Processing student ID card job {job_id} with image {filename}")
-        
-        if not os.path.exists(filename):
-            print(f"Error: Image file not found at {filename}")
-            save_error_result(job_id, "Student ID card image file not found")
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-            return
-        
-        # Perform OCR on the student ID card image
-        ocr_result = process_image_ocr(filename)
-        
-        if ocr_result:
-            # Extract structured data from OCR text
-            result_data = extract_fields(ocr_result)
-            
-            # Add confidence scores for extracted fields
-            result_data["confidence"] = {
-                "nombre": 1.0 if result_data["nombre"] else 0.0,
-                "codigo_estudiante": 1.0 if result_data["codigo_estudiante"] else 0.0,
-                "carrera": 1.0 if result_data["carrera"] else 0.0
-            }
-            
+        with job_context(job_id, model=OLLAMA_MODEL):
+            set_attempt(attempt)
+            status = _process_job(job_id, data.get('filename'), refresh=data.get('refresh', False))
+        return status
+    finally:
+        JOBS_IN_FLIGHT.dec()
+        JOBS_TOTAL.inc(status=status)
+        JOB_SECONDS.observe(time.perf_counter() - started, status=status)
+
+
+def _process_job(job_id, filename, refresh=False):
+
+    print(f"Processing student ID card job {job_id} with image {filename}")
+
+    if not os.path.exists(filename):
+        print(f"Error: Image file not found at {filename}")
+        save_error_result(job_id, "Student ID card image file not found")
+        return "error"
+
+    try:
+        # Reuse the result of an identical image if we already processed it
+        with span("cache_lookup"):
+            key = file_cache_key(filename, model=OLLAMA_MODEL)
+            result_data = None if refresh else result_cache.get(key)
+        if result_data is not None:
+            print(f"Cache hit for job {job_id}")
+            CACHE_LOOKUPS.inc(result="hit")
+            result_data["cached"] = True
+        else:
+            CACHE_LOOKUPS.inc(result="skipped" if refresh else "miss")
+            # OCR the card (cheapest engine first) and extract the fields
+            result_data = recognize_card(filename)
+            # Don't pin a bad read: a retry or a better model may do better
+            if result_data is not None and not needs_escalation(result_data):
+                result_cache.put(key, result_data)
+
+        if result_data is not None:
             # Add metadata to the result
             result_data["job_id"] = job_id
             result_data["status"] = "completado"
             result_data["processed_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
-            
-            # Save result to file
-            result_file = os.path.join(RESULT_FOLDER, f"{job_id}.json")
-            with open(result_file, 'w', encoding='utf-8') as f:
-                json.dump(result_data, f, indent=2, ensure_ascii=False)
+
+            # Save result to file (unless the database is the only copy)
+            with span("result_file_write"):
+                write_result_file(result_data)
 
             # Save result to database
-            save_result_to_db(result_data)  # <-- NEW line
-            
+            with span("db_write"):
+                result_writer.save(result_data)
+
             print(f"Student ID card job {job_id} completed successfully")
+            return "completado"
         else:
-            save_error_result(job_id, "Student ID card OCR processing failed")
             print(f"Job {job_id} failed - OCR processing error")
-            
-        # Acknowledge the message
-        ch.basic_ack(delivery_tag=method.delivery_tag)
-        
+            raise RetryableJobError("Student ID card OCR processing failed")
     except Exception as e:
         print(f"Error processing student ID card: {e}")
+        raise
+
+
+def announce_result(channel, job_id, status):
+    try:
+        publish_result_event(channel, job_id, status)
+    except Exception as e:
+        # Waiting clients fall back to checking the database
+        print(f"Could not publish result event for job {job_id}: {e}")
+
+
+def discard_prepared_payload(body):
+    """Delete the payload a dead job's failed attempts kept next to its upload"""
+    try:
+        filename = json.loads(body).get('filename')
+    except (ValueError, AttributeError):
+        return
+    if not filename:
+        return
+    try:
+        os.remove(filename + PREPARED_PAYLOAD_SUFFIX)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Could not delete the prepared payload of {filename}: {e}")
+
+
+def settle_message(channel, delivery_tag, action, job_id=None, status=None,
+                   body=None, properties=None, attempt=1, error=None, queue=RABBITMQ_QUEUE):
+    """
+    Settle a delivery on the connection thread (pika channels are not
+    thread-safe):
+
+    - "ack": the job finished; announce it to the API and ack.
+    - "retry": republish it to a delay queue of its job queue as the next
+      attempt, then ack.
+    - "dead": the last attempt failed; park it in the dead-letter queue.
+    - "requeue": the attempt failed because Ollama is down; put it back
+      in its queue as it was, without using up an attempt.
+
+    The copy is published before the ack, so a crash in between can only
+    duplicate the job, never lose it.
+    """
+    if not channel.is_open:
+        # The delivery tag died with the channel; the broker will redeliver it
+        print(f"Channel closed, cannot settle delivery {delivery_tag}")
+        return
+    if action == "requeue":
+        channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+        return
+    try:
+        if action == "retry":
+            delay = publish_retry(channel, body, properties, attempt + 1, error, queue=queue)
+            JOB_RETRIES.inc()
+            print(f"Job {job_id} attempt {attempt} failed, retrying in {delay} seconds")
+        elif action == "dead":
+            publish_dead_letter(channel, body, properties, attempt, error)
+            DEAD_LETTERS.inc()
+            discard_prepared_payload(body)
+            print(f"Job {job_id} failed after {attempt} attempt(s), moved to the dead-letter queue")
+    except Exception as e:
+        # Let the broker hand it out again rather than losing the job
+        print(f"Could not reschedule job {job_id}: {e}")
+        channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+        return
+
+    if job_id and action != "retry":
+        announce_result(channel, job_id, status)
+    channel.basic_ack(delivery_tag=delivery_tag)
+
+
+def run_job(connection, channel, delivery_tag, properties, body,
+            queue=RABBITMQ_QUEUE, priority=PRIORITY_INTERACTIVE):
+    """
+    Job thread entry point: process the job and hand the settlement back
+    to the connection thread. A failed attempt is retried through the
+    broker, so this thread moves on to the next job right away.
+    """
+    attempt = get_attempt(properties)
+    job_id = status = error = None
+    try:
+        data = json.loads(body)
+        job_id = data.get('job_id')
+        if attempt == 1 and data.get('enqueued_at'):
+            QUEUE_WAIT_SECONDS.observe(max(0.0, time.time() - data['enqueued_at']), priority=priority)
+    except ValueError as e:
+        # A message that cannot be parsed will never succeed
+        action, error = "dead", f"Invalid message: {e}"
+    else:
         try:
-            if 'job_id' in locals():
-                save_error_result(job_id, str(e))
-        except:
-            pass
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            status = process_job(data, attempt)
+            action = "ack"
+        except Exception as e:
+            error = str(e) or repr(e)
+            if BACKEND_BREAKER.is_open:
+                # Not the job's fault: it waits in the queue for the backend
+                action, status = "requeue", None
+                print(f"Job {job_id} put back in its queue while Ollama is down")
+            elif is_last_attempt(attempt):
+                action, status = "dead", "error"
+                try:
+                    save_error_result(job_id, error)
+                except Exception as save_error:
+                    print(f"Could not save error result for job {job_id}: {save_error}")
+            else:
+                action = "retry"
+
+    try:
+        connection.add_callback_threadsafe(functools.partial(
+            settle_message, channel, delivery_tag, action, job_id, status,
+            body, properties, attempt, error, queue
+        ))
+    except Exception as e:
+        print(f"Could not schedule ack for delivery {delivery_tag}: {e}")
+
+
+def callback(ch, method, properties, body, connection=None, scheduler=None,
+             queue=RABBITMQ_QUEUE, priority=PRIORITY_INTERACTIVE):
+    """
+    Callback function that hands student ID card OCR jobs from the queues
+    to the job threads, through the scheduler (priority and fairness). It
+    returns immediately so the connection thread keeps servicing
+    heartbeats while inference runs.
+    """
+    try:
+        fairness_key = json.loads(body).get('fairness_key')
+    except (ValueError, AttributeError):
+        fairness_key = None
+    scheduler.put(priority, fairness_key,
+                  (connection, ch, method.delivery_tag, properties, body, queue, priority))
+
+
+def job_loop(scheduler):
+    """Job thread: run the jobs the scheduler picks until it is closed"""
+    while True:
+        item = scheduler.get()
+        if item is None:
+            return
+        run_job(*item)
 
 def save_error_result(job_id, error_message):
     """Helper function to save error results"""
-    result_file = os.path.join(RESULT_FOLDER, f"{job_id}.json")
-    with open(result_file, 'w', encoding='utf-8') as f:
-        json.dump({
-            "job_id": job_id,
-            "status": "error",
-            "error": error_message,
-            "processed_at": time.strftime("%Y-%m-%d %H:%M:%S")
-        }, f, indent=2, ensure_ascii=False)
-
-def start_worker():
+    error_data = {
+        "job_id": job_id,
+        "status": "error",
+        "error": error_message,
+        "processed_at": time.strftime("%Y-%m-%d %H:%M:%S")
+    }
+    write_result_file(error_data)
+
+    # Also in the database, so batch progress counts failed jobs
+    result_writer.save(error_data)
+
+def start_worker(concurrency=WORKER_CONCURRENCY):
     """Main function to start the worker"""
-    gpu_status = check_gpu_usage()
+    # GPU usage is sampled periodically as a gauge; the first sample is logged
+    gpu_status = start_gpu_sampler(REGISTRY, GPU_SAMPLE_INTERVAL)
+    WORKER_SLOTS.set(concurrency)
+    SnapshotWriter(REGISTRY, f"worker-{os.getpid()}").start()
     if gpu_status["gpu_available"]:
         print(f"GPU available with {gpu_status['gpu_utilization']}% utilization")
         print(f"GPU memory: {gpu_status['memory_used_mb']}/{gpu_status['memory_total_mb']} MB")
@@ -140,29 +310,133 @@ def start_worker():
         print("Warning: GPU not available, using CPU only")
         print(f"Reason: {gpu_status.get('error', 'Unknown')}")
     
-    # Pre-warm the model before starting
-    warmup_model()
-    
-    while True:
+    # Pre-warm the model before starting, and keep it loaded while idle
+    keeper = ModelKeeper(get_client())
+    warmup_model(keeper)
+    keeper.start(is_idle=lambda: JOBS_IN_FLIGHT.value() == 0)
+
+    scheduler = JobScheduler(PRIORITY_WEIGHTS)
+    REGISTRY.add_collector(lambda: [
+        BUFFERED_JOBS.set(count, priority=priority) for priority, count in scheduler.pending().items()
+    ])
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="ocr-job")
+    for _ in range(concurrency):
+        executor.submit(job_loop, scheduler)
+    # channels: priority -> channel; consumers: (channel, consumer tag)
+    state = {"connection": None, "channels": {}, "consumers": [], "stopping": False}
+
+    def consume():
+        """Start consuming every job queue (connection thread)"""
+        if state["consumers"] or state["stopping"] or BACKEND_BREAKER.is_open:
+            return
+        for queue, priority in JOB_QUEUES.items():
+            channel = state["channels"][priority]
+            consumer_tag = channel.basic_consume(
+                queue=queue,
+                on_message_callback=functools.partial(
+                    callback, connection=state["connection"], scheduler=scheduler,
+                    queue=queue, priority=priority
+                )
+            )
+            state["consumers"].append((channel, consumer_tag))
+
+    def cancel_consumers():
+        """Stop receiving new deliveries (connection thread)"""
+        for channel, consumer_tag in state["consumers"]:
+            if channel.is_open:
+                channel.basic_cancel(consumer_tag)
+        state["consumers"] = []
+
+    def pause():
+        """
+        Circuit open: stop consuming and hand the buffered jobs back to the
+        broker, so they wait in the queue instead of failing here
+        """
+        cancel_consumers()
+        for item in scheduler.drain():
+            channel, delivery_tag = item[1], item[2]
+            if channel.is_open:
+                channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+
+    def on_connection_thread(func):
+        connection = state["connection"]
+        if connection is not None and connection.is_open:
+            connection.add_callback_threadsafe(func)
+
+    BACKEND_BREAKER.add_listener(on_open=lambda: on_connection_thread(pause),
+                                 on_close=lambda: on_connection_thread(consume))
+
+    def request_stop(signum, frame):
+        """SIGTERM: stop taking new jobs and drain the ones in flight"""
+        print("Stop requested, no longer consuming new jobs...")
+        state["stopping"] = True
+        on_connection_thread(cancel_consumers)
+
+    signal.signal(signal.SIGTERM, request_stop)
+
+    while not state["stopping"]:
         try:
             connection = pika.BlockingConnection(pika.ConnectionParameters(
                 host=RABBITMQ_HOST,
                 port=RABBITMQ_PORT
             ))
-            channel = connection.channel()
-            channel.queue_declare(queue=RABBITMQ_QUEUE, durable=True)
-            channel.basic_qos(prefetch_count=1)
-            channel.basic_consume(queue=RABBITMQ_QUEUE, on_message_callback=callback)
-            
-            print("Worker started. Waiting for messages...")
-            channel.start_consuming()
+            # Deliveries buffered for the previous connection will be redelivered
+            scheduler.clear()
+            # Interactive and bulk jobs get separate prefetch windows, so a
+            # backlog of bulk jobs never takes the slots of interactive ones
+            interactive_channel = connection.channel()
+            bulk_channel = connection.channel()
+            state["connection"] = connection
+            state["channels"] = {PRIORITY_INTERACTIVE: interactive_channel, PRIORITY_BULK: bulk_channel}
+            state["consumers"] = []
+            for queue in JOB_QUEUES:
+                interactive_channel.queue_declare(queue=queue, durable=True)
+            declare_retry_queues(interactive_channel, JOB_QUEUES)
+            declare_results_exchange(interactive_channel)
+            interactive_channel.basic_qos(prefetch_count=concurrency)
+            # Shared by all the bulk shard consumers of the channel
+            bulk_channel.basic_qos(prefetch_count=concurrency, global_qos=True)
+            # While the circuit is open, consumption resumes when it closes
+            consume()
+
+            print(f"Worker started with {concurrency} concurrent job(s). Waiting for messages...")
+            # Dispatches the deliveries of both channels, and keeps the
+            # connection alive while consumption is paused
+            while not state["stopping"]:
+                connection.process_data_events(time_limit=1)
         except KeyboardInterrupt:
-            print("Worker stopped.")
-            break
+            state["stopping"] = True
         except Exception as e:
+            if state["stopping"]:
+                break
             print(f"Worker error: {e}")
             print("Reconnecting in 5 seconds...")
             time.sleep(5)
 
+    drain_and_close(executor, scheduler, state["connection"])
+
+
+def drain_and_close(executor, scheduler, connection):
+    """
+    Wait for the in-flight jobs, deliver their acks and close the
+    connection. Buffered jobs that did not start are redelivered by the
+    broker once the connection closes.
+    """
+    print("Worker stopping, waiting for in-flight jobs...")
+    scheduler.close()
+    executor.shutdown(wait=True)
+    # Flush the acks queued by the finished jobs before closing
+    try:
+        if connection and connection.is_open:
+            connection.process_data_events(time_limit=0)
+            connection.close()
+    except Exception:
+        pass
+    print("Worker stopped.")
+
 if __name__ == "__main__":
-    start_worker()
+    parser = argparse.ArgumentParser(description="Worker OCR para carnés estudiantiles")
+    parser.add_argument('--concurrency', type=int, default=WORKER_CONCURRENCY,
+                        help="Número de trabajos OCR procesados en paralelo")
+    args = parser.parse_args()
+    start_worker(max(1, args.concurrency))
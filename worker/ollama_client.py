@@ -0,0 +1,421 @@
+import re
+import json
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from shared.config import (
+    OLLAMA_API_URL, OLLAMA_MODEL, OLLAMA_PARAMETERS, OLLAMA_TIMEOUT,
+    OLLAMA_STREAM, OLLAMA_POOL_SIZE, OLLAMA_KEEP_ALIVE, COLD_START_THRESHOLD_MS,
+    OLLAMA_API_URLS, OLLAMA_HEALTH_INTERVAL, OLLAMA_EJECT_AFTER_FAILURES, OLLAMA_EJECT_SECONDS
+)
+from shared.metrics import REGISTRY
+
+LOAD_SECONDS = REGISTRY.histogram('ocr_ollama_load_duration_seconds', 'Model load time reported by Ollama')
+FIRST_TOKEN_SECONDS = REGISTRY.histogram('ocr_ollama_first_token_seconds', 'Time until the first streamed token')
+COLD_STARTS = REGISTRY.counter('ocr_model_cold_starts_total', 'Requests that had to wait for the model to load')
+GENERATED_TOKENS = REGISTRY.histogram('ocr_ollama_generated_tokens', 'Tokens generated per answer (eval_count)',
+                                      buckets=(16, 32, 64, 128, 256, 512, 1024, 2048))
+TRUNCATED_ANSWERS = REGISTRY.counter('ocr_ollama_truncated_total', 'Answers cut off by the num_predict limit')
+NODE_REQUEST_SECONDS = REGISTRY.histogram('ocr_ollama_node_request_seconds', 'Chat request time per Ollama server and outcome')
+NODE_OUTSTANDING = REGISTRY.gauge('ocr_ollama_node_outstanding', 'Requests in flight per Ollama server')
+NODE_UP = REGISTRY.gauge('ocr_ollama_node_up', '1 while the Ollama server is in rotation')
+NODE_EJECTIONS = REGISTRY.counter('ocr_ollama_node_ejections_total', 'Times an Ollama server was taken out of rotation')
+
+# Seconds a health probe may take
+HEALTH_PROBE_TIMEOUT = 5
+
+# A labelled field counts as emitted once its line is terminated by a newline
+FIELD_LINE_PATTERNS = [
+    re.compile(r"^[\s*]*" + label + r"[\s*]*:[^\n]*\S[^\n]*\n", re.IGNORECASE | re.MULTILINE)
+    for label in ("nombre", "c[oó]digo", "carrera", "instituci[oó]n")
+]
+
+
+# Stands in for the image list while the rest of the request is serialized
+IMAGES_PLACEHOLDER = '__ocr_images__'
+
+
+class OllamaError(Exception):
+    """Raised when the Ollama API answers with an error"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def all_fields_emitted(text):
+    """True when the four labelled fields (Nombre, Código, Carrera, Institución) are complete"""
+    return all(pattern.search(text) for pattern in FIELD_LINE_PATTERNS)
+
+
+def encode_chat_body(payload, images=None):
+    """
+    Serialize a chat request. The base64 images (str or bytes-like, e.g. a
+    mmap of a prepared payload) are spliced into the JSON as raw bytes
+    instead of going through json.dumps, which would copy each image
+    several more times.
+    """
+    if not images:
+        return json.dumps(payload).encode('utf-8')
+
+    payload["messages"][-1]["images"] = IMAGES_PLACEHOLDER
+    head, tail = json.dumps(payload).encode('utf-8').split(f'"{IMAGES_PLACEHOLDER}"'.encode('utf-8'), 1)
+    del payload["messages"][-1]["images"]
+
+    parts = [head, b'[']
+    for i, image in enumerate(images):
+        if isinstance(image, str):
+            image = image.encode('ascii')
+        parts.extend((b',"' if i else b'"', image, b'"'))
+    parts.extend((b']', tail))
+    return b''.join(parts)
+
+
+class OllamaClient:
+    """
+    Thin client for Ollama's /api/chat endpoint.
+
+    Uses a single requests.Session with a keep-alive connection pool, so
+    concurrent jobs reuse TCP connections instead of opening one per call.
+    """
+
+    def __init__(self, api_url=OLLAMA_API_URL, model=OLLAMA_MODEL,
+                 pool_size=OLLAMA_POOL_SIZE, timeout=OLLAMA_TIMEOUT,
+                 keep_alive=OLLAMA_KEEP_ALIVE):
+        self.api_url = api_url.rstrip('/')
+        self.model = model
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        # time.time() of the last successful request from this process
+        self.last_used = 0.0
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @property
+    def chat_url(self):
+        return f"{self.api_url}/chat"
+
+    def chat(self, prompt, images=None, stream=OLLAMA_STREAM,
+             stop_when_fields_complete=False, timeout=None, **params):
+        """
+        Send a single user message and return the generated text.
+
+        With stream=True the NDJSON chunks are parsed as they arrive. If
+        stop_when_fields_complete is set, the response is closed as soon as
+        the four labelled card fields have been generated, which makes
+        Ollama stop generating any further tokens. Extra params (format,
+        options...) go to the request; options are merged with those of
+        OLLAMA_PARAMETERS.
+        """
+        message = {"role": "user", "content": prompt}
+        options = {**OLLAMA_PARAMETERS.get("options", {}), **params.pop("options", {})}
+        payload = {
+            "model": self.model,
+            "messages": [message],
+            "stream": stream,
+            **self._keep_alive(),
+            **OLLAMA_PARAMETERS,
+            **params,
+        }
+        if options:
+            payload["options"] = options
+
+        started = time.perf_counter()
+        response = self.session.post(
+            self.chat_url,
+            data=encode_chat_body(payload, images),
+            headers={"Content-Type": "application/json"},
+            timeout=timeout or self.timeout,
+            stream=stream,
+        )
+
+        try:
+            if response.status_code != 200:
+                raise OllamaError(f"Error from Ollama API: {response.status_code} - {response.text}",
+                                  response.status_code)
+
+            if not stream:
+                data = response.json()
+                self._record_done(data)
+                text = data.get("message", {}).get("content", "")
+            else:
+                text = self._read_stream(response, stop_when_fields_complete, started)
+            self.last_used = time.time()
+            return text
+        finally:
+            response.close()
+
+    def load_model(self, timeout=None):
+        """
+        Load the model (or extend its keep_alive) without generating
+        anything: a chat request with no messages. Returns the load time
+        in seconds reported by Ollama, 0.0 when it was already loaded.
+        """
+        response = self.session.post(
+            self.chat_url,
+            json={"model": self.model, "messages": [], "stream": False, **self._keep_alive()},
+            timeout=timeout or self.timeout,
+        )
+        try:
+            if response.status_code != 200:
+                raise OllamaError(f"Error from Ollama API: {response.status_code} - {response.text}",
+                                  response.status_code)
+            data = response.json()
+        finally:
+            response.close()
+        self.last_used = time.time()
+        # Loads done ahead of time are the point, not a cold start
+        return self._record_load(data, cold_start=False)
+
+    def ping(self, timeout=HEALTH_PROBE_TIMEOUT):
+        """True when the server answers and has the model"""
+        try:
+            response = self.session.get(f"{self.api_url}/tags", timeout=timeout)
+            try:
+                if response.status_code != 200:
+                    return False
+                names = {model.get("name") for model in response.json().get("models", [])}
+            finally:
+                response.close()
+        except (requests.RequestException, ValueError):
+            return False
+        return self.model in names or f"{self.model}:latest" in names
+
+    def _keep_alive(self):
+        return {"keep_alive": self.keep_alive} if self.keep_alive else {}
+
+    def _record_done(self, data):
+        """Record the stats Ollama sends with the end of an answer"""
+        self._record_load(data)
+        if data.get("eval_count") is not None:
+            GENERATED_TOKENS.observe(data["eval_count"], model=self.model)
+        if data.get("done_reason") == "length":
+            TRUNCATED_ANSWERS.inc(model=self.model)
+
+    def _record_load(self, data, cold_start=True):
+        """Record the load_duration (ns) Ollama reports with finished answers"""
+        load_seconds = (data.get("load_duration") or 0) / 1e9
+        if data.get("load_duration") is not None:
+            LOAD_SECONDS.observe(load_seconds, model=self.model)
+        if cold_start and load_seconds * 1000 >= COLD_START_THRESHOLD_MS:
+            print(f"Cold start: {self.model} took {load_seconds:.1f}s to load")
+            COLD_STARTS.inc(model=self.model, detected_by="load_duration")
+        return load_seconds
+
+    def _read_stream(self, response, stop_when_fields_complete, started):
+        parts = []
+        first_token = True
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if chunk.get("error"):
+                raise OllamaError(chunk["error"])
+
+            if first_token:
+                first_token = False
+                waited = time.perf_counter() - started
+                FIRST_TOKEN_SECONDS.observe(waited, model=self.model)
+
+            parts.append(chunk.get("message", {}).get("content", ""))
+            if chunk.get("done"):
+                self._record_done(chunk)
+                break
+
+            if stop_when_fields_complete and all_fields_emitted("".join(parts)):
+                # Everything we need is here; closing the response aborts
+                # generation. The final chunk (with load_duration) never
+                # comes, so a very slow first token stands in for it.
+                if waited * 1000 >= COLD_START_THRESHOLD_MS:
+                    COLD_STARTS.inc(model=self.model, detected_by="first_token")
+                break
+
+        return "".join(parts)
+
+
+class OllamaNode:
+    """One server of an OllamaPool and its routing state"""
+
+    def __init__(self, client):
+        self.client = client
+        self.name = client.api_url
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0  # consecutive
+        self.ejected_until = None  # time.monotonic() deadline while out of rotation
+        self.latency = None  # moving average of successful requests, seconds
+
+    @property
+    def in_rotation(self):
+        return self.ejected_until is None
+
+
+class OllamaPool:
+    """
+    Spreads chat requests over several Ollama servers, with the same
+    interface as OllamaClient.
+
+    Each request goes to the server in rotation with the fewest requests
+    outstanding (ties: the lowest recent latency). A server that fails
+    eject_after requests in a row, or a health probe, leaves the rotation;
+    the first successful probe after eject_seconds brings it back. Without
+    health probes (health_interval 0) the node comes back on probation once
+    eject_seconds have passed: its next request routes normally and a
+    single failure ejects it again. A
+    request that could not reach its server (connection refused, 5xx) is
+    tried on another one. With every server ejected, requests still go
+    out rather than failing outright.
+    """
+
+    def __init__(self, api_urls=OLLAMA_API_URLS, model=OLLAMA_MODEL,
+                 health_interval=OLLAMA_HEALTH_INTERVAL, eject_after=OLLAMA_EJECT_AFTER_FAILURES,
+                 eject_seconds=OLLAMA_EJECT_SECONDS):
+        self.model = model
+        self.eject_after = max(1, eject_after)
+        self.eject_seconds = eject_seconds
+        self.health_interval = health_interval
+        self.nodes = [OllamaNode(OllamaClient(api_url=url, model=model)) for url in api_urls]
+        self._lock = threading.Lock()
+        for node in self.nodes:
+            NODE_UP.set(1, node=node.name)
+        if health_interval > 0:
+            threading.Thread(target=self._health_loop, args=(health_interval,),
+                             name="ollama-health", daemon=True).start()
+
+    @property
+    def last_used(self):
+        return max(node.client.last_used for node in self.nodes)
+
+    def _acquire(self, exclude=()):
+        with self._lock:
+            if self.health_interval <= 0:
+                now = time.monotonic()
+                for node in self.nodes:
+                    if not node.in_rotation and now >= node.ejected_until:
+                        self._readmit(node, "ejection expired, on probation")
+                        node.failures = self.eject_after - 1
+            candidates = [node for node in self.nodes if node not in exclude]
+            candidates = [node for node in candidates if node.in_rotation] or candidates
+            node = min(candidates, key=lambda node: (node.outstanding, node.latency or 0.0))
+            node.outstanding += 1
+            NODE_OUTSTANDING.set(node.outstanding, node=node.name)
+        return node
+
+    def _release(self, node, seconds, failed):
+        with self._lock:
+            node.outstanding -= 1
+            node.requests += 1
+            NODE_OUTSTANDING.set(node.outstanding, node=node.name)
+            if failed:
+                node.failures += 1
+                if node.in_rotation and node.failures >= self.eject_after:
+                    self._eject(node, f"{node.failures} failed requests in a row")
+            else:
+                node.failures = 0
+                node.latency = seconds if node.latency is None else 0.8 * node.latency + 0.2 * seconds
+        NODE_REQUEST_SECONDS.observe(seconds, node=node.name, outcome="error" if failed else "ok")
+
+    def _eject(self, node, reason):
+        """Take a node out of rotation (called with the lock held)"""
+        node.ejected_until = time.monotonic() + self.eject_seconds
+        NODE_UP.set(0, node=node.name)
+        NODE_EJECTIONS.inc(node=node.name)
+        print(f"⚠️ Ollama server {node.name} out of rotation: {reason}")
+
+    def _readmit(self, node, reason):
+        """Put an ejected node back in rotation (called with the lock held)"""
+        node.ejected_until = None
+        node.failures = 0
+        NODE_UP.set(1, node=node.name)
+        print(f"✅ Ollama server {node.name} back in rotation: {reason}")
+
+    def chat(self, prompt, images=None, **kwargs):
+        tried = []
+        while True:
+            node = self._acquire(exclude=tried)
+            started = time.perf_counter()
+            try:
+                text = node.client.chat(prompt, images=images, **kwargs)
+            except Exception as e:
+                self._release(node, time.perf_counter() - started, failed=True)
+                tried.append(node)
+                unreachable = isinstance(e, requests.ConnectionError) or (
+                    isinstance(e, OllamaError) and (e.status_code or 0) >= 500
+                )
+                if not unreachable or len(tried) == len(self.nodes):
+                    raise
+                print(f"Ollama server {node.name} failed ({e}), trying another one")
+                continue
+            self._release(node, time.perf_counter() - started, failed=False)
+            return text
+
+    def load_model(self, timeout=None):
+        """Load the model on every server in rotation; returns the longest load time"""
+        loads = []
+        error = None
+        for node in self.nodes:
+            if not node.in_rotation:
+                continue
+            try:
+                loads.append(node.client.load_model(timeout))
+            except Exception as e:
+                print(f"Could not load the model on {node.name}: {e}")
+                error = e
+        if not loads and error is not None:
+            raise error
+        return max(loads, default=0.0)
+
+    def ping(self):
+        """True when at least one server answers and has the model"""
+        return any(node.client.ping() for node in self.nodes)
+
+    def _health_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            for node in self.nodes:
+                healthy = node.client.ping()
+                with self._lock:
+                    if not healthy:
+                        if node.in_rotation:
+                            self._eject(node, "health probe failed")
+                        else:
+                            node.ejected_until = time.monotonic() + self.eject_seconds
+                    elif not node.in_rotation and time.monotonic() >= node.ejected_until:
+                        self._readmit(node, "health probe passed")
+
+    def stats(self):
+        """Routing state and latency of each server"""
+        with self._lock:
+            return [{
+                "node": node.name,
+                "in_rotation": node.in_rotation,
+                "outstanding": node.outstanding,
+                "requests": node.requests,
+                "consecutive_failures": node.failures,
+                "latency_ms": round(node.latency * 1000, 1) if node.latency is not None else None,
+            } for node in self.nodes]
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide Ollama client (a pool with several OLLAMA_API_URLS)"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            if len(OLLAMA_API_URLS) > 1:
+                _client = OllamaPool()
+                print(f"Ollama servers: {', '.join(OLLAMA_API_URLS)}")
+            else:
+                _client = OllamaClient(api_url=OLLAMA_API_URLS[0] if OLLAMA_API_URLS else OLLAMA_API_URL)
+        return _client